@@ -0,0 +1,100 @@
+"""
+Streaming Export Benchmark
+==========================
+
+Measures the peak memory used to export a large collection with the
+streaming CSV, NDJSON, and JSON encoders compared to materializing the
+whole collection first.
+
+Run with `python benchmarks/export.py [rows] [batch_size]` (Python 3 and
+SQLAlchemy must be installed). Rows are inserted into an in-memory SQLite
+database and memory is measured with `tracemalloc`, so only allocations
+made by Python are counted (not those made by SQLite itself).
+
+"""
+import sys
+import time
+import tracemalloc
+
+from pyramid.testing import DummyRequest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import Column
+from sqlalchemy.types import Integer, String
+
+from pyramid_restler.model import SQLAlchemyORMContext
+
+
+Base = declarative_base()
+
+
+class Row(Base):
+
+    __tablename__ = 'row'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String)
+
+
+class Context(SQLAlchemyORMContext):
+
+    entity = Row
+
+
+def measure(export):
+    tracemalloc.start()
+    start = time.time()
+    try:
+        size = export()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return size, peak, time.time() - start
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000000
+    batch_size = int(argv[2]) if len(argv) > 2 else 1000
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(bind=engine)
+    session = Session(bind=engine)
+    session.execute(
+        text(
+            'WITH RECURSIVE c(x) AS ('
+            'SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < :n) '
+            "INSERT INTO row (id, value) SELECT x, 'row ' || x FROM c"),
+        {'n': n})
+    session.commit()
+    request = DummyRequest()
+    request.db_session = session
+    context = Context(request)
+    context.stream_batch_size = batch_size
+    fields = ['id', 'value']
+
+    def stream(method):
+        def export():
+            query = context.get_collection_query(fields=fields)
+            return sum(len(chunk) for chunk in method(query, fields))
+        return export
+
+    def materialize():
+        collection = context.get_collection(fields=fields)
+        return len(context.to_json(collection, fields))
+
+    print('{0} rows, batches of {1}'.format(n, batch_size))
+    exports = (
+        ('csv (streamed)', stream(context.to_csv_iter)),
+        ('ndjson (streamed)', stream(context.to_ndjson_iter)),
+        ('json (streamed)', stream(context.to_json_iter)),
+        ('json (materialized)', materialize),
+    )
+    for name, export in exports:
+        size, peak, elapsed = measure(export)
+        print('{0:<20} {1:>8.1f} MB output {2:>8.1f} MB peak {3:>6.2f}s'
+              .format(name, size / 1e6, peak / 1e6, elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,124 @@
+"""
+Offloaded Encoding Benchmark
+============================
+
+Finds the collection size at which encoding JSON in a `concurrent.futures`
+pool (via `SQLAlchemyORMContext.encode_executor`) starts to pay off
+compared to encoding in the calling thread.
+
+Run with `python benchmarks/offload.py [max_rows] [workers] [backend]`
+(Python 3 and SQLAlchemy must be installed). Rows are built in memory so
+that only serialization and encoding are timed. The results depend
+heavily on the JSON backend, the number of cores, and the shape of the
+rows, so rerun this on production hardware before picking
+`encode_threshold`.
+
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
+import decimal
+import json
+import sys
+import time
+
+from pyramid.testing import DummyRequest
+
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import Column
+from sqlalchemy.types import DateTime, Integer, Numeric, String
+
+from pyramid_restler.jsonlib import get_json_backend
+from pyramid_restler.model import SQLAlchemyORMContext
+
+
+Base = declarative_base()
+
+
+class Row(Base):
+
+    __tablename__ = 'row'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    description = Column(String)
+    amount = Column(Numeric(10, 2))
+    quantity = Column(Integer)
+    created = Column(DateTime)
+    updated = Column(DateTime)
+
+
+class Context(SQLAlchemyORMContext):
+
+    entity = Row
+
+    encode_threshold = 0
+
+
+def make_rows(n):
+    now = datetime.datetime(2013, 4, 3, 12, 0, 0)
+    return [
+        Row(id=i, name='Row {0}'.format(i), description='Description',
+            amount=decimal.Decimal('{0}.50'.format(i)), quantity=i % 100,
+            created=now, updated=now)
+        for i in range(n)
+    ]
+
+
+def best_of(context, rows, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        context.to_json(rows)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    max_rows = int(argv[1]) if len(argv) > 1 else 200000
+    workers = int(argv[2]) if len(argv) > 2 else 4
+    backend = argv[3] if len(argv) > 3 else 'auto'
+    context = Context(DummyRequest())
+    context.json_backend = get_json_backend(backend)
+    print('JSON backend: {0}; workers: {1}'.format(
+        context.json_backend.name, workers))
+    print('{0:>8}  {1:>8}  {2:>8}  {3:>8}'.format(
+        'rows', 'inline', 'threads', 'procs'))
+    executors = [
+        ('threads', ThreadPoolExecutor(workers)),
+        ('procs', ProcessPoolExecutor(workers)),
+    ]
+    crossover = {}
+    n = 1000
+    while n <= max_rows:
+        rows = make_rows(n)
+        context.encode_executor = None
+        context.encode_chunk_size = n
+        expected = json.loads(context.to_json(rows[:10]).decode('utf-8'))
+        inline = best_of(context, rows)
+        times = []
+        for name, executor in executors:
+            context.encode_executor = executor
+            context.encode_chunk_size = max(1, n // workers)
+            result = json.loads(context.to_json(rows[:10]).decode('utf-8'))
+            assert result == expected
+            elapsed = best_of(context, rows)
+            # The crossover is the size from which offloading consistently
+            # wins by a clear margin (so timing noise isn't reported).
+            if elapsed < inline * 0.9:
+                crossover.setdefault(name, n)
+            else:
+                crossover.pop(name, None)
+            times.append(elapsed)
+        print('{0:>8}  {1:>7.3f}s  {2:>7.3f}s  {3:>7.3f}s'.format(
+            n, inline, *times))
+        n *= 2
+    for name, executor in executors:
+        executor.shutdown()
+        if name in crossover:
+            print('{0} pay off at ~{1} rows'.format(name, crossover[name]))
+        else:
+            print('{0} never paid off'.format(name))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
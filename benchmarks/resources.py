@@ -0,0 +1,90 @@
+"""
+Resource Configuration Benchmark
+================================
+
+Compares three ways of configuring many entities:
+
+- routes: `add_restful_routes` per entity (a route per method)
+- single: `add_restful_routes(..., single_route=True)` per entity
+- resources: one `add_restful_resources` call for all entities
+
+For each entity count, the time to configure and commit (i.e., to make
+the WSGI app) and the latency of a request for the last entity are
+reported.
+
+Run with `python benchmarks/resources.py [max_entities] [requests]`.
+
+"""
+import sys
+import time
+
+from pyramid.config import Configurator
+from pyramid.response import Response
+
+from webob.request import Request
+
+
+class Context(object):
+
+    def __init__(self, request):
+        self.request = request
+
+
+class View(object):
+
+    def __init__(self, context, request):
+        self.request = request
+
+    def __getattr__(self, name):
+        return lambda: Response(b'{}', content_type='application/json')
+
+
+def make_app(mode, entity_count):
+    config = Configurator()
+    config.include('pyramid_restler')
+    names = ['entity_{0}'.format(i) for i in range(entity_count)]
+    if mode == 'resources':
+        config.add_restful_resources(
+            [(name, Context) for name in names], prefix='/api', view=View,
+            batch=True)
+    else:
+        for name in names:
+            config.add_restful_routes(
+                name, Context, view=View, batch=True,
+                single_route=(mode == 'single'))
+    return config.make_wsgi_app()
+
+
+def time_request(app, path, n):
+    requests = [Request.blank(path) for _ in range(n)]
+    start = time.time()
+    for request in requests:
+        response = request.get_response(app)
+    elapsed = time.time() - start
+    assert response.status_int == 200, (path, response.status)
+    return elapsed / n * 1e6
+
+
+def main(argv):
+    max_entities = int(argv[1]) if len(argv) > 1 else 810
+    n = int(argv[2]) if len(argv) > 2 else 1000
+    modes = ('routes', 'single', 'resources')
+    print('{0:>8}  {1:<10}  {2:>12}  {3:>12}'.format(
+        'entities', 'mode', 'configure', 'request'))
+    entity_count = 10
+    while entity_count <= max_entities:
+        for mode in modes:
+            start = time.time()
+            app = make_app(mode, entity_count)
+            configure_time = time.time() - start
+            path = '/entity-{0}/1'.format(entity_count - 1)
+            if mode == 'resources':
+                path = '/api' + path
+            request_time = time_request(app, path, n)
+            print('{0:>8}  {1:<10}  {2:>10.1f}ms  {3:>10.1f}us'.format(
+                entity_count, mode, configure_time * 1000, request_time))
+        entity_count *= 3
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,86 @@
+"""
+Routing Latency Benchmark
+=========================
+
+Measures how request latency grows with the number of entities when
+`add_restful_routes` adds a route per method (the default) compared to a
+single route per entity (``single_route=True``).
+
+Pyramid tries routes one at a time in the order they were added, so the
+last entity's routes are the slowest to reach; both the first and last
+entity are timed. The view doesn't do any work, so the timings are
+dominated by routing.
+
+Run with `python benchmarks/routing.py [requests] [max_entities]`.
+
+"""
+import sys
+import time
+
+from pyramid.config import Configurator
+from pyramid.response import Response
+
+from webob.request import Request
+
+
+class Context(object):
+
+    def __init__(self, request):
+        self.request = request
+
+
+class View(object):
+
+    def __init__(self, context, request):
+        self.request = request
+
+    def __getattr__(self, name):
+        return lambda: Response(b'{}', content_type='application/json')
+
+
+def make_app(entity_count, single_route):
+    config = Configurator()
+    config.include('pyramid_restler')
+    for i in range(entity_count):
+        config.add_restful_routes(
+            'entity_{0}'.format(i), Context, view=View, batch=True,
+            single_route=single_route)
+    return config.make_wsgi_app()
+
+
+def best_of(app, path, method, n, repeat=3):
+    times = []
+    for _ in range(repeat):
+        requests = [Request.blank(path, method=method) for _ in range(n)]
+        start = time.time()
+        for request in requests:
+            response = request.get_response(app)
+        times.append(time.time() - start)
+        assert response.status_int == 200, (path, response.status)
+    return min(times) / n * 1e6
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 1000
+    max_entities = int(argv[2]) if len(argv) > 2 else 500
+    print('{0:>8}  {1:<10}  {2:>12}  {3:>12}  {4:>12}'.format(
+        'entities', 'request', 'first', 'last', 'last single'))
+    entity_count = 10
+    while entity_count <= max_entities:
+        apps = [make_app(entity_count, s) for s in (False, True)]
+        for method in ('GET', 'PUT'):
+            path = '/entity-{0}/1'
+            times = [
+                best_of(apps[0], path.format(0), method, n),
+                best_of(apps[0], path.format(entity_count - 1), method, n),
+                best_of(apps[1], path.format(entity_count - 1), method, n),
+            ]
+            print(
+                '{0:>8}  {1:<10}  {2:>10.1f}us  {3:>10.1f}us  {4:>10.1f}us'
+                .format(entity_count, method, *times))
+        entity_count *= 3
+    print('first and last use a route per method')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,89 @@
+"""
+Member Serializer Benchmark
+===========================
+
+Compares the compiled member serializers used by `SQLAlchemyORMContext`
+against the previous approach of building each member dict with `getattr`
+and leaving decimals and datetimes to `DefaultJSONEncoder.default`.
+
+Run with `python benchmarks/serializers.py [num_rows]` (SQLAlchemy must be
+installed). Rows are built in memory so that only serialization is timed.
+
+"""
+import datetime
+import decimal
+import json
+import sys
+import time
+
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import Column
+from sqlalchemy.types import DateTime, Integer, Numeric, String
+
+from pyramid_restler.model import DefaultJSONEncoder, get_member_serializer
+
+
+Base = declarative_base()
+
+
+class Row(Base):
+
+    __tablename__ = 'row'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    description = Column(String)
+    amount = Column(Numeric(10, 2))
+    quantity = Column(Integer)
+    created = Column(DateTime)
+    updated = Column(DateTime)
+
+
+FIELDS = ('amount', 'created', 'description', 'id', 'name', 'quantity',
+          'updated')
+
+
+def make_rows(n):
+    now = datetime.datetime(2013, 4, 3, 12, 0, 0)
+    return [
+        Row(id=i, name='Row {0}'.format(i), description='Description',
+            amount=decimal.Decimal('{0}.50'.format(i)), quantity=i % 100,
+            created=now, updated=now)
+        for i in range(n)
+    ]
+
+
+def legacy(rows):
+    obj = [dict((name, getattr(m, name)) for name in FIELDS) for m in rows]
+    return json.dumps(obj, cls=DefaultJSONEncoder)
+
+
+def compiled(rows):
+    serialize = get_member_serializer(Row, FIELDS)
+    obj = [serialize(m) for m in rows]
+    return json.dumps(obj, cls=DefaultJSONEncoder)
+
+
+def best_of(func, rows, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func(rows)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    rows = make_rows(n)
+    assert json.loads(legacy(rows[:10])) == json.loads(compiled(rows[:10]))
+    legacy_time = best_of(legacy, rows)
+    compiled_time = best_of(compiled, rows)
+    print('Serializing {0} rows (best of 3):'.format(n))
+    print('    legacy:   {0:.3f}s'.format(legacy_time))
+    print('    compiled: {0:.3f}s ({1:.2f}x)'.format(
+        compiled_time, legacy_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,100 @@
+"""
+POST Tunneling Overhead Benchmark
+=================================
+
+Measures the overhead POST tunneling adds to requests that *don't* tunnel
+a method. Three apps with the same RESTful routes are compared:
+
+- none: tunneling isn't enabled
+- subscriber: the method override is checked by a `NewRequest` subscriber
+  on every request (how tunneling used to be implemented)
+- predicate: tunneling is enabled via `config.enable_POST_tunneling`, which
+  uses the ``tunneled_method`` route predicate
+
+Run with `python benchmarks/tunneling.py [requests]`. The view doesn't
+touch the database, so the timings are dominated by routing.
+
+"""
+import sys
+import time
+
+from pyramid.config import Configurator
+from pyramid.events import NewRequest
+from pyramid.response import Response
+
+from webob.request import Request
+
+
+class Context(object):
+
+    def __init__(self, request):
+        self.request = request
+
+
+class View(object):
+
+    def __init__(self, context, request):
+        self.request = request
+
+    def __getattr__(self, name):
+        return lambda: Response(b'{}', content_type='application/json')
+
+
+def legacy_tunneling_subscriber(event):
+    request = event.request
+    if request.method == 'POST':
+        method = request.GET.pop('$method', None)
+        if method is None:
+            method = request.POST.pop('$method', None)
+        if method is None:
+            method = request.headers.pop('X-HTTP-Method-Override', None)
+        if method is not None:
+            request.method = method.upper()
+
+
+def make_app(tunneling):
+    config = Configurator()
+    config.include('pyramid_restler')
+    if tunneling == 'subscriber':
+        config.add_subscriber(legacy_tunneling_subscriber, NewRequest)
+    elif tunneling == 'predicate':
+        config.enable_POST_tunneling()
+    config.add_restful_routes('thing', Context, view=View)
+    return config.make_wsgi_app()
+
+
+def make_requests():
+    return [
+        ('GET /thing/1', lambda: Request.blank('/thing/1')),
+        ('POST /thing', lambda: Request.blank(
+            '/thing', method='POST', POST={'name': 'x', 'val': 'y'})),
+        ('PUT /thing/1', lambda: Request.blank(
+            '/thing/1', method='PUT', body=b'{"name": "x"}',
+            content_type='application/json')),
+    ]
+
+
+def best_of(app, make_request, n, repeat=3):
+    times = []
+    for _ in range(repeat):
+        requests = [make_request() for _ in range(n)]
+        start = time.time()
+        for request in requests:
+            request.get_response(app)
+        times.append(time.time() - start)
+    return min(times) / n * 1e6
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 5000
+    modes = ('none', 'subscriber', 'predicate')
+    apps = [make_app(mode) for mode in modes]
+    print('{0:<14}  {1:>10}  {2:>10}  {3:>10}'.format('request', *modes))
+    for name, make_request in make_requests():
+        times = [best_of(app, make_request, n) for app in apps]
+        print('{0:<14}  {1:>8.1f}us  {2:>8.1f}us  {3:>8.1f}us'.format(
+            name, *times))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
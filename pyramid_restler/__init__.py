@@ -1,6 +1,40 @@
-from pyramid_restler.config import add_restful_routes, enable_POST_tunneling
+from pyramid.tweens import EXCVIEW
+
+from pyramid_restler.cache import response_cache_from_settings
+from pyramid_restler.config import (
+    add_restful_resources,
+    add_restful_routes,
+    enable_POST_tunneling,
+    set_restful_json_backend,
+    set_restful_response_cache,
+)
+from pyramid_restler.dispatch import (
+    ResourcePredicate, TunneledMethodPredicate)
 
 
 def includeme(config):
     config.add_directive('add_restful_routes', add_restful_routes)
+    config.add_directive('add_restful_resources', add_restful_resources)
     config.add_directive('enable_POST_tunneling', enable_POST_tunneling)
+    config.add_directive(
+        'set_restful_json_backend', set_restful_json_backend)
+    config.add_directive(
+        'set_restful_response_cache', set_restful_response_cache)
+    config.add_route_predicate('tunneled_method', TunneledMethodPredicate)
+    config.add_route_predicate('restful_resources', ResourcePredicate)
+    config.add_tween(
+        'pyramid_restler.tweens.deferred_commit_tween_factory',
+        under=EXCVIEW)
+    settings = config.get_settings() or {}
+    config.set_restful_json_backend(
+        settings.get('restler.json_backend', 'json'))
+    response_cache = response_cache_from_settings(settings)
+    if response_cache is not None:
+        config.set_restful_response_cache(response_cache)
+    try:
+        from pyramid_restler.model import clear_field_plans
+    except ImportError:  # SQLAlchemy isn't installed
+        pass
+    else:
+        # Don't carry field plans over from a previous configuration
+        clear_field_plans()
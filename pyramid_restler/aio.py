@@ -0,0 +1,426 @@
+"""asyncio variants of :class:`SQLAlchemyORMContext` and :class:`RESTfulView`.
+
+These require Python 3 and SQLAlchemy 1.4+ with an async driver (e.g.,
+asyncpg or aiosqlite).
+
+"""
+import asyncio
+import functools
+import queue
+import threading
+
+from pyramid.decorator import reify
+from pyramid.httpexceptions import (
+    HTTPBadRequest, HTTPConflict, HTTPNotFound, HTTPPreconditionFailed)
+from pyramid.response import Response
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pyramid_restler.exceptions import (
+    IntegrityConflict, InvalidQuery, VersionConflict)
+from pyramid_restler.model import (
+    SQLAlchemyORMContext, add_after_commit_callback)
+from pyramid_restler.view import RESTfulView
+
+
+class AsyncSQLAlchemyORMContext(SQLAlchemyORMContext):
+    """Adapts a SQLAlchemy ORM class for use with an `AsyncSession`.
+
+    The `IContext` methods are coroutines. Each one runs the corresponding
+    :class:`SQLAlchemyORMContext` method via `AsyncSession.run_sync`, so
+    queries are built exactly as they are for the synchronous context
+    (filters, cursors, counts, embedding, etc all work the same way), but
+    I/O is done by the async driver without blocking a thread.
+
+    :meth:`session_factory` must return an `AsyncSession`; by default, it
+    returns ``request.db_session``.
+
+    Since members are serialized after the session's greenlet has exited,
+    relationships must be loaded eagerly (see :attr:`embeddable`) rather
+    than lazily, and collections can't be streamed. For the same reason,
+    the 'deferred' :attr:`commit_strategy` isn't supported. Since an
+    `AsyncSession` has to be closed by awaiting it, :attr:`sessionmaker`
+    isn't supported either. A `ValueError` is raised on construction if
+    either is set.
+
+    """
+
+    @reify
+    def async_session(self):
+        session = self.session_factory()
+        if not isinstance(session, AsyncSession):
+            raise TypeError('Expected an AsyncSession: {0!r}'.format(session))
+        return session
+
+    sync_methods = (
+        'get_collection', 'get_member', 'create_member', 'update_member',
+        'patch_member', 'delete_member', 'create_members', 'update_members',
+        'delete_members',
+    )
+
+    def __init__(self, request):
+        if self.commit_strategy == 'deferred':
+            raise ValueError(
+                "The 'deferred' commit strategy isn't supported with an "
+                "AsyncSession")
+        if self.sessionmaker is not None:
+            raise ValueError(
+                "sessionmaker isn't supported with an AsyncSession")
+        super(AsyncSQLAlchemyORMContext, self).__init__(request)
+
+    #: Attributes copied back from the sync helper after each call, so
+    #: the results can be serialized.
+    sync_state = ('read_state', 'changed_fields')
+
+    def after_commit(self, callback):
+        if self.commit_strategy == 'immediate':
+            callback()
+        else:
+            # Commit events are dispatched by the proxied Session
+            add_after_commit_callback(
+                self.async_session.sync_session, callback)
+
+    @classmethod
+    def get_sync_class(cls):
+        """Get the class of the helpers returned by :meth:`get_sync_context`.
+
+        It's a subclass of ``cls`` in which the methods named in
+        :attr:`sync_methods` are the synchronous
+        :class:`SQLAlchemyORMContext` versions (so, e.g., `update_member`
+        can call `get_member`). It's created once per class.
+
+        """
+        sync_class = cls.__dict__.get('_sync_class')
+        if sync_class is None:
+            attrs = dict(
+                (name, getattr(SQLAlchemyORMContext, name))
+                for name in cls.sync_methods + ('after_commit',))
+            name = 'Sync{0}'.format(cls.__name__)
+            sync_class = type(name, (cls,), attrs)
+            cls._sync_class = sync_class
+        return sync_class
+
+    def get_sync_context(self, session):
+        """Get a synchronous helper for this context that uses ``session``.
+
+        The helper starts with a copy of this context's instance attributes
+        (so instance-level settings apply), and its :attr:`session` is
+        ``session``.
+
+        """
+        sync_class = self.get_sync_class()
+        helper = sync_class.__new__(sync_class)
+        helper.__dict__.update(self.__dict__)
+        helper.session = session
+        return helper
+
+    async def run_sync(self, method, *args, **kwargs):
+        """Run the synchronous ``method`` of this context in the session.
+
+        ``method`` is called with a helper from :meth:`get_sync_context`
+        whose session is the `Session` proxied by :attr:`async_session`.
+        Afterwards, the attributes named in :attr:`sync_state` are copied
+        from the helper to this context.
+
+        """
+        def call(session):
+            helper = self.get_sync_context(session)
+            try:
+                return method(helper, *args, **kwargs)
+            finally:
+                for name in self.sync_state:
+                    if name in helper.__dict__:
+                        self.__dict__[name] = helper.__dict__[name]
+        return await self.async_session.run_sync(call)
+
+    async def get_collection(self, **kwargs):
+        return await self.run_sync(
+            SQLAlchemyORMContext.get_collection, **kwargs)
+
+    async def get_member(self, id, embed=None):
+        return await self.run_sync(
+            SQLAlchemyORMContext.get_member, id, embed=embed)
+
+    async def create_member(self, data):
+        return await self.run_sync(SQLAlchemyORMContext.create_member, data)
+
+    async def update_member(self, id, data):
+        return await self.run_sync(
+            SQLAlchemyORMContext.update_member, id, data)
+
+    async def patch_member(self, id, data, version=None):
+        return await self.run_sync(
+            SQLAlchemyORMContext.patch_member, id, data, version=version)
+
+    async def delete_member(self, id):
+        return await self.run_sync(SQLAlchemyORMContext.delete_member, id)
+
+    async def create_members(self, data):
+        return await self.run_sync(SQLAlchemyORMContext.create_members, data)
+
+    async def update_members(self, ids, data):
+        return await self.run_sync(
+            SQLAlchemyORMContext.update_members, ids, data)
+
+    async def delete_members(self, ids):
+        return await self.run_sync(SQLAlchemyORMContext.delete_members, ids)
+
+
+class AsyncRESTfulView(RESTfulView):
+    """A :class:`RESTfulView` whose `IView` methods are coroutines.
+
+    This is intended for use with an :class:`AsyncSQLAlchemyORMContext`.
+    The coroutines can be awaited directly by an asyncio-based bridge; to
+    register the view with Pyramid's (synchronous) router, wrap it with
+    :func:`blocking_view`.
+
+    Only the context's coroutines run on the event loop. Blocking work
+    (decoding request data, rendering and compressing responses, and
+    reading, writing, and invalidating cached responses) is done via
+    :meth:`run_blocking` so it doesn't stall the loop.
+
+    Responses are never streamed.
+
+    """
+
+    stream = False
+
+    #: Blocking work is run in this `concurrent.futures` executor; ``None``
+    #: means the loop's default executor.
+    executor = None
+
+    #: When set (by :func:`blocking_view`), blocking work is sent to the
+    #: thread waiting for the view via this `queue.Queue` instead of to
+    #: :attr:`executor`.
+    worker_queue = None
+
+    async def run_blocking(self, func, *args):
+        """Run the blocking ``func`` outside of the event loop."""
+        loop = asyncio.get_event_loop()
+        if self.worker_queue is None:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args))
+        future = loop.create_future()
+
+        def set_result(method, value):
+            if not future.done():
+                method(value)
+
+        def task():
+            try:
+                result = func(*args)
+            except BaseException as exc:
+                loop.call_soon_threadsafe(
+                    set_result, future.set_exception, exc)
+            else:
+                loop.call_soon_threadsafe(
+                    set_result, future.set_result, result)
+
+        self.worker_queue.put(task)
+        return await future
+
+    async def get_collection(self):
+        cached_response = await self.run_blocking(self.get_cached_response)
+        if cached_response is not None:
+            return cached_response
+        try:
+            kwargs = await self.run_blocking(self.get_collection_kwargs)
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        try:
+            collection = await self.context.get_collection(**kwargs)
+        except InvalidQuery as exc:
+            raise HTTPBadRequest(str(exc))
+        return await self.run_blocking(self._render_and_cache, collection)
+
+    async def get_member(self):
+        id = self.request.matchdict['id']
+        cached_response = await self.run_blocking(
+            self.get_cached_response, id)
+        if cached_response is not None:
+            return cached_response
+        try:
+            embed = self.embed
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        try:
+            if embed is None:
+                member = await self.context.get_member(id)
+            else:
+                member = await self.context.get_member(id, embed=embed)
+        except InvalidQuery as exc:
+            raise HTTPBadRequest(str(exc))
+        return await self.run_blocking(self._render_and_cache, member, id)
+
+    def _render_and_cache(self, value, member_id=None):
+        return self.cache_response(self.render_to_response(value), member_id)
+
+    async def create_member(self):
+        data = await self.run_blocking(self._get_data)
+        member = await self.context.create_member(data)
+        await self.run_blocking(self.invalidate_cached_responses)
+        id = self.context.get_member_id_as_string(member)
+        headers = {'Location': '/'.join((self.request.path, id))}
+        return Response(status=201, headers=headers)
+
+    async def update_member(self):
+        id = self.request.matchdict['id']
+        data = await self.run_blocking(self._get_data)
+        try:
+            member = await self.context.update_member(id, data)
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        await self.run_blocking(self.invalidate_cached_responses, id)
+        if member is None:
+            member = await self.context.create_member(data)
+            headers = {'Location': self.request.path}
+            return Response(status=201, headers=headers)
+        else:
+            return Response(status=204, content_type='')
+
+    async def patch_member(self):
+        id = self.request.matchdict['id']
+        data = await self.run_blocking(self._get_data)
+        try:
+            member = await self.context.patch_member(
+                id, data, version=self.if_match_version)
+        except VersionConflict:
+            raise HTTPPreconditionFailed()
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        if member is None:
+            if 'If-Match' in self.request.headers:
+                raise HTTPPreconditionFailed()
+            raise HTTPNotFound(self.context)
+        if self.context.changed_fields:
+            await self.run_blocking(self.invalidate_cached_responses, id)
+        return Response(status=204, content_type='')
+
+    async def delete_member(self):
+        id = self.request.matchdict['id']
+        member = await self.context.delete_member(id)
+        if member is None:
+            raise HTTPNotFound(self.context)
+        await self.run_blocking(self.invalidate_cached_responses, id)
+        return Response(status=204, content_type='')
+
+    async def create_members(self):
+        data = await self.run_blocking(self._get_batch_data)
+        if not isinstance(data, list):
+            raise HTTPBadRequest('Expected a JSON array of members.')
+        try:
+            results = await self.context.create_members(data)
+        except IntegrityConflict as exc:
+            raise HTTPConflict(str(exc))
+        await self.run_blocking(self.invalidate_cached_responses)
+        return await self.run_blocking(
+            self._batch_response,
+            dict(results=results, result_count=len(results)))
+
+    async def update_members(self):
+        data = await self.run_blocking(self._get_batch_data)
+        if not (isinstance(data, dict) and 'ids' in data and 'data' in data):
+            raise HTTPBadRequest(
+                'Expected a JSON object with "ids" and "data" keys.')
+        ids = self._get_batch_ids(data)
+        changes = self._get_batch_changes(data)
+        try:
+            count = await self.context.update_members(ids, changes)
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        await self.run_blocking(self.invalidate_all_cached_responses)
+        return await self.run_blocking(
+            self._batch_response, dict(result_count=count))
+
+    async def delete_members(self):
+        data = await self.run_blocking(self._get_batch_data)
+        if not (isinstance(data, dict) and 'ids' in data):
+            raise HTTPBadRequest('Expected a JSON object with an "ids" key.')
+        count = await self.context.delete_members(self._get_batch_ids(data))
+        await self.run_blocking(self.invalidate_all_cached_responses)
+        return await self.run_blocking(
+            self._batch_response, dict(result_count=count))
+
+
+class EventLoopThread(object):
+    """Runs an asyncio event loop in a daemon thread.
+
+    Coroutines submitted from other threads via :meth:`run` are multiplexed
+    on the loop, so the database I/O for many concurrent requests is done
+    by a single thread.
+
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name='pyramid_restler.aio')
+                thread.daemon = True
+                thread.start()
+                self.loop = loop
+        return self.loop
+
+    def stop(self):
+        with self._lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.loop = None
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the loop and return a `Future` for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the loop, wait for it, and return its result."""
+        return self.submit(coro).result(timeout)
+
+
+default_loop_thread = EventLoopThread()
+
+
+def blocking_view(view_class, loop_thread=None):
+    """Adapt an :class:`AsyncRESTfulView` class to Pyramid's router.
+
+    Returns a subclass of ``view_class`` whose `IView` methods run the
+    corresponding coroutines on ``loop_thread`` (a shared
+    :class:`EventLoopThread` by default) and return their results. Use the
+    result as the ``view`` passed to ``config.add_restful_routes``.
+
+    The request's thread has to wait for the response anyway, so instead
+    of idling, it runs the view's blocking work (see
+    :meth:`AsyncRESTfulView.run_blocking`) while the loop thread only
+    does the database I/O. No other threads are used.
+
+    """
+    if loop_thread is None:
+        loop_thread = default_loop_thread
+
+    def make_method(name):
+        coroutine_function = getattr(view_class, name)
+
+        def method(self):
+            tasks = self.worker_queue = queue.Queue()
+            future = loop_thread.submit(coroutine_function(self))
+            future.add_done_callback(lambda future: tasks.put(None))
+            for task in iter(tasks.get, None):
+                task()
+            return future.result()
+
+        method.__name__ = name
+        method.__doc__ = coroutine_function.__doc__
+        return method
+
+    names = (
+        'get_collection', 'get_member', 'create_member', 'update_member',
+        'patch_member', 'delete_member', 'create_members', 'update_members',
+        'delete_members',
+    )
+    attrs = dict((name, make_method(name)) for name in names)
+    name = 'Blocking{0}'.format(view_class.__name__)
+    return type(name, (view_class,), attrs)
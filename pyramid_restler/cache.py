@@ -0,0 +1,211 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+
+try:
+    import anydbm as dbm
+except ImportError:
+    import dbm
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from pyramid.response import Response
+
+from zope.interface import implementer
+
+from pyramid_restler.interfaces import IResponseCache
+from pyramid_restler.util import LRUCache
+
+
+class MemoryCacheBackend(object):
+    """Stores cache entries in an in-process :class:`LRUCache`."""
+
+    def __init__(self, maxsize=1024):
+        self.cache = LRUCache(maxsize)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class DBMCacheBackend(object):
+    """Stores cache entries in a dbm file that can be shared by processes.
+
+    Access to the file is serialized with a lock file (where `fcntl` is
+    available). Entries aren't evicted, but they will be orphaned when
+    they're invalidated, so the file should be cleared periodically (e.g.,
+    on deployment).
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = '{0}.lock'.format(path)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._locked(exclusive=False):
+            db = dbm.open(self.path, 'c')
+            try:
+                value = db.get(self._key(key))
+            finally:
+                db.close()
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._locked(exclusive=True):
+            db = dbm.open(self.path, 'c')
+            try:
+                db[self._key(key)] = value
+            finally:
+                db.close()
+
+    def clear(self):
+        with self._locked(exclusive=True):
+            db = dbm.open(self.path, 'n')
+            db.close()
+
+    def _key(self, key):
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def _locked(self, exclusive):
+        return _FileLock(self._lock, self.lock_path, exclusive)
+
+
+class _FileLock(object):
+
+    def __init__(self, thread_lock, path, exclusive):
+        self.thread_lock = thread_lock
+        self.path = path
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.file = None
+        if fcntl is not None:
+            self.file = open(self.path, 'a')
+            mode = fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH
+            fcntl.flock(self.file.fileno(), mode)
+
+    def __exit__(self, *exc_info):
+        try:
+            if self.file is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+                self.file.close()
+        finally:
+            self.thread_lock.release()
+
+
+@implementer(IResponseCache)
+class ResponseCache(object):
+    """Caches rendered responses in a ``backend``.
+
+    Invalidation is done with generation tokens: each namespace has a
+    token for its collection responses, a token for all of its member
+    responses, and a token per member. These tokens are part of the keys
+    entries are stored under, so replacing a token orphans all of the
+    entries stored with it.
+
+    If ``ttl`` is passed, entries will also expire after that many seconds
+    (which is useful when the underlying data can be modified by other
+    means).
+
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, namespace, key, member_id=None):
+        entry = self.backend.get(self._entry_key(namespace, key, member_id))
+        if entry is None:
+            return None
+        expires, status, headerlist, body = entry
+        if expires is not None and expires < time.time():
+            return None
+        return Response(body=body, status=status, headerlist=headerlist)
+
+    def set(self, namespace, key, response, member_id=None):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        headerlist = [
+            (name, value) for (name, value) in response.headerlist
+            if name.lower() != 'set-cookie']
+        entry = (expires, response.status, headerlist, response.body)
+        self.backend.set(self._entry_key(namespace, key, member_id), entry)
+
+    def invalidate(self, namespace, member_id=None, all_members=False):
+        self._new_generation(namespace, 'collection')
+        if all_members:
+            self._new_generation(namespace, 'members')
+        elif member_id is not None:
+            self._new_generation(namespace, 'member', member_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _entry_key(self, namespace, key, member_id):
+        if member_id is None:
+            gens = [self._generation(namespace, 'collection')]
+        else:
+            gens = [
+                self._generation(namespace, 'members'),
+                self._generation(namespace, 'member', member_id),
+            ]
+        return '\n'.join(['entry', namespace] + gens + [key])
+
+    def _generation(self, namespace, *parts):
+        key = self._generation_key(namespace, *parts)
+        generation = self.backend.get(key)
+        if generation is None:
+            generation = self._new_generation(namespace, *parts)
+        return generation
+
+    def _new_generation(self, namespace, *parts):
+        generation = uuid.uuid4().hex
+        self.backend.set(self._generation_key(namespace, *parts), generation)
+        return generation
+
+    def _generation_key(self, namespace, *parts):
+        parts = ['generation', namespace] + [str(p) for p in parts]
+        return '\n'.join(parts)
+
+
+def response_cache_from_settings(settings):
+    """Create a :class:`ResponseCache` from app settings.
+
+    ``restler.response_cache`` selects the backend: 'memory' or 'dbm'. When
+    it isn't set, ``None`` is returned. ``restler.response_cache.maxsize``
+    sets the size of the memory backend, ``restler.response_cache.path``
+    sets the path of the dbm file, and ``restler.response_cache.ttl`` sets
+    the TTL for entries.
+
+    """
+    prefix = 'restler.response_cache'
+    backend = settings.get(prefix)
+    if not backend:
+        return None
+    if backend == 'memory':
+        maxsize = int(settings.get(prefix + '.maxsize', 1024))
+        backend = MemoryCacheBackend(maxsize)
+    elif backend == 'dbm':
+        path = settings.get(prefix + '.path')
+        if not path:
+            raise ValueError('{0}.path must be set'.format(prefix))
+        backend = DBMCacheBackend(os.path.abspath(path))
+    else:
+        raise ValueError('Unknown {0} backend: {1}'.format(prefix, backend))
+    ttl = settings.get(prefix + '.ttl')
+    ttl = None if ttl is None else float(ttl)
+    return ResponseCache(backend, ttl=ttl)
@@ -0,0 +1,121 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from pyramid_restler.util import ClosingIterator
+
+
+class ZlibCompressor(object):
+    """Compresses data incrementally in gzip or zlib (HTTP deflate) format."""
+
+    def __init__(self, encoding, level=6):
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self.compressobj.compress(data)
+
+    def finish(self):
+        return self.compressobj.flush()
+
+
+class BrotliCompressor(object):
+    """Compresses data incrementally in brotli format (requires brotli)."""
+
+    def __init__(self, encoding='br', level=5):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+compressors = {
+    'gzip': ZlibCompressor,
+    'deflate': ZlibCompressor,
+}
+
+if brotli is not None:
+    compressors['br'] = BrotliCompressor
+
+
+def negotiate_encoding(accept_encoding, offers):
+    """Choose a content coding from ``offers`` based on ``accept_encoding``.
+
+    ``accept_encoding`` is the value of an Accept-Encoding header, and
+    ``offers`` is a list of codings in order of preference. The first
+    offer with the highest quality value is returned, or ``None`` if none
+    of the offers are acceptable (in which case the identity coding should
+    be used).
+
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    default = qualities.get('*', 0.0)
+    best = None
+    best_q = 0.0
+    for offer in offers:
+        q = qualities.get(offer, default)
+        if q > best_q:
+            best, best_q = offer, q
+    return best
+
+
+def compress(data, encoding, level=None):
+    """Compress ``data`` (bytes) using ``encoding``."""
+    compressor = get_compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_iter(app_iter, encoding, level=None):
+    """Compress the chunks yielded by ``app_iter`` incrementally.
+
+    Compressed chunks are yielded as the compressor produces them, so only
+    the compressor's window is held in memory. If ``app_iter`` has a
+    ``close`` method, the returned iterator has one too that calls it (even
+    if iteration never started).
+
+    """
+    chunks = _compress_chunks(app_iter, get_compressor(encoding, level))
+    close = getattr(app_iter, 'close', None)
+    if close is None:
+        return chunks
+    return ClosingIterator(chunks, close)
+
+
+def _compress_chunks(app_iter, compressor):
+    for chunk in app_iter:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def get_compressor(encoding, level=None):
+    try:
+        compressor_class = compressors[encoding]
+    except KeyError:
+        raise ValueError('Unsupported content coding: {0}'.format(encoding))
+    if level is None:
+        return compressor_class(encoding)
+    return compressor_class(encoding, level)
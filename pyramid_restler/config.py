@@ -1,11 +1,25 @@
-from pyramid.events import NewRequest
-from pyramid.httpexceptions import HTTPBadRequest
+import logging
+import time
 
+from pyramid.events import ContextFound
+from pyramid.exceptions import ConfigurationError
+
+from pyramid_restler.dispatch import (
+    EntityDispatcher,
+    ResourceDispatcher,
+    tunnel_matched_request,
+)
+from pyramid_restler.interfaces import IJSONBackend, IResponseCache
+from pyramid_restler.jsonlib import get_json_backend
 from pyramid_restler.view import RESTfulView
 
 
+log = logging.getLogger(__name__)
+
+
 def add_restful_routes(self, name, factory, view=RESTfulView,
-                       route_kw=None, view_kw=None):
+                       route_kw=None, view_kw=None, batch=False,
+                       single_route=False):
     """Add a set of RESTful routes for an entity.
 
     URL patterns for an entity are mapped to a set of views encapsulated in
@@ -31,6 +45,21 @@ def add_restful_routes(self, name, factory, view=RESTfulView,
     all `add_route` and `add_view` calls. Pass ``route_kw`` and/or ``view_kw``
     as dictionaries to do so.
 
+    If ``batch`` is set, routes for creating, updating, and deleting
+    multiple members in a single request will be added too. These use the
+    pattern /{slug}/batch with the POST, PATCH, and DELETE methods
+    respectively, and the view and context must implement the
+    `create_members`, `update_members`, and `delete_members` methods.
+
+    If ``single_route`` is set, a single route named ``name`` is added
+    instead of a route per method. It matches /{slug}, /{slug}.{renderer},
+    and /{slug}/{id} (etc), and requests are dispatched to the view
+    class's methods by an :class:`pyramid_restler.dispatch.EntityDispatcher`
+    via a (method, URL shape) table. Since Pyramid matches routes one at a
+    time, this makes routing considerably faster for apps with many
+    entities (see `benchmarks/routing.py`). The view class sees the same
+    matchdict either way.
+
     """
     route_kw = {} if route_kw is None else route_kw
     view_kw = {} if view_kw is None else view_kw
@@ -42,16 +71,40 @@ def add_restful_routes(self, name, factory, view=RESTfulView,
         id='{id}',
         renderer='{renderer}')
 
+    if single_route:
+        pattern = '/{slug}{{rest:(/[^/]*|\\.[^/]*)?}}'.format(**subs)
+        self.add_route(name, pattern, factory=factory, **route_kw)
+        self.add_view(
+            view=EntityDispatcher(view, batch=batch), route_name=name,
+            **view_kw)
+        return
+
     def add_route(name, pattern, attr, method):
         name = name.format(**subs)
         pattern = pattern.format(**subs)
-        self.add_route(
-            name, pattern, factory=factory,
-            request_method=method, **route_kw)
+        kw = dict(route_kw)
+        if method in ('GET', 'POST'):
+            kw['request_method'] = method
+        else:
+            # Allow this method to be tunneled via POST.
+            kw['request_method'] = (method, 'POST')
+            kw['tunneled_method'] = method
+        self.add_route(name, pattern, factory=factory, **kw)
         self.add_view(
             view=view, attr=attr, route_name=name,
             request_method=method, **view_kw)
 
+    if batch:
+        # These have to be added before the member routes so that "batch"
+        # won't be matched as an ID.
+        add_route(
+            'create_{name}_batch', '/{slug}/batch', 'create_members', 'POST')
+        add_route(
+            'update_{name}_batch', '/{slug}/batch', 'update_members', 'PATCH')
+        add_route(
+            'delete_{name}_batch', '/{slug}/batch', 'delete_members',
+            'DELETE')
+
     # Get collection
     add_route(
         'get_{name}_collection_rendered', '/{slug}.{renderer}',
@@ -69,52 +122,165 @@ def add_restful_routes(self, name, factory, view=RESTfulView,
 
     # Update member
     add_route('update_{name}', '/{slug}/{id}', 'update_member', 'PUT')
+    add_route('patch_{name}', '/{slug}/{id}', 'patch_member', 'PATCH')
 
     # Delete member
     add_route('delete_{name}', '/{slug}/{id}', 'delete_member', 'DELETE')
 
 
-def enable_POST_tunneling(self, allowed_methods=('PUT', 'DELETE')):
+def add_restful_resources(self, factories, prefix='', view=RESTfulView,
+                          route_kw=None, view_kw=None, batch=False):
+    """Add RESTful routes for many entities under a shared ``prefix``.
+
+    ``factories`` is a dict or a list of (name, factory) pairs. Each name is
+    used as described in :func:`add_restful_routes` (i.e., underscores
+    are converted to dashes in the URL). ``view`` and ``batch`` apply to
+    all of the entities.
+
+    Instead of a set of routes per entity, a single route that matches
+    {prefix}/{slug}, {prefix}/{slug}/{id}, etc is added per prefix. The
+    entity is resolved by looking up the slug in a dict, and requests are
+    then dispatched as they are with ``single_route`` (see
+    :class:`pyramid_restler.dispatch.ResourceDispatcher`). This directive
+    can be called multiple times with the same prefix; the route is only
+    added the first time, so ``route_kw`` and ``view_kw`` can only be
+    passed then (a `ConfigurationError` is raised if they're passed again
+    with different values). ``route_kw`` can't include ``factory``, since
+    the dispatcher is the route's context factory.
+
+    The entities are registered when the configuration is committed. Each
+    entity is a separate action with the discriminator
+    ``('restful_resource', prefix, slug)``, so adding the same entity twice
+    under a prefix is reported as a conflict. This is much cheaper than
+    adding routes and views for each entity; the time it takes is logged at
+    the DEBUG level.
+
+    """
+    if route_kw is not None and 'factory' in route_kw:
+        raise ConfigurationError(
+            'route_kw can\'t include factory; each resource\'s factory is '
+            'used as its context factory')
+    options = (route_kw, view_kw)
+
+    prefix = prefix.strip('/')
+    prefix = '/{0}'.format(prefix) if prefix else ''
+    dispatchers = getattr(self.registry, 'restler_resource_dispatchers', None)
+    if dispatchers is None:
+        dispatchers = self.registry.restler_resource_dispatchers = {}
+
+    if prefix in dispatchers:
+        dispatcher, first_options = dispatchers[prefix]
+        args = ('route_kw', 'view_kw')
+        for arg, kw, first_kw in zip(args, options, first_options):
+            if kw is not None and kw != first_kw:
+                raise ConfigurationError(
+                    'The route for RESTful resources under {0!r} was added '
+                    'by a previous call, so {1} can\'t be changed'
+                    .format(prefix or '/', arg))
+    else:
+        route_kw = {} if route_kw is None else dict(route_kw)
+        view_kw = {} if view_kw is None else dict(view_kw)
+        dispatcher = ResourceDispatcher()
+        dispatchers[prefix] = (dispatcher, (dict(route_kw), dict(view_kw)))
+        view_kw.setdefault('http_cache', 0)
+        name = 'restful_resources:{0}'.format(prefix or '/')
+        pattern = prefix + '/{slug:[^/.]+}{rest:(/[^/]*|\\.[^/]*)?}'
+        self.add_route(
+            name, pattern, factory=dispatcher.factory,
+            restful_resources=dispatcher, **route_kw)
+        self.add_view(view=dispatcher, route_name=name, **view_kw)
+
+    if hasattr(factories, 'items'):
+        factories = factories.items()
+    factories = list(factories)
+    start = []
+
+    def register(name, factory):
+        if not start:
+            start.append(time.time())
+        dispatcher.add(name, factory, view, batch=batch)
+
+    def log_time():
+        if start:
+            log.debug(
+                'Registered %d RESTful resources under %r in %.2fms',
+                len(factories), prefix or '/',
+                (time.time() - start[0]) * 1000)
+
+    for name, factory in factories:
+        discriminator = ('restful_resource', prefix, name.replace('_', '-'))
+        self.action(discriminator, register, args=(name, factory))
+    self.action(None, log_time)
+
+
+def enable_POST_tunneling(self, allowed_methods=('PUT', 'PATCH', 'DELETE')):
     """Allow other request methods to be tunneled via POST.
 
-    This allows PUT and DELETE requests to be tunneled via POST requests.
+    This allows PUT, PATCH, and DELETE requests to be tunneled via POST requests.
     The method can be specified using a parameter or a header...
 
     The name of the parameter is '$method'; it can be a query or POST
-    parameter. The query parameter will be preferred if both the query and
-    POST parameters are present in the request.
+    parameter. The name of the header is 'X-HTTP-Method-Override'. The
+    query parameter is checked first, then the header, and then the POST
+    parameter. The request body is only parsed as a last resort, and only
+    if it contains form data.
+
+    Tunneling only applies to the routes added by
+    :func:`add_restful_routes` for methods other than GET and POST (those
+    routes are matched by the ``tunneled_method`` route predicate, or by
+    the dispatcher when ``single_route`` is used), so it doesn't add any
+    overhead to other requests.
+
+    When a tunneled request matches a route, its method will be overwritten
+    before it reaches application code (by a `ContextFound` subscriber; see
+    :func:`pyramid_restler.dispatch.tunnel_matched_request`), such that the
+    application will never be aware of the original request method.
+    Likewise, the parameter and header will be removed from the request,
+    and the application will never see them.
+
+    """
+    allowed_methods = frozenset(m.upper() for m in allowed_methods)
+    def register():
+        self.registry.restler_tunneled_methods = allowed_methods
+    self.action('restler_tunneled_methods', register)
+    self.add_subscriber(tunnel_matched_request, ContextFound)
 
-    The name of the header is 'X-HTTP-Method-Override'. If the parameter
-    described above is passed, this will be ignored.
 
-    The request method will be overwritten before it reaches application
-    code, such that the application will never be aware of the original
-    request method. Likewise, the parameter and header will be removed from
-    the request, and the application will never see them.
+def set_restful_response_cache(self, cache):
+    """Set the cache used for GET responses from RESTful views.
+
+    ``cache`` must implement the
+    :class:`pyramid_restler.interfaces.IResponseCache` interface (e.g., a
+    :class:`pyramid_restler.cache.ResponseCache`). Pass ``None`` to disable
+    response caching.
+
+    A cache can also be configured via the ``restler.response_cache``
+    settings; see :func:`pyramid_restler.cache.response_cache_from_settings`.
 
     """
-    param_name = '$method'
-    header_name = 'X-HTTP-Method-Override'
-    allowed_methods = set(allowed_methods)
-    disallowed_message = (
-        'Only these methods may be tunneled over POST: {0}.'
-        .format(sorted(list(allowed_methods))))
-    def new_request_subscriber(event):
-        request = event.request
-        if request.method == 'POST':
-            if param_name in request.GET:
-                method = request.GET[param_name]
-            elif param_name in request.POST:
-                method = request.POST[param_name]
-            elif header_name in request.headers:
-                method = request.headers[header_name]
-            else:
-                return  # Not a tunneled request
-            if method in allowed_methods:
-                request.GET.pop(param_name, None)
-                request.POST.pop(param_name, None)
-                request.headers.pop(header_name, None)
-                request.method = method
-            else:
-                raise HTTPBadRequest(disallowed_message)
-    self.add_subscriber(new_request_subscriber, NewRequest)
+    def register():
+        if cache is None:
+            self.registry.unregisterUtility(provided=IResponseCache)
+        else:
+            self.registry.registerUtility(cache, IResponseCache)
+    self.action(IResponseCache, register)
+
+
+def set_restful_json_backend(self, backend):
+    """Set the JSON backend used by RESTful views and contexts.
+
+    ``backend`` is either an object that implements the
+    :class:`pyramid_restler.interfaces.IJSONBackend` interface or the name
+    of a backend to pass to :func:`pyramid_restler.jsonlib.get_json_backend`
+    (e.g., 'orjson').
+
+    A backend can also be selected via the ``restler.json_backend``
+    setting.
+
+    """
+    if not IJSONBackend.providedBy(backend):
+        backend = get_json_backend(backend)
+
+    def register():
+        self.registry.registerUtility(backend, IJSONBackend)
+    self.action(IJSONBackend, register)
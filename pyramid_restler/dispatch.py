@@ -0,0 +1,280 @@
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+
+
+tunneling_param = '$method'
+
+tunneling_header = 'X-HTTP-Method-Override'
+
+form_types = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def find_tunneled_method(request):
+    """Find the method tunneled by the POST ``request``.
+
+    The $method query parameter is checked first, then the
+    X-HTTP-Method-Override header, and then the $method POST parameter
+    (only if the body contains form data). ``None`` is returned if tunneling
+    isn't enabled or no method is specified. The method isn't checked
+    against the allowed methods; see :func:`get_tunneled_method`.
+
+    """
+    if not getattr(request.registry, 'restler_tunneled_methods', None):
+        return None
+    method = request.GET.get(tunneling_param)
+    if method is None:
+        method = request.headers.get(tunneling_header)
+    if method is None and request.content_type in form_types:
+        # Parsing the form makes the body seekable, so it can still be
+        # read by the view.
+        method = request.POST.get(tunneling_param)
+    if method is None:
+        return None
+    return method.upper()
+
+
+def get_tunneled_method(request):
+    """Get the method tunneled by the POST ``request``.
+
+    This is like :func:`find_tunneled_method`, except that a 400 is raised
+    if the method isn't one of the allowed methods.
+
+    """
+    method = find_tunneled_method(request)
+    if method is None:
+        return None
+    allowed_methods = request.registry.restler_tunneled_methods
+    if method not in allowed_methods:
+        raise HTTPBadRequest(
+            'Only these methods may be tunneled over POST: {0}.'
+            .format(sorted(allowed_methods)))
+    return method
+
+
+def tunnel_request(request, method):
+    """Overwrite ``request``'s method with the tunneled ``method``.
+
+    The $method parameter and X-HTTP-Method-Override header are removed
+    so that the application never sees them.
+
+    """
+    request.GET.pop(tunneling_param, None)
+    if request.content_type in form_types:
+        request.POST.pop(tunneling_param, None)
+    request.headers.pop(tunneling_header, None)
+    request.method = method
+
+
+def tunnel_matched_request(event):
+    """Rewrite tunneled requests once they've matched a route.
+
+    This is a `ContextFound` subscriber added by
+    :func:`pyramid_restler.config.enable_POST_tunneling`. Routing happens
+    before the view is looked up, so this is where the method of a POST
+    request that matched a route using :class:`TunneledMethodPredicate` is
+    overwritten with the tunneled method (or where it's rejected with a 400
+    if the method isn't allowed). Requests for other routes are left alone.
+
+    """
+    request = event.request
+    if request.method != 'POST':
+        return
+    route = getattr(request, 'matched_route', None)
+    if route is None:
+        return
+    for predicate in route.predicates:
+        if isinstance(predicate, TunneledMethodPredicate):
+            break
+    else:
+        return
+    method = get_tunneled_method(request)
+    if method is not None:
+        tunnel_request(request, method)
+
+
+class TunneledMethodPredicate(object):
+    """Route predicate that matches requests using ``method``.
+
+    This matches ``method`` requests and POST requests that tunnel
+    ``method``, provided that tunneling was enabled via
+    :func:`pyramid_restler.config.enable_POST_tunneling`. Routes using this
+    predicate must allow the POST method (if they specify
+    ``request_method``).
+
+    POST requests that tunnel a method that isn't allowed match too, so
+    that they get a 400 instead of a 404. The predicate only checks the
+    request; :func:`tunnel_matched_request` does the rewriting.
+
+    """
+
+    def __init__(self, val, config):
+        self.method = val.upper()
+
+    def text(self):
+        return 'tunneled_method = {0}'.format(self.method)
+
+    phash = text
+
+    def __call__(self, info, request):
+        method = request.method
+        if method == self.method:
+            return True
+        if method != 'POST':
+            return False
+        method = find_tunneled_method(request)
+        if method is None:
+            return False
+        if method == self.method:
+            return True
+        return method not in request.registry.restler_tunneled_methods
+
+
+class EntityDispatcher(object):
+    """View that dispatches all of an entity's requests to a view class.
+
+    This is used by :func:`pyramid_restler.config.add_restful_routes` when
+    ``single_route`` is set. The route's ``rest`` match is everything after
+    the slug; it's parsed into the shapes it could have (e.g., /1.json
+    could be the member "1" rendered as JSON or the member "1.json"), and
+    the first (method, shape) pair in :attr:`table` determines which method
+    of ``view`` is called. The ``id`` and ``renderer`` keys are added to the
+    matchdict, so the view sees the same matchdict as it would with a route
+    per method.
+
+    Requests that don't match anything are 404s, as they would be with a
+    route per method.
+
+    """
+
+    def __init__(self, view, batch=False):
+        self.view = view
+        self.batch = batch
+        table = {
+            ('GET', 'collection_rendered'): 'get_collection',
+            ('GET', 'collection'): 'get_collection',
+            ('GET', 'member_rendered'): 'get_member',
+            ('GET', 'member'): 'get_member',
+            ('POST', 'collection'): 'create_member',
+            ('PUT', 'member'): 'update_member',
+            ('PATCH', 'member'): 'patch_member',
+            ('DELETE', 'member'): 'delete_member',
+        }
+        if batch:
+            table.update({
+                ('POST', 'batch'): 'create_members',
+                ('PATCH', 'batch'): 'update_members',
+                ('DELETE', 'batch'): 'delete_members',
+            })
+        self.table = table
+
+    def __call__(self, context, request):
+        match = self.match(request)
+        if match is None:
+            raise HTTPNotFound()
+        attr, matchdict = match
+        request.matchdict.update(matchdict)
+        return getattr(self.view(context, request), attr)()
+
+    def match(self, request):
+        """Find the view method and matchdict for ``request``.
+
+        Returns ``None`` if there's no match. POST requests that don't
+        match are retried with the tunneled method, if there is one.
+
+        """
+        shapes = self.get_shapes(request.matchdict.get('rest', ''))
+        method = request.method
+        match = self.lookup(method, shapes)
+        if match is None and method == 'POST' and shapes:
+            tunneled_method = get_tunneled_method(request)
+            if tunneled_method is not None:
+                match = self.lookup(tunneled_method, shapes)
+                if match is not None:
+                    tunnel_request(request, tunneled_method)
+        return match
+
+    def lookup(self, method, shapes):
+        table = self.table
+        for shape, matchdict in shapes:
+            attr = table.get((method, shape))
+            if attr is not None:
+                return attr, matchdict
+        return None
+
+    def get_shapes(self, rest):
+        """Get the shapes ``rest`` could have, in order of precedence."""
+        if not rest:
+            return [('collection', {})]
+        if rest[0] == '.':
+            renderer = rest[1:]
+            if not renderer:
+                return []
+            return [('collection_rendered', {'renderer': renderer})]
+        id = rest[1:]
+        if not id:
+            return []
+        shapes = []
+        if self.batch and id == 'batch':
+            shapes.append(('batch', {}))
+        base, _, renderer = id.rpartition('.')
+        if base and renderer:
+            shapes.append(
+                ('member_rendered', {'id': base, 'renderer': renderer}))
+        shapes.append(('member', {'id': id}))
+        return shapes
+
+
+class ResourceDispatcher(object):
+    """Dispatches requests for many entities that share a single route.
+
+    This is used by :func:`pyramid_restler.config.add_restful_resources`.
+    The route's ``slug`` match is looked up in :attr:`resources` (a dict
+    of slug => (context factory, :class:`EntityDispatcher`)), so resolving
+    an entity takes constant time regardless of how many entities there
+    are. The route only matches known slugs (see
+    :class:`ResourcePredicate`), :meth:`factory` is its context factory,
+    and the dispatcher itself is its view.
+
+    """
+
+    def __init__(self):
+        self.resources = {}
+
+    def add(self, name, factory, view, batch=False):
+        slug = name.replace('_', '-')
+        if slug in self.resources:
+            raise ValueError('Duplicate resource: {0}'.format(slug))
+        self.resources[slug] = (factory, EntityDispatcher(view, batch=batch))
+
+    def get_resource(self, request):
+        try:
+            return self.resources[request.matchdict['slug']]
+        except KeyError:
+            raise HTTPNotFound()
+
+    def factory(self, request):
+        return self.resources[request.matchdict['slug']][0](request)
+
+    def __call__(self, context, request):
+        return self.get_resource(request)[1](context, request)
+
+
+class ResourcePredicate(object):
+    """Route predicate that matches slugs added to a dispatcher.
+
+    ``dispatcher`` is a :class:`ResourceDispatcher`. Requests whose
+    ``slug`` match isn't one of its resources don't match the route, so
+    routing continues with the routes added after it (e.g., /about when
+    resources are added without a prefix).
+
+    """
+
+    def __init__(self, dispatcher, config):
+        self.dispatcher = dispatcher
+
+    def text(self):
+        return 'restful_resources'
+
+    phash = text
+
+    def __call__(self, info, request):
+        return info['match'].get('slug') in self.dispatcher.resources
@@ -0,0 +1,24 @@
+class InvalidQuery(ValueError):
+    """Raised when the arguments of a query are invalid.
+
+    E.g., when a cursor can't be decoded or a relationship can't be
+    embedded. Views should respond with a 400 Bad Request.
+
+    """
+
+
+class VersionConflict(Exception):
+    """Raised when a member's version isn't the version a client expects.
+
+    Views should respond with a 412 Precondition Failed.
+
+    """
+
+
+class IntegrityConflict(Exception):
+    """Raised when a write violates a database constraint.
+
+    E.g., when a batch of new members contains an ID that already exists.
+    Views should respond with a 409 Conflict.
+
+    """
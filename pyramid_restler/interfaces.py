@@ -17,6 +17,13 @@ class IView(Interface):
         but no further processing will be done on the resulting dict (i.e.,
         types won't be coerced, etc).
 
+        If a $fields query parameter is present, it will also be passed to
+        the context's `get_collection` method as the ``fields`` keyword arg
+        (unless $$ already contains ``fields``). Likewise, a $count query
+        parameter other than 'none' will be passed as the ``count`` keyword
+        arg, and an $embed query parameter will be passed as the ``embed``
+        keyword arg.
+
         """
 
     def get_member():
@@ -24,6 +31,9 @@ class IView(Interface):
 
         GET /entity/id -> 200 OK, member
 
+        If an $embed query parameter is present, it will be passed to the
+        context's `get_member` method as the ``embed`` keyword arg.
+
         """
 
     def create_member():
@@ -40,6 +50,17 @@ class IView(Interface):
 
         """
 
+    def patch_member(id):
+        """Update some fields of an existing member.
+
+        PATCH /entity/id?POST_data -> 204 No Content
+
+        Only fields that changed are updated. If the If-Match header
+        contains a version, the update is only made if the member's version
+        matches (otherwise, 412 Precondition Failed).
+
+        """
+
     def delete_member(id):
         """Delete an existing member.
 
@@ -47,6 +68,27 @@ class IView(Interface):
 
         """
 
+    def create_members():
+        """Create multiple members (only needed for batch routes).
+
+        POST /entity/batch?JSON_array -> 200 OK, ID or error for each item
+
+        """
+
+    def update_members():
+        """Update multiple members (only needed for batch routes).
+
+        PATCH /entity/batch?{"ids": [...], "data": {...}} -> 200 OK, count
+
+        """
+
+    def delete_members():
+        """Delete multiple members (only needed for batch routes).
+
+        DELETE /entity/batch?{"ids": [...]} -> 200 OK, count
+
+        """
+
     def render_to_response(value, fields=None):
         """Render a member or list of members to an appropriate response.
 
@@ -73,10 +115,26 @@ class IContext(Interface):
         Implementation-specific keyword args may be passed to filter the
         collection or alter it in various ways.
 
+        A ``fields`` keyword arg may be passed to indicate which fields
+        will be used from each member. Implementations can use this to
+        avoid loading other fields.
+
+        An ``embed`` keyword arg may be passed to request that related
+        members be loaded eagerly and included in each member.
+
+        Implementations should raise a
+        :class:`pyramid_restler.exceptions.InvalidQuery` for invalid args
+        (e.g., relationships that can't be embedded); views respond to it
+        with a 400.
+
         """
 
-    def get_member(id):
-        """Return the member identified by ``id``."""
+    def get_member(id, embed=None):
+        """Return the member identified by ``id``.
+
+        ``embed`` is handled as for `get_collection`.
+
+        """
 
     def create_member(**data):
         """Create a new member."""
@@ -84,8 +142,85 @@ class IContext(Interface):
     def update_member(id, **data):
         """Update an existing member."""
 
+    def patch_member(id, data, version=None):
+        """Update the fields in ``data`` that have changed.
+
+        Returns the member or ``None`` if it doesn't exist. If ``version`` is
+        passed and doesn't match the member's version, a
+        :class:`pyramid_restler.exceptions.VersionConflict` is raised.
+
+        """
+
     def delete_member(id):
         """Delete an existing member."""
 
+    def create_members(data):
+        """Create multiple members (only needed for batch routes).
+
+        Returns a list with the ID of each new member or an error.
+
+        """
+
+    def update_members(ids, data):
+        """Update multiple members (only needed for batch routes).
+
+        Returns the number of members updated.
+
+        """
+
+    def delete_members(ids):
+        """Delete multiple members (only needed for batch routes).
+
+        Returns the number of members deleted.
+
+        """
+
     def get_member_id_as_string(member):
         """Get string representation of ``member`` ID."""
+
+
+class IResponseCache(Interface):
+    """Interface for caching rendered GET responses.
+
+    Cached responses are grouped into namespaces (typically one per entity)
+    so that writes can invalidate the responses they affect.
+
+    """
+
+    def get(namespace, key, member_id=None):
+        """Return the response cached for ``key`` or ``None``.
+
+        ``member_id`` should be passed when ``key`` identifies a member
+        response; otherwise, ``key`` is assumed to identify a collection
+        response.
+
+        """
+
+    def set(namespace, key, response, member_id=None):
+        """Cache ``response`` for ``key``."""
+
+    def invalidate(namespace, member_id=None, all_members=False):
+        """Invalidate cached responses in ``namespace``.
+
+        Collection responses are always invalidated. If ``member_id`` is
+        passed, responses for that member are invalidated as well. If
+        ``all_members`` is set, responses for all members are invalidated.
+
+        """
+
+
+class IJSONBackend(Interface):
+    """Interface for JSON encoding/decoding backends."""
+
+    name = Attribute('The name of the backend.')
+
+    def dumps(obj, default=None):
+        """Encode ``obj`` as JSON and return the result as UTF-8 bytes.
+
+        ``default`` is a function that will be called to convert objects
+        the backend can't encode natively.
+
+        """
+
+    def loads(data):
+        """Decode JSON ``data``, which may be text or UTF-8 bytes."""
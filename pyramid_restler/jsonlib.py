@@ -0,0 +1,138 @@
+import json
+
+from zope.interface import implementer
+
+from pyramid_restler.interfaces import IJSONBackend
+
+
+@implementer(IJSONBackend)
+class StdlibJSONBackend(object):
+    """JSON backend that uses the standard library's `json` module."""
+
+    name = 'json'
+
+    def dumps(self, obj, default=None):
+        return json.dumps(obj, default=default).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+@implementer(IJSONBackend)
+class OrjsonBackend(object):
+    """JSON backend that uses orjson.
+
+    orjson natively encodes dates and times (in ISO 8601 format), so
+    ``default`` will only be called for other types it can't handle, such
+    as decimals and named tuples.
+
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj, default=None):
+        return self.orjson.dumps(obj, default=default)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+@implementer(IJSONBackend)
+class UjsonBackend(object):
+    """JSON backend that uses ujson.
+
+    Note that ujson natively encodes decimals as numbers and tuples
+    (including named tuples) as arrays, so ``default`` won't be called
+    for them.
+
+    """
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, obj, default=None):
+        if default is None:
+            data = self.ujson.dumps(obj)
+        else:
+            data = self.ujson.dumps(obj, default=default)
+        return data.encode('utf-8')
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+
+json_backends = {
+    'json': StdlibJSONBackend,
+    'orjson': OrjsonBackend,
+    'ujson': UjsonBackend,
+}
+
+
+def get_json_backend(name='json'):
+    """Get the JSON backend named ``name``.
+
+    ``name`` can be 'json' (the default), 'orjson', or 'ujson'. If it's
+    'auto', the first of orjson, ujson, and the stdlib backend that's
+    available is returned.
+
+    The other backends are opt-in because they don't produce the same
+    output as the stdlib backend: e.g., ujson encodes decimals as numbers,
+    and orjson encodes datetimes in ISO 8601 format. With 'auto', the
+    output would depend on which packages happen to be installed.
+
+    """
+    if name == 'auto':
+        for name in ('orjson', 'ujson'):
+            try:
+                return json_backends[name]()
+            except ImportError:
+                pass
+        return StdlibJSONBackend()
+    try:
+        backend_class = json_backends[name]
+    except KeyError:
+        raise ValueError('Unknown JSON backend: {0}'.format(name))
+    return backend_class()
+
+
+default_json_backend = StdlibJSONBackend()
+
+
+def encode_json_items(backend_name, encoder_class, items):
+    """Encode the ``items`` of a JSON array without the enclosing brackets.
+
+    This is used to encode chunks of a collection in an executor. The args
+    are picklable so that it can be used with a process pool: the backend
+    is specified by name, and ``encoder_class`` is a `JSONEncoder` subclass
+    whose `default` method is used.
+
+    """
+    backend = get_json_backend(backend_name)
+    data = backend.dumps(items, encoder_class().default)
+    return data[1:-1].strip()
+
+
+def get_request_json_backend(request):
+    """Get the JSON backend configured for ``request``'s app.
+
+    The backend is configured via the ``restler.json_backend`` setting
+    (which is 'json' by default) or
+    :func:`pyramid_restler.config.set_restful_json_backend`. If no backend
+    has been configured (e.g., if `pyramid_restler` wasn't included), the
+    stdlib backend is used.
+
+    """
+    registry = getattr(request, 'registry', None)
+    backend = None
+    if registry is not None:
+        backend = registry.queryUtility(IJSONBackend)
+    return default_json_backend if backend is None else backend
@@ -1,28 +1,417 @@
-from collections import Iterable
+import base64
+from collections import OrderedDict
+import csv
 import datetime
 import decimal
+from functools import partial
+import hashlib
+import io
+import itertools
 import json
+from operator import attrgetter
+from weakref import WeakKeyDictionary, ref
+
+try:
+    from collections.abc import Iterable
+except ImportError:  # Python 2
+    from collections import Iterable
 
 from pyramid.decorator import reify
-from pyramid.compat import string_types
+from pyramid.compat import PY3, integer_types, string_types, text_type
 
+from sqlalchemy import and_, bindparam, event, func, or_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import (
+    Mapper, Query, Session, class_mapper, configure_mappers, joinedload,
+    scoped_session, subqueryload)
+from sqlalchemy.orm.exc import StaleDataError, UnmappedClassError
 from sqlalchemy.schema import Column
-from sqlalchemy.util import KeyedTuple as NamedTuple
+from sqlalchemy.types import (
+    Boolean, Date, DateTime, Integer, LargeBinary, Numeric, String, Time)
+
+try:
+    from sqlalchemy.engine import Row as NamedTuple
+except ImportError:  # SQLAlchemy < 1.4
+    from sqlalchemy.util import KeyedTuple as NamedTuple
+
+try:
+    from sqlalchemy.orm import selectinload
+except ImportError:  # SQLAlchemy < 1.2
+    selectinload = subqueryload
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from zope.interface import implementer
 
+from pyramid_restler.exceptions import (
+    IntegrityConflict, InvalidQuery, VersionConflict)
 from pyramid_restler.interfaces import IContext
+from pyramid_restler.jsonlib import encode_json_items, get_request_json_backend
+from pyramid_restler.tweens import deferred_commits_key
+from pyramid_restler.util import ClosingIterator, LRUCache, TTLCache
 
 
 datetime_types = (datetime.time, datetime.date, datetime.datetime)
 
 
+class FieldPlan(object):
+    """Describes the fields of an entity class.
+
+    ``columns`` maps the names of column attributes to their `Column`s,
+    ``properties`` contains the names of Python properties, and ``names``
+    contains all of the field names in sorted order. ``getters`` maps each
+    field name to an `attrgetter` for it. ``primary_key`` contains the names
+    of the attributes that make up the primary key, and ``relationships``
+    maps the names of relationship attributes to their `RelationshipProperty`s.
+
+    Building a plan requires introspecting the entity class, so plans
+    should be retrieved via :func:`get_field_plan`, which caches them. Plans
+    don't hold strong references to the entity (``columns`` contains table
+    columns rather than the entity's annotated columns, and relationships
+    are looked up from the mapper), so caching them doesn't keep entity
+    classes alive.
+
+    """
+
+    def __init__(self, entity):
+        configure_mappers()
+        columns = {}
+        properties = []
+        for name in dir(entity):
+            if name.startswith('_'):
+                continue
+            attr = getattr(entity, name)
+            if isinstance(attr, property):
+                properties.append(name)
+            else:
+                try:
+                    clause_el = attr.__clause_element__()
+                except AttributeError:
+                    pass
+                else:
+                    if issubclass(clause_el.__class__, Column):
+                        prop = getattr(attr, 'property', None)
+                        prop_columns = getattr(prop, 'columns', None)
+                        columns[name] = (
+                            prop_columns[0] if prop_columns else clause_el)
+        try:
+            mapper = class_mapper(entity)
+        except UnmappedClassError:
+            primary_key = ()
+        else:
+            primary_key = tuple(
+                mapper.get_property_by_column(c).key
+                for c in mapper.primary_key)
+        self._entity = ref(entity)
+        self.columns = columns
+        self.primary_key = primary_key
+        self.properties = tuple(properties)
+        self.names = tuple(sorted(set(columns).union(properties)))
+        self.getters = dict((name, attrgetter(name)) for name in self.names)
+
+    @property
+    def entity(self):
+        return self._entity()
+
+    @property
+    def relationships(self):
+        try:
+            mapper = class_mapper(self.entity)
+        except UnmappedClassError:
+            return {}
+        return dict((r.key, r) for r in mapper.relationships)
+
+
+_field_plans = WeakKeyDictionary()
+
+
+class ReadState(object):
+    """The state of a context's most recent read.
+
+    A new one is created by each call to
+    :meth:`SQLAlchemyORMContext.get_collection_query`,
+    :meth:`SQLAlchemyORMContext.get_baked_collection`, and
+    :meth:`SQLAlchemyORMContext.get_member`, and it's used when the result
+    is serialized. ``embedded`` contains the names of the embedded
+    relationships, ``info`` is the collection info included when wrapping
+    (e.g., ``total_count`` and ``next_cursor``), and ``cursor_limit`` is
+    the page size when keyset pagination is used. ``paged`` indicates
+    whether keyset pagination is used.
+
+    """
+
+    def __init__(self, embedded=(), paged=False, cursor_limit=None):
+        self.embedded = embedded
+        self.paged = paged
+        self.cursor_limit = cursor_limit
+        self.info = {}
+        if paged:
+            self.info['next_cursor'] = None
+
+
+def get_field_plan(entity):
+    """Get the :class:`FieldPlan` for ``entity``.
+
+    Plans are computed once per entity class and cached until the entity's
+    mapper is (re)configured or :func:`clear_field_plans` is called.
+
+    """
+    try:
+        return _field_plans[entity]
+    except KeyError:
+        plan = _field_plans[entity] = FieldPlan(entity)
+        return plan
+
+
+def clear_field_plans():
+    """Clear all cached field plans (and the serializers built from them)."""
+    _field_plans.clear()
+    _member_serializers.clear()
+
+
+@event.listens_for(Mapper, 'mapper_configured')
+def _invalidate_field_plan(mapper, class_):
+    if _field_plans.pop(class_, None) is not None:
+        _member_serializers.clear()
+
+
+def get_type_converter(type_):
+    """Get a function that makes values of ``type_`` JSON encodable.
+
+    Returns ``None`` when values of ``type_`` can be passed to the JSON
+    encoder as-is (or when the type is unknown, in which case it's left up
+    to the encoder).
+
+    """
+    if isinstance(type_, Numeric):
+        return str if type_.asdecimal else None
+    if isinstance(type_, (Date, DateTime, Time)):
+        return str
+    return None
+
+
+def get_arrow_type(type_):
+    """Get the Arrow type for values of the SQLAlchemy type ``type_``.
+
+    Returns ``None`` when the Arrow type should be inferred from the values
+    instead. Requires pyarrow.
+
+    """
+    if isinstance(type_, Boolean):
+        return pyarrow.bool_()
+    if isinstance(type_, Integer):
+        return pyarrow.int64()
+    if isinstance(type_, Numeric):
+        if not type_.asdecimal:
+            return pyarrow.float64()
+        precision = type_.precision
+        if precision is not None and precision <= 38:
+            return pyarrow.decimal128(precision, type_.scale or 0)
+        return None
+    if isinstance(type_, DateTime):
+        return None if type_.timezone else pyarrow.timestamp('us')
+    if isinstance(type_, Date):
+        return pyarrow.date32()
+    if isinstance(type_, Time):
+        return pyarrow.time64('us')
+    if isinstance(type_, String):
+        return pyarrow.string()
+    if isinstance(type_, LargeBinary):
+        return pyarrow.binary()
+    return None
+
+
+class MemberSerializer(object):
+    """Converts members of an entity to dicts for a given list of fields.
+
+    Values are fetched with a single `attrgetter` call, and values of
+    column fields are converted according to the column's type up front
+    (e.g., decimals and datetimes are converted to strings), so the JSON
+    encoder's `default` hook doesn't need to be consulted for them.
+
+    ``embed`` is a list of relationships whose related members will be
+    included as nested objects (or lists of objects), using the column
+    fields of the related entity (properties are left out, since they may
+    load other relationships). Only one level of nesting is supported.
+
+    When ``convert_types`` is false, column values are left as-is (for
+    formats that support decimals, dates, etc natively).
+
+    Serializers should be retrieved via :func:`get_member_serializer`,
+    which caches them.
+
+    """
+
+    def __init__(self, plan, fields, embed=(), convert_types=True):
+        fields = tuple(fields)
+        fields += tuple(name for name in embed if name not in fields)
+        if len(fields) == 1:
+            getter = attrgetter(fields[0])
+            self.get_values = lambda member: (getter(member),)
+        elif fields:
+            self.get_values = attrgetter(*fields)
+        else:
+            self.get_values = lambda member: ()
+        converters = []
+        for i, name in enumerate(fields):
+            if name in embed:
+                converter = self._get_embed_converter(
+                    plan, name, convert_types)
+            else:
+                column = plan.columns.get(name)
+                if column is None or not convert_types:
+                    continue
+                converter = get_type_converter(column.type)
+            if converter is not None:
+                converters.append((i, converter))
+        self.fields = fields
+        self.converters = tuple(converters)
+
+    def _get_embed_converter(self, plan, name, convert_types=True):
+        relationship = plan.relationships[name]
+        related_entity = relationship.mapper.class_
+        related_fields = tuple(sorted(get_field_plan(related_entity).columns))
+        serialize = get_member_serializer(
+            related_entity, related_fields, convert_types=convert_types)
+        if relationship.uselist:
+            return lambda members: [serialize(m) for m in members]
+        return serialize
+
+    def to_row(self, member):
+        """Get converted values for ``member`` in field order."""
+        values = self.get_values(member)
+        if self.converters:
+            values = list(values)
+            for i, convert in self.converters:
+                value = values[i]
+                if value is not None:
+                    values[i] = convert(value)
+        return values
+
+    def __call__(self, member):
+        return dict(zip(self.fields, self.to_row(member)))
+
+
+_member_serializers = WeakKeyDictionary()
+
+
+def get_member_serializer(entity, fields, embed=(), convert_types=True):
+    """Get a :class:`MemberSerializer` for ``entity``, ``fields``, and
+    ``embed``.
+
+    Like field plans, serializers are cached per entity (and discarded when
+    the entity is), in a bounded LRU cache keyed by fields, embedded
+    relationships, and ``convert_types``. ``fields`` can be a set, in which
+    case the fields will be sorted.
+
+    """
+    if isinstance(fields, (set, frozenset)):
+        fields = tuple(sorted(fields))
+    else:
+        fields = tuple(fields)
+    embed = tuple(embed)
+    try:
+        serializers = _member_serializers[entity]
+    except KeyError:
+        serializers = _member_serializers[entity] = LRUCache(maxsize=64)
+    key = (fields, embed, convert_types)
+    serializer = serializers.get(key)
+    if serializer is None:
+        serializer = MemberSerializer(
+            get_field_plan(entity), fields, embed, convert_types)
+        serializers.set(key, serializer)
+    return serializer
+
+
+def get_request_session(request, sessionmaker):
+    """Get the session created by ``sessionmaker`` for ``request``.
+
+    The session is created the first time it's requested and shared by all
+    of the contexts that use the same ``sessionmaker`` during the request.
+    It's closed when the request is finished, which rolls back anything
+    that wasn't committed and returns its connection to the engine's pool
+    (sessions only check out a connection when they're first used), unless
+    it was detached via :func:`detach_request_session`.
+
+    """
+    sessions = request.environ.setdefault('pyramid_restler.sessions', {})
+    session = sessions.get(sessionmaker)
+    if session is None:
+        session = sessions[sessionmaker] = sessionmaker()
+
+        def close(request):
+            if sessions.get(sessionmaker) is session:
+                del sessions[sessionmaker]
+                session.close()
+
+        request.add_finished_callback(close)
+    return session
+
+
+def detach_request_session(request, sessionmaker):
+    """Take over closing the session created by ``sessionmaker``.
+
+    The session won't be closed when ``request`` is finished, so the
+    caller has to close it. This is used for streamed responses, since
+    finished callbacks are called before the WSGI server iterates over the
+    response's ``app_iter``. Returns the session or ``None`` if there's no
+    session (or it was already detached).
+
+    """
+    sessions = request.environ.get('pyramid_restler.sessions', {})
+    return sessions.pop(sessionmaker, None)
+
+
+after_commit_key = 'pyramid_restler.after_commit'
+
+
+def add_after_commit_callback(session, callback):
+    """Call ``callback`` after ``session``'s transaction is next committed.
+
+    ``session`` can be a `Session` or a `scoped_session` (in which case the
+    current session is used). Pending callbacks are kept in the session's
+    ``info`` and discarded when the session is rolled back.
+
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    session.info.setdefault(after_commit_key, []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(session):
+    callbacks = session.info.pop(after_commit_key, None)
+    if callbacks:
+        for callback in callbacks:
+            callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit_callbacks(session):
+    session.info.pop(after_commit_key, None)
+
+
+# Exact counts are cached per entity generation (see
+# SQLAlchemyORMContext.invalidate_counts).
+_count_generations = WeakKeyDictionary()
+_count_generation_counter = itertools.count(1)
+
+
 class DefaultJSONEncoder(json.JSONEncoder):
 
     def default(self, obj):
         """Convert ``obj`` to something JSON encoder can handle."""
         if isinstance(obj, NamedTuple):
-            obj = dict((k, getattr(obj, k)) for k in obj.keys())
+            obj = dict(obj._asdict())
         elif isinstance(obj, decimal.Decimal):
             obj = str(obj)
         elif isinstance(obj, datetime_types):
@@ -36,18 +425,147 @@ class SQLAlchemyORMContext(object):
 
     json_encoder = DefaultJSONEncoder
 
+    stream_batch_size = 100
+
+    encode_executor = None
+
+    encode_threshold = 10000
+
+    encode_chunk_size = 5000
+
+    arrow_batch_size = 65536
+
+    cursor_fields = None
+
+    count_cache = TTLCache(maxsize=1024, ttl=30)
+
+    version_field = None
+
+    last_modified_field = None
+
+    direct_writes = False
+
+    commit_strategy = 'immediate'
+
+    sessionmaker = None
+
+    bake_queries = False
+
+    bakery = baked.bakery(size=512)
+
+    query_shapes = LRUCache(maxsize=512)
+
+    embeddable = {}
+
+    default_embed = ()
+
+    changed_fields = ()
+
+    loader_strategies = {
+        'joined': joinedload,
+        'selectin': selectinload,
+        'subquery': subqueryload,
+    }
+
     def __init__(self, request):
         self.request = request
 
+    @reify
+    def json_backend(self):
+        """The :class:`IJSONBackend` used to encode JSON."""
+        return get_request_json_backend(self.request)
+
+    @reify
+    def json_default(self):
+        """The `default` hook passed to :attr:`json_backend`.
+
+        This is taken from an instance of :attr:`json_encoder`, which is
+        created once per context.
+
+        """
+        return self.json_encoder().default
+
     @reify
     def session(self):
         return self.session_factory()
 
     def session_factory(self):
-        return self.request.db_session
+        """Get the session for the request.
+
+        By default, this is ``request.db_session``. If :attr:`sessionmaker`
+        is set, it's used instead to create a session for the request (see
+        :func:`get_request_session`).
+
+        """
+        if self.sessionmaker is None:
+            return self.request.db_session
+        return get_request_session(self.request, self.sessionmaker)
+
+    def _commit(self):
+        """End a write according to :attr:`commit_strategy`.
+
+        - 'immediate' (the default) commits the session right away.
+        - 'flush' only flushes the session; committing is left to the
+          application (e.g., pyramid_tm).
+        - 'deferred' flushes the session and commits it once, after the
+          view has returned (see :meth:`defer_commit`), so multiple writes
+          made during a request are committed together.
+
+        The session is always flushed, so generated IDs are available and
+        integrity errors are raised by the method that caused them.
+
+        """
+        strategy = self.commit_strategy
+        if strategy == 'immediate':
+            self.session.commit()
+        elif strategy == 'flush':
+            self.session.flush()
+        elif strategy == 'deferred':
+            self.defer_commit()
+            self.session.flush()
+        else:
+            raise ValueError('Unknown commit strategy: {0}'.format(strategy))
+        self.after_commit(self.invalidate_counts)
+
+    def defer_commit(self):
+        """Commit the session after the view has returned.
+
+        The session is added to the request's deferred commits, which are
+        committed by
+        :func:`pyramid_restler.tweens.deferred_commit_tween_factory` if the
+        response is successful (i.e., its status is less than 400) and
+        rolled back otherwise. The tween is added by `includeme`; a
+        `RuntimeError` is raised if it isn't active for the request.
+
+        """
+        deferred = self.request.environ.get(deferred_commits_key)
+        if deferred is None:
+            raise RuntimeError(
+                "The 'deferred' commit strategy requires pyramid_restler's "
+                "tween; use config.include('pyramid_restler')")
+        session = self.session
+        if not any(s is session for s in deferred):
+            deferred.append(session)
+
+    def after_commit(self, callback):
+        """Call ``callback`` once the current writes have been committed.
+
+        With the 'immediate' :attr:`commit_strategy`, writes have already
+        been committed, so ``callback`` is called right away. Otherwise,
+        it's called when the session is next committed (and discarded if
+        the session is rolled back instead). Views use this to invalidate
+        cached responses only once the new data is visible to other
+        requests.
+
+        """
+        if self.commit_strategy == 'immediate':
+            callback()
+        else:
+            add_after_commit_callback(self.session, callback)
 
     def get_collection(self, distinct=False, order_by=None, limit=None,
-                       offset=None, filters=None):
+                       offset=None, filters=None, fields=None, cursor=None,
+                       count=None, embed=None):
         """Get the entire collection or a subset of it.
 
         By default, this will fetch all records for :attr:`entity`. Various
@@ -74,10 +592,84 @@ class SQLAlchemyORMContext(object):
         second case, a simple `filter_by(key=value)` is applied to the
         query.
 
+        If ``fields`` is passed and every field it names is a mapped column,
+        only those columns will be queried, and the collection will consist
+        of named tuples instead of ORM instances. This avoids the overhead
+        of loading full instances when only a few of their attributes are
+        needed. If any field isn't a column (e.g., it's a Python property),
+        full instances are loaded.
+
+        Passing a ``cursor`` enables keyset pagination, which costs the same
+        no matter how deep into the collection the requested page is (unlike
+        ``offset``). The collection will be ordered by :attr:`cursor_fields`
+        (the primary key by default), which must uniquely identify members.
+        Pass an empty string to get the first page. When the page is full
+        (i.e., it contains ``limit`` members), an opaque ``next_cursor`` is
+        added to :attr:`collection_info` (and hence to the wrapped JSON
+        result); passing it back fetches the next page. ``order_by`` can't
+        be used with ``cursor``.
+
+        ``count`` can be used to add the ``total_count`` of the (filtered)
+        collection to :attr:`collection_info`. By default, or when it's
+        ``'none'``, no count is done. When it's ``'exact'``, a separate
+        count query is run using the same filters; the result is cached in
+        :attr:`count_cache` for a short time (or until the context writes to
+        the entity; see :meth:`invalidate_counts`), so paging through a
+        collection doesn't re-count on every page. When it's
+        ``'estimated'``, the planner's estimate is used on PostgreSQL (other
+        databases fall back to an exact count).
+
+        ``embed`` is a list of relationships to load eagerly and include in
+        each member as nested objects (see :meth:`get_embed`). When it's
+        ``None``, :attr:`default_embed` is used.
+
+        When :attr:`bake_queries` is set, collection queries that don't use
+        ``cursor``, ``count``, or {key}_filter methods are built with
+        :meth:`get_baked_collection`, so repeated requests with the same
+        shape skip query construction and SQL compilation.
+
         """
-        q = self.session.query(self.entity)
+        q = None
+        if self.bake_queries and cursor is None and count in (None, 'none'):
+            q = self.get_baked_collection(
+                distinct=distinct, order_by=order_by, limit=limit,
+                offset=offset, filters=filters, fields=fields, embed=embed)
+        if q is None:
+            q = self.get_collection_query(
+                distinct=distinct, order_by=order_by, limit=limit,
+                offset=offset, filters=filters, fields=fields, cursor=cursor,
+                count=count, embed=embed)
+        collection = q.all()
+        if self.read_state.paged:
+            last = collection[-1] if collection else None
+            self.update_next_cursor(last, len(collection))
+        return collection
+
+    def get_collection_query(self, distinct=False, order_by=None, limit=None,
+                             offset=None, filters=None, fields=None,
+                             cursor=None, count=None, embed=None):
+        """Build the query used by :meth:`get_collection`.
+
+        This accepts the same args as :meth:`get_collection` but returns the
+        `Query` instead of executing it, so that the results can be fetched
+        lazily (e.g., when streaming a response).
+
+        """
+        if cursor is not None and order_by is not None:
+            raise InvalidQuery('order_by cannot be used with cursor')
+
+        state = ReadState(
+            self.get_embed(embed), paged=cursor is not None,
+            cursor_limit=limit if cursor is not None else None)
+        fields = self.get_query_fields(fields, cursor)
 
-        # XXX: Handle joined loads here?
+        # Embedded relationships require full instances.
+        columns = None if state.embedded else self.get_query_columns(fields)
+        if columns is None:
+            q = self.session.query(self.entity)
+            q = q.options(*self.get_loader_options(state.embedded))
+        else:
+            q = self.session.query(*columns).select_from(self.entity)
 
         # Apply "global" (i.e., every request) filters
         if hasattr(self, 'filters'):
@@ -96,6 +688,13 @@ class SQLAlchemyORMContext(object):
 
         if distinct:
             q = q.distinct()
+
+        if count not in (None, 'none'):
+            state.info['total_count'] = self.count_collection(q, count)
+
+        if cursor is not None:
+            q = self.apply_cursor(q, cursor)
+
         if order_by is not None:
             q = q.order_by(*order_by)
         if offset is not None:
@@ -103,35 +702,679 @@ class SQLAlchemyORMContext(object):
         if limit is not None:
             q = q.limit(limit)
 
-        return q.all()
+        self.read_state = state
+        return q
+
+    def get_baked_collection(self, distinct=False, order_by=None,
+                             limit=None, offset=None, filters=None,
+                             fields=None, embed=None):
+        """Get a collection result using a cached, precompiled query.
+
+        Queries are cached by :attr:`bakery` by shape: the context class,
+        the keys (but not values) of ``filters``, ``distinct``,
+        ``order_by``, whether ``limit`` and ``offset`` are present, the
+        queried fields, and the embedded relationships. Each shape is
+        built and compiled once; after that, only the filter values,
+        limit, and offset are bound. Shapes are also recorded in
+        :attr:`query_shapes`, whose ``stats()`` gives the number of hits
+        (shapes that were already baked) and misses.
+
+        Returns ``None`` when the query can't be baked (i.e., when a filter
+        has a {key}_filter method, whose result may depend on the value,
+        when ``order_by`` contains anything other than names, or when the
+        instance's global :attr:`filters` differ from its class's, since
+        the shape doesn't include them).
+
+        """
+        cls = self.__class__
+        if vars(self).get('filters', None) is not None:
+            if self.filters is not getattr(cls, 'filters', None):
+                return None
+        filters = filters or {}
+        entity = self.entity
+        for k in filters:
+            if hasattr(entity, '{0}_filter'.format(k)):
+                return None
+        if order_by is not None:
+            if not all(isinstance(o, string_types) for o in order_by):
+                return None
+            order_by = tuple(order_by)
+        state = ReadState(self.get_embed(embed))
+        fields = self.get_query_fields(fields)
+        shape = (
+            cls, tuple(sorted(filters)), bool(distinct), order_by,
+            limit is not None, offset is not None,
+            None if fields is None else tuple(fields), state.embedded)
+        query_shapes = self.query_shapes
+        if query_shapes.get(shape) is None:
+            query_shapes.set(shape, True)
+        baked_query = self.bake_collection_query(shape)
+        params = dict(('filter_{0}'.format(k), v) for k, v in filters.items())
+        if limit is not None:
+            params['limit'] = limit
+        if offset is not None:
+            params['offset'] = offset
+        self.read_state = state
+        return baked_query(self.session).params(**params)
+
+    def bake_collection_query(self, shape):
+        """Create a `BakedQuery` for the collection query ``shape``.
+
+        This is cheap: :attr:`bakery` caches the built `Query` and its
+        compiled SQL by ``shape``, so the steps added here only run the
+        first time a shape is seen. See :meth:`get_baked_collection`.
+
+        """
+        (_, filter_keys, distinct, order_by, has_limit, has_offset, fields,
+         embed) = shape
+        # Only capture what the shape determines, since baked queries are
+        # shared by all requests.
+        entity = self.entity
+        global_filters = tuple(getattr(self, 'filters', ()))
+        columns = None if embed else self.get_query_columns(fields)
+        if columns is None:
+            options = self.get_loader_options(embed)
+            baked_query = self.bakery(
+                lambda s: s.query(entity).options(*options), shape)
+        else:
+            baked_query = self.bakery(
+                lambda s: s.query(*columns).select_from(entity), shape)
+        if global_filters:
+            baked_query += lambda q: q.filter(*global_filters)
+        if filter_keys:
+            baked_query += lambda q: q.filter_by(**dict(
+                (k, bindparam('filter_{0}'.format(k))) for k in filter_keys))
+        if distinct:
+            baked_query += lambda q: q.distinct()
+        if order_by is not None:
+            baked_query += lambda q: q.order_by(*order_by)
+        if has_offset:
+            baked_query += lambda q: q.offset(bindparam('offset'))
+        if has_limit:
+            baked_query += lambda q: q.limit(bindparam('limit'))
+        return baked_query
+
+    def get_query_fields(self, fields, cursor=None):
+        """Get the fields to query when ``fields`` are requested.
+
+        This makes sure the fields needed to compute validators (and the
+        next cursor when ``cursor`` is passed) are selected too.
+
+        """
+        if not fields:
+            return fields
+        extra = list(self.get_validator_fields())
+        if cursor is not None:
+            extra.extend(self.get_cursor_fields())
+        fields = list(fields)
+        fields.extend(f for f in extra if f not in fields)
+        return fields
+
+    def get_query_columns(self, fields):
+        """Get labeled column expressions for ``fields``.
+
+        Returns ``None`` if ``fields`` is ``None`` or if any of the fields
+        isn't a mapped column.
+
+        """
+        if not fields:
+            return None
+        columns = self.field_plan.columns
+        if not all(name in columns for name in fields):
+            return None
+        entity = self.entity
+        return [getattr(entity, name).label(name) for name in fields]
+
+    def count_collection(self, q, mode='exact'):
+        """Count the rows selected by ``q`` using the specified ``mode``.
+
+        See :meth:`get_collection` for a description of the modes.
+
+        """
+        bind = self.session.get_bind()
+        if mode == 'estimated':
+            if bind.dialect.name == 'postgresql':
+                return self.estimate_count(q)
+        elif mode != 'exact':
+            raise InvalidQuery('Unknown count mode: {0}'.format(mode))
+        # The statement is compiled *before* ordering, offset, etc are
+        # applied, so the key only depends on what's selected & filters.
+        compiled = q.statement.compile()
+        params = json.dumps(
+            compiled.params, sort_keys=True, cls=self.json_encoder)
+        generation = _count_generations.get(self.entity)
+        key = (bind, generation, str(compiled), params)
+        total = self.count_cache.get(key)
+        if total is None:
+            total = q.order_by(None).count()
+            self.count_cache.set(key, total)
+        return total
+
+    def invalidate_counts(self):
+        """Discard the entity's cached exact counts.
+
+        Counts are keyed by a generation per entity, which this replaces;
+        it's called after every committed write made by the context (see
+        :meth:`after_commit`). Writes made elsewhere are only reflected
+        once cached counts expire.
+
+        """
+        _count_generations[self.entity] = next(_count_generation_counter)
+
+    def estimate_count(self, q):
+        """Get the PostgreSQL planner's row estimate for ``q``."""
+        connection = self.session.connection()
+        statement = q.order_by(None).statement.compile(
+            dialect=connection.dialect)
+        sql = 'EXPLAIN (FORMAT JSON) {0}'.format(statement)
+        execute = getattr(connection, 'exec_driver_sql', connection.execute)
+        plan = execute(sql, statement.params).scalar()
+        if isinstance(plan, string_types):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
 
-    def get_member(self, id):
+    def get_cursor_fields(self):
+        fields = self.cursor_fields
+        if fields is None:
+            fields = self.field_plan.primary_key
+        return tuple(fields)
+
+    def apply_cursor(self, q, cursor):
+        """Order ``q`` by the cursor fields and apply ``cursor`` to it.
+
+        Only rows that sort after the position encoded in ``cursor`` will
+        be selected. An empty ``cursor`` selects from the beginning.
+
+        """
+        columns = [getattr(self.entity, f) for f in self.get_cursor_fields()]
+        if cursor:
+            values = self.decode_cursor(cursor)
+            if len(values) != len(columns):
+                raise InvalidQuery('Invalid cursor')
+            clauses = []
+            for i, column in enumerate(columns):
+                clause = [c == v for c, v in zip(columns[:i], values[:i])]
+                clause.append(column > values[i])
+                clauses.append(and_(*clause))
+            q = q.filter(or_(*clauses))
+        return q.order_by(*columns)
+
+    def update_next_cursor(self, last, count):
+        """Set ``next_cursor`` in :attr:`collection_info`.
+
+        ``last`` is the last member in the current page and ``count`` is
+        the number of members in the page. If the page isn't full, there's
+        no next page, and ``next_cursor`` will be set to ``None``.
+
+        """
+        limit = self.read_state.cursor_limit
+        if last is not None and limit is not None and count >= limit:
+            values = [getattr(last, f) for f in self.get_cursor_fields()]
+            next_cursor = self.encode_cursor(values)
+        else:
+            next_cursor = None
+        self.collection_info['next_cursor'] = next_cursor
+
+    def encode_cursor(self, values):
+        data = json.dumps(values, cls=self.json_encoder).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not isinstance(cursor, string_types):
+            raise InvalidQuery('Invalid cursor')
+        cursor = cursor.encode('ascii')
+        cursor += b'=' * (-len(cursor) % 4)
+        try:
+            values = base64.urlsafe_b64decode(cursor).decode('utf-8')
+            values = json.loads(values)
+        except (TypeError, ValueError):
+            raise InvalidQuery('Invalid cursor')
+        if not isinstance(values, list):
+            raise InvalidQuery('Invalid cursor')
+        return values
+
+    def get_validator_fields(self):
+        """Get the fields needed by :meth:`get_validators`."""
+        fields = []
+        if self.version_field is not None:
+            fields.extend(self.field_plan.primary_key)
+            fields.append(self.version_field)
+        if self.last_modified_field is not None:
+            fields.extend(
+                f for f in self.field_plan.primary_key if f not in fields)
+            fields.append(self.last_modified_field)
+        return tuple(fields)
+
+    def get_validators(self, value):
+        """Get cache validators for a member or collection.
+
+        Returns a ``(version, last_modified)`` tuple. ``version`` is a
+        string that changes whenever the IDs or :attr:`version_field`
+        values of the members in ``value`` change, the members embedded in
+        them change, or the :attr:`collection_info` changes.
+        ``last_modified`` is the member's :attr:`last_modified_field` value.
+
+        Either will be ``None`` when the corresponding field isn't set. For
+        collections, ``last_modified`` is always ``None``, since the most
+        recent modification time doesn't change when members are removed;
+        when only :attr:`last_modified_field` is set, the version is
+        computed from the members' IDs and modification times instead. Both
+        will be ``None`` if ``value`` is a `Query`, since computing them
+        would require running the query.
+
+        """
+        if isinstance(value, Query):
+            return None, None
+        is_member = not isinstance(value, Iterable)
+        if is_member:
+            value = [value]
+        version = last_modified = None
+        version_field = self.version_field
+        if version_field is None and not is_member:
+            version_field = self.last_modified_field
+        if version_field is not None:
+            getter = attrgetter(*(
+                self.field_plan.primary_key + (version_field,)))
+            data = [getter(m) for m in value]
+            if self.embedded:
+                # Embedded members aren't versioned, so their values are
+                # included instead.
+                serialize = get_member_serializer(
+                    self.entity, (), self.embedded)
+                data = [[d, serialize(m)] for d, m in zip(data, value)]
+            data = json.dumps(
+                [data, self.collection_info], sort_keys=True,
+                cls=self.json_encoder)
+            version = hashlib.md5(data.encode('utf-8')).hexdigest()
+        if self.last_modified_field is not None and is_member:
+            last_modified = getattr(value[0], self.last_modified_field)
+        return version, last_modified
+
+    def get_embed(self, embed=None):
+        """Validate ``embed`` and return it as a tuple of names.
+
+        ``embed`` is a list of relationships to embed; when it's ``None``,
+        :attr:`default_embed` is used. Only relationships listed in
+        :attr:`embeddable` (which maps relationship names to loader
+        strategies) can be embedded, so clients can't trigger arbitrary
+        joins. A `ValueError` is raised for any other name.
+
+        """
+        if embed is None:
+            embed = self.default_embed
+        if not embed:
+            return ()
+        relationships = self.field_plan.relationships
+        names = []
+        for name in embed:
+            if name not in self.embeddable or name not in relationships:
+                raise InvalidQuery('Cannot embed {0}'.format(name))
+            if name not in names:
+                names.append(name)
+        return tuple(names)
+
+    def get_loader_options(self, embed):
+        """Get the loader options for the relationships in ``embed``.
+
+        The strategy for each relationship is taken from :attr:`embeddable`
+        and must be one of the keys of :attr:`loader_strategies`.
+
+        """
+        options = []
+        for name in embed:
+            strategy = self.embeddable[name]
+            try:
+                loader = self.loader_strategies[strategy]
+            except KeyError:
+                raise ValueError(
+                    'Unknown loader strategy for {0}: {1}'
+                    .format(name, strategy))
+            options.append(loader(getattr(self.entity, name)))
+        return options
+
+    def get_member(self, id, embed=None):
+        state = ReadState(self.get_embed(embed))
         q = self.session.query(self.entity)
+        q = q.options(*self.get_loader_options(state.embedded))
+        self.read_state = state
         return q.get(id)
 
     def create_member(self, data):
         member = self.entity(**data)
         self.session.add(member)
-        self.session.commit()
+        self._commit()
         return member
 
     def update_member(self, id, data):
+        """Update the member identified by ``id`` with ``data``.
+
+        Returns the updated member or ``None`` if the member doesn't exist.
+
+        When :attr:`direct_writes` is set, the member isn't loaded first.
+        Instead, a single UPDATE is issued, and ``id`` is returned if a row
+        was updated (or ``None`` if not). Since the UPDATE bypasses the
+        ORM, a `ValueError` is raised if ``data`` contains fields that
+        aren't column attributes.
+
+        Either way, the member's :attr:`version_field` is bumped (see
+        :meth:`bump_version` and :meth:`get_version_bump`) unless ``data``
+        sets it explicitly.
+
+        """
+        if self.direct_writes and data:
+            self.check_fields(data)
+            q = self.session.query(self.entity)
+            q = q.filter(self.get_ids_clause([id]))
+            count = q.update(
+                self.get_version_bump(data), synchronize_session=False)
+            self._commit()
+            return id if count else None
         member = self.get_member(id)
         if member is None:
             return None
         for name in data:
             setattr(member, name, data[name])
-        self.session.commit()
+        version_field = self.version_field
+        if data and version_field is not None and version_field not in data:
+            self.bump_version(member)
+        self._commit()
         return member
 
+    def check_fields(self, data):
+        """Raise a `ValueError` if ``data`` has fields that aren't columns.
+
+        Field names are checked against the column attributes in
+        :attr:`field_plan`.
+
+        """
+        columns = self.field_plan.columns
+        unknown = sorted(k for k in data if k not in columns)
+        if unknown:
+            raise ValueError('Unknown fields: {0}'.format(', '.join(unknown)))
+
+    def patch_member(self, id, data, version=None):
+        """Update the fields in ``data`` that differ from the member's.
+
+        Incoming values are compared to the loaded values and to their JSON
+        representations (so, e.g., "1.50" matches ``Decimal('1.50')``), and
+        only the fields that differ are set, so only those columns are
+        included in the UPDATE. Their names are stored in
+        :attr:`changed_fields`. When nothing changed, the session isn't
+        committed at all. A `ValueError` is raised for fields that aren't
+        column attributes.
+
+        If ``version`` is passed, it's compared to the member's version as
+        computed by :meth:`get_validators`, and a
+        :class:`pyramid_restler.exceptions.VersionConflict` is raised if
+        they differ. When anything changed, the member's version is bumped
+        via :meth:`bump_version`. To also catch concurrent updates made
+        between the load and the UPDATE, map :attr:`version_field` as the
+        mapper's ``version_id_col``.
+
+        Returns the member or ``None`` if the member doesn't exist. Unlike
+        :meth:`update_member`, this always loads the member first.
+
+        """
+        self.check_fields(data)
+        self.changed_fields = ()
+        member = self.get_member(id)
+        if member is None:
+            return None
+        if version is not None:
+            if self.version_field is None:
+                raise ValueError(
+                    '{0} is not versioned'.format(self.entity.__name__))
+            current_version = self.get_validators(member)[0]
+            if current_version != version:
+                raise VersionConflict(id, current_version, version)
+        changes = self.get_changes(member, data)
+        if changes:
+            if self.version_field is not None:
+                self.bump_version(member)
+            for name in changes:
+                setattr(member, name, changes[name])
+            try:
+                self._commit()
+            except StaleDataError:
+                if self.commit_strategy == 'immediate':
+                    self.session.rollback()
+                raise VersionConflict(id, None, version)
+        self.changed_fields = tuple(sorted(changes))
+        return member
+
+    def bump_version(self, member):
+        """Increment the member's :attr:`version_field` value.
+
+        Nothing is done when :attr:`version_field` is mapped as the mapper's
+        ``version_id_col``, since the ORM increments it on flush. Otherwise,
+        the field must hold an integer (or ``None``); a `ValueError` is
+        raised if it doesn't.
+
+        """
+        name = self.version_field
+        mapper = class_mapper(self.entity)
+        version_id_col = mapper.version_id_col
+        if version_id_col is not None:
+            if mapper.get_property_by_column(version_id_col).key == name:
+                return
+        current = getattr(member, name)
+        if current is None:
+            current = 0
+        elif isinstance(current, bool) or not isinstance(
+                current, integer_types):
+            raise ValueError(
+                '{0}.{1} must be an integer or the version_id_col'.format(
+                    self.entity.__name__, name))
+        setattr(member, name, current + 1)
+
+    def get_version_bump(self, data):
+        """Add an increment of :attr:`version_field` to ``data``.
+
+        This is used for bulk UPDATEs, which bypass the ORM, so neither
+        :meth:`bump_version` nor the mapper's version counter applies. The
+        field is incremented in SQL (``NULL`` counts as 0), so it must be an
+        integer column. Returns a new dict or ``data`` itself when there's
+        no :attr:`version_field`, when ``data`` already sets it, or when the
+        version is generated by the database (i.e., ``version_id_generator``
+        is ``False``).
+
+        """
+        name = self.version_field
+        if name is None or name in data:
+            return data
+        mapper = class_mapper(self.entity)
+        version_id_col = mapper.version_id_col
+        if (version_id_col is not None and
+                mapper.version_id_generator is False and
+                mapper.get_property_by_column(version_id_col).key == name):
+            return data
+        data = dict(data)
+        data[name] = func.coalesce(getattr(self.entity, name), 0) + 1
+        return data
+
+    def get_changes(self, member, data):
+        """Get the items in ``data`` whose values differ from ``member``'s."""
+        names = tuple(sorted(data))
+        raw = get_member_serializer(
+            self.entity, names, convert_types=False).to_row(member)
+        converted = get_member_serializer(self.entity, names).to_row(member)
+        changes = {}
+        for name, raw_value, converted_value in zip(names, raw, converted):
+            value = data[name]
+            if value != raw_value and value != converted_value:
+                changes[name] = value
+        return changes
+
     def delete_member(self, id):
+        """Delete the member identified by ``id``.
+
+        Returns the deleted member or ``None`` if the member doesn't exist.
+
+        When :attr:`direct_writes` is set, the member isn't loaded first.
+        Instead, a single DELETE is issued, and ``id`` is returned if a row
+        was deleted (or ``None`` if not). Note that this bypasses ORM-level
+        cascades.
+
+        """
+        if self.direct_writes:
+            q = self.session.query(self.entity)
+            q = q.filter(self.get_ids_clause([id]))
+            count = q.delete(synchronize_session=False)
+            self._commit()
+            return id if count else None
         member = self.get_member(id)
         if member is None:
             return None
         self.session.delete(member)
-        self.session.commit()
+        self._commit()
         return member
 
+    def create_members(self, data):
+        """Create multiple members with a single commit.
+
+        ``data`` is a list of dicts. Items that are invalid (i.e., that
+        aren't dicts or that contain keys that aren't column attributes)
+        are skipped. Valid items are inserted in bulk via
+        `Session.bulk_insert_mappings`.
+
+        Returns a list containing a dict for each item, in the same order,
+        with either the ``id`` of the new member or an ``error`` message.
+
+        If the insert violates a constraint (e.g., an ID already exists),
+        none of the items are created, the session is rolled back (when the
+        :attr:`commit_strategy` is 'immediate'), and a
+        :class:`pyramid_restler.exceptions.IntegrityConflict` is raised.
+
+        """
+        columns = self.field_plan.columns
+        results = []
+        mappings = []
+        for item in data:
+            if not isinstance(item, dict):
+                results.append({'error': 'Expected an object'})
+                continue
+            unknown = sorted(k for k in item if k not in columns)
+            if unknown:
+                message = 'Unknown fields: {0}'.format(', '.join(unknown))
+                results.append({'error': message})
+                continue
+            mapping = dict(item)
+            results.append(mapping)
+            mappings.append(mapping)
+        if mappings:
+            try:
+                self.insert_mappings(mappings)
+                self._commit()
+            except IntegrityError as exc:
+                if self.commit_strategy == 'immediate':
+                    self.session.rollback()
+                raise IntegrityConflict(str(exc.orig))
+        pk = self.field_plan.primary_key
+        for i, result in enumerate(results):
+            if 'error' not in result:
+                id = [result.get(name) for name in pk]
+                results[i] = {'id': id[0] if len(id) == 1 else id}
+        return results
+
+    def insert_mappings(self, mappings):
+        """Insert ``mappings``, setting their generated primary keys.
+
+        Mappings that contain the whole primary key don't need anything
+        returned, so they're inserted via `Session.bulk_insert_mappings`,
+        which uses executemany. For the others, the new IDs are needed:
+        when the database supports executemany with RETURNING (e.g.,
+        PostgreSQL with SQLAlchemy 1.4+), they're inserted that way;
+        otherwise, they're inserted one row at a time.
+
+        """
+        pk = self.field_plan.primary_key
+        complete = []
+        groups = OrderedDict()
+        for mapping in mappings:
+            if all(mapping.get(name) is not None for name in pk):
+                complete.append(mapping)
+            else:
+                for name in pk:
+                    mapping.pop(name, None)
+                groups.setdefault(frozenset(mapping), []).append(mapping)
+        if groups:
+            self._insert_returning_ids(list(groups.values()))
+        if complete:
+            self.session.bulk_insert_mappings(self.entity, complete)
+
+    def _insert_returning_ids(self, groups):
+        entity = self.entity
+        mapper = class_mapper(entity)
+        connection = self.session.connection(mapper=mapper)
+        returning = (
+            len(mapper.tables) == 1 and
+            getattr(connection.dialect, 'insert_executemany_returning', False))
+        if not returning:
+            for group in groups:
+                self.session.bulk_insert_mappings(
+                    entity, group, return_defaults=True)
+            return
+        columns = self.field_plan.columns
+        pk = self.field_plan.primary_key
+        pk_columns = [columns[name] for name in pk]
+        statement = mapper.local_table.insert().returning(*pk_columns)
+        for group in groups:
+            params = [
+                dict((columns[name].key, value)
+                     for name, value in mapping.items())
+                for mapping in group]
+            rows = connection.execute(statement, params).fetchall()
+            for mapping, row in zip(group, rows):
+                mapping.update(zip(pk, row))
+
+    def update_members(self, ids, data):
+        """Update the members identified by ``ids`` with a single UPDATE.
+
+        The same ``data`` is applied to all of the members, and their
+        :attr:`version_field` values are bumped (see
+        :meth:`get_version_bump`). Returns the number of members that were
+        updated. A `ValueError` is raised if ``data`` is empty or contains
+        fields that aren't column attributes.
+
+        """
+        if not data:
+            raise ValueError('No fields to update')
+        self.check_fields(data)
+        if not ids:
+            return 0
+        q = self.session.query(self.entity).filter(self.get_ids_clause(ids))
+        count = q.update(
+            self.get_version_bump(data), synchronize_session=False)
+        self._commit()
+        return count
+
+    def delete_members(self, ids):
+        """Delete the members identified by ``ids`` with a single DELETE.
+
+        Returns the number of members that were deleted.
+
+        """
+        if not ids:
+            return 0
+        q = self.session.query(self.entity).filter(self.get_ids_clause(ids))
+        count = q.delete(synchronize_session=False)
+        self._commit()
+        return count
+
+    def get_ids_clause(self, ids):
+        """Get a clause that selects the members identified by ``ids``.
+
+        For entities with a composite primary key, each ID must be a
+        sequence of values.
+
+        """
+        entity = self.entity
+        pk = self.field_plan.primary_key
+        columns = [getattr(entity, name) for name in pk]
+        if len(columns) == 1:
+            return columns[0].in_(ids)
+        return tuple_(*columns).in_([tuple(id) for id in ids])
+
     def get_member_id(self, member):
         pk = member._sa_instance_state.key
         if pk is None:
@@ -149,7 +1392,7 @@ class SQLAlchemyORMContext(object):
         else:
             return json.dumps(id, cls=self.json_encoder)
 
-    def to_json(self, value, fields=None, wrap=True):
+    def to_json(self, value, fields=None, wrap=True, columnar=False):
         """Convert instance or sequence of instances to JSON.
 
         ``value`` is a single ORM instance or an iterable that yields
@@ -160,48 +1403,419 @@ class SQLAlchemyORMContext(object):
         ``wrap`` indicates whether or not the result should be wrapped or
         returned as-is.
 
+        ``columnar`` selects a compact format that doesn't repeat the field
+        names for every member: ``{"fields": [...], "rows": [[...], ...]}``,
+        where each row contains a member's values in field order. When
+        wrapped, ``result_count`` and :attr:`collection_info` are added to
+        this object.
+
+        The JSON is encoded by :attr:`json_backend` and returned as UTF-8
+        bytes.
+
+        If :attr:`encode_executor` is set to a `concurrent.futures`
+        executor, collections with at least :attr:`encode_threshold`
+        members are encoded in chunks of :attr:`encode_chunk_size` members
+        by the executor (see :meth:`to_json_offloaded`).
+
         """
-        obj = self.get_json_obj(value, fields, wrap)
-        return json.dumps(obj, cls=self.json_encoder)
+        executor = self.encode_executor
+        if executor is not None and isinstance(value, (list, tuple)):
+            if len(value) >= self.encode_threshold and not columnar:
+                return self.to_json_offloaded(value, fields, wrap)
+        obj = self.get_json_obj(value, fields, wrap, columnar)
+        return self.json_backend.dumps(obj, self.json_default)
+
+    def to_json_offloaded(self, value, fields=None, wrap=True):
+        """Convert a list of instances to JSON using :attr:`encode_executor`.
 
-    def get_json_obj(self, value, fields, wrap):
+        Members are converted to dicts in the calling thread, since that
+        requires access to the ORM instances, and then the dicts are split
+        into chunks that are encoded by the executor. The encoded chunks
+        are joined and inserted into the envelope.
+
+        A `ProcessPoolExecutor` can be used with any JSON backend; chunks
+        are pickled to send them to worker processes, so this only pays
+        off for large collections (see `benchmarks/offload.py`). A
+        `ThreadPoolExecutor` only helps if the backend releases the GIL
+        while encoding.
+
+        """
+        if fields is None:
+            fields = self.default_fields
+        serialize = self.get_member_serializer(fields)
+        items = [serialize(m) for m in value]
+        size = self.encode_chunk_size
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        encode = partial(
+            encode_json_items, self.json_backend.name, self.json_encoder)
+        results = b','.join(
+            chunk for chunk in self.encode_executor.map(encode, chunks)
+            if chunk)
+        results = b''.join((b'[', results, b']'))
+        if not wrap:
+            return results
+        info = dict(result_count=len(items))
+        info.update(self.collection_info)
+        info = self.json_backend.dumps(info, self.json_default)
+        return b''.join((b'{"results": ', results, b', ', info[1:]))
+
+    def to_json_iter(self, value, fields=None, wrap=True, columnar=False):
+        """Convert instance or sequence of instances to JSON incrementally.
+
+        This is like :meth:`to_json`, but instead of building the entire
+        JSON document in memory, it returns an iterator that yields encoded
+        chunks as members are serialized. The iterator is suitable for use
+        as a response's ``app_iter``.
+
+        If ``value`` is a `Query`, rows will be fetched in batches of
+        :attr:`stream_batch_size` via `Query.yield_per`. When the result is
+        wrapped, ``result_count`` is written *after* the results, since it
+        isn't known until all of the rows have been fetched.
+
+        """
+        if fields is None:
+            fields = self.default_fields
+        value = self.iter_members(value)
+        return self.close_with_stream(
+            self._generate_json_chunks(value, fields, wrap, columnar))
+
+    def to_ndjson_iter(self, value, fields=None):
+        """Convert instance or sequence of instances to newline delimited
+        JSON incrementally.
+
+        Each member is encoded as a JSON object on its own line. Like
+        :meth:`to_json_iter`, this returns an iterator that yields a chunk
+        per :attr:`stream_batch_size` members, so only one batch of members
+        is held in memory at a time.
+
+        """
+        if fields is None:
+            fields = self.default_fields
+        value = self.iter_members(value)
+        return self.close_with_stream(
+            self._generate_ndjson_chunks(value, fields))
+
+    def _generate_ndjson_chunks(self, value, fields):
+        dumps = self.json_backend.dumps
+        default = self.json_default
+        serialize = self.get_member_serializer(fields)
+        batch_size = self.stream_batch_size
+        chunk = []
+        for count, member in enumerate(value, 1):
+            chunk.append(dumps(serialize(member), default))
+            chunk.append(b'\n')
+            if count % batch_size == 0:
+                yield b''.join(chunk)
+                chunk = []
+        yield b''.join(chunk)
+
+    def to_csv_iter(self, value, fields=None):
+        """Convert instance or sequence of instances to CSV incrementally.
+
+        The first row contains the field names. Embedded members are
+        encoded as JSON. Like :meth:`to_json_iter`, this returns an iterator
+        that yields UTF-8 encoded chunks of :attr:`stream_batch_size` rows.
+
+        """
+        value = self.iter_members(value)
+        return self.close_with_stream(self._generate_csv_chunks(value, fields))
+
+    def _generate_csv_chunks(self, value, fields):
+        names, to_row = self.get_row_serializer(fields)
+        dumps = self.json_backend.dumps
+        default = self.json_default
+        embedded = [i for i, name in enumerate(names) if name in self.embedded]
+        buffer = io.StringIO() if PY3 else io.BytesIO()
+        writer = csv.writer(buffer)
+
+        def flush():
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data.encode('utf-8') if PY3 else data
+
+        def encode(row):
+            if PY3:
+                return row
+            return [
+                v.encode('utf-8') if isinstance(v, text_type) else v
+                for v in row]
+
+        def to_cells(row):
+            if embedded:
+                row = list(row)
+                for i in embedded:
+                    row[i] = dumps(row[i], default).decode('utf-8')
+            return encode(row)
+
+        writer.writerow(encode(names))
+        batch_size = self.stream_batch_size
+        for count, member in enumerate(value, 1):
+            writer.writerow(to_cells(to_row(member)))
+            if count % batch_size == 0:
+                yield flush()
+        yield flush()
+
+    def close_with_stream(self, app_iter):
+        """Make ``app_iter`` close the request's session when it's closed.
+
+        When :attr:`sessionmaker` is set, the session would otherwise be
+        closed when the request is finished, before a streamed body is
+        sent, and fetching the remaining rows would check out a connection
+        that's never returned to the pool. Instead, the session is detached
+        from the request (see :func:`detach_request_session`) and closed by
+        the returned iterator's ``close`` method, which the WSGI server
+        calls once the body has been sent.
+
+        """
+        if self.sessionmaker is None:
+            return app_iter
+        session = detach_request_session(self.request, self.sessionmaker)
+        if session is None:
+            return app_iter
+        return ClosingIterator(app_iter, session.close)
+
+    def iter_members(self, value):
+        """Get an iterator over the members in ``value`` for streaming.
+
+        If ``value`` is a `Query`, rows are fetched in batches of
+        :attr:`stream_batch_size` via `Query.yield_per`, which also enables
+        server side cursors on databases that support them. Since joined
+        and subquery eager loading of collections can't be combined with
+        `yield_per`, embedded collections are loaded with `selectinload`
+        instead (i.e., with a query per batch). If ``value`` is a single
+        member, it's wrapped in a list.
+
+        """
+        if isinstance(value, Query):
+            if self.embedded:
+                relationships = self.field_plan.relationships
+                value = value.options(*(
+                    selectinload(getattr(self.entity, name))
+                    for name in self.embedded
+                    if relationships[name].uselist))
+            return value.yield_per(self.stream_batch_size)
+        elif not isinstance(value, Iterable):
+            return [value]
+        return value
+
+    def to_msgpack(self, value, fields=None, wrap=True, columnar=False):
+        """Convert instance or sequence of instances to MessagePack.
+
+        The args are the same as for :meth:`to_json`, and the structure of
+        the result is the same too.
+
+        """
+        obj = self.get_json_obj(value, fields, wrap, columnar)
+        return msgpack.packb(obj, default=self.json_default, use_bin_type=True)
+
+    def to_arrow(self, value, fields=None, wrap=True):
+        """Convert instance or sequence of instances to Arrow IPC format.
+
+        The result is an Arrow IPC stream containing a record batch per
+        :attr:`arrow_batch_size` members, with a column per field. Only one
+        batch of rows is held in memory at a time (and if ``value`` is a
+        `Query`, rows are fetched via `Query.yield_per`). Column values
+        aren't converted to strings, so decimals, dates, etc keep their
+        types; the Arrow type of each column field is derived from its
+        SQLAlchemy type (see :func:`get_arrow_type`). When ``wrap`` is set,
+        :attr:`collection_info` is included in the schema's metadata as
+        JSON.
+
+        When all of ``fields`` are columns, the collection consists of
+        rows from a column-only query, and batches are built directly from
+        those rows without loading ORM instances.
+
+        """
+        if fields is None:
+            fields = self.default_fields
+        serializer = get_member_serializer(
+            self.entity, fields, self.embedded, convert_types=False)
+        names = list(serializer.fields)
+        plan_columns = self.field_plan.columns
+        types = [
+            get_arrow_type(plan_columns[name].type)
+            if name in plan_columns else None
+            for name in names]
+        metadata = None
+        if wrap and self.collection_info:
+            info = self.json_backend.dumps(
+                self.collection_info, self.json_default)
+            metadata = {'collection_info': info}
+        sink = pyarrow.BufferOutputStream()
+        writer = None
+        try:
+            for rows in self._iter_arrow_rows(value, serializer.to_row):
+                columns = list(zip(*rows)) if rows else [()] * len(names)
+                arrays = [
+                    pyarrow.array(column, type=type_)
+                    for column, type_ in zip(columns, types)]
+                batch = pyarrow.RecordBatch.from_arrays(arrays, names=names)
+                if writer is None:
+                    # Values in later batches must have the same types as
+                    # those inferred for the first batch.
+                    schema = batch.schema
+                    types = schema.types
+                    if metadata is not None:
+                        schema = schema.with_metadata(metadata)
+                    writer = pyarrow.ipc.new_stream(sink, schema)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        return sink.getvalue().to_pybytes()
+
+    def _iter_arrow_rows(self, value, to_row):
+        # Yields lists of at most arrow_batch_size rows; there's always at
+        # least one (possibly empty) list, so a schema can be written.
+        batch_size = self.arrow_batch_size
+        rows = []
+        empty = True
+        for member in self.iter_members(value):
+            rows.append(to_row(member))
+            if len(rows) == batch_size:
+                yield rows
+                rows = []
+                empty = False
+        if rows or empty:
+            yield rows
+
+    if msgpack is None:  # pragma: no cover
+        # The MessagePack renderer won't be offered.
+        to_msgpack = None
+
+    if pyarrow is None:  # pragma: no cover
+        # The Arrow renderer won't be offered.
+        to_arrow = None
+
+    def _generate_json_chunks(self, value, fields, wrap, columnar=False):
+        dumps = self.json_backend.dumps
+        default = self.json_default
+        if columnar:
+            names, serialize = self.get_row_serializer(fields)
+            chunk = [b'{"fields": ', dumps(names), b', "rows": [']
+        else:
+            serialize = self.get_member_serializer(fields)
+            chunk = [b'{"results": [' if wrap else b'[']
+        batch_size = self.stream_batch_size
+        count = 0
+        member = None
+        for member in value:
+            if count:
+                chunk.append(b', ')
+            chunk.append(dumps(serialize(member), default))
+            count += 1
+            if count % batch_size == 0:
+                yield b''.join(chunk)
+                chunk = []
+        chunk.append(b']')
+        if wrap:
+            if self.read_state.paged:
+                self.update_next_cursor(member, count)
+            chunk.append(b', "result_count": ')
+            chunk.append(dumps(count))
+            for name, item in self.collection_info.items():
+                chunk.extend((b', ', dumps(name), b': ', dumps(item, default)))
+        if wrap or columnar:
+            chunk.append(b'}')
+        yield b''.join(chunk)
+
+    def get_json_obj(self, value, fields, wrap, columnar=False):
         if fields is None:
             fields = self.default_fields
         if not isinstance(value, Iterable):
             value = [value]
-        obj = [self.member_to_dict(m, fields) for m in value]
+        if columnar:
+            names, to_row = self.get_row_serializer(fields)
+            rows = [to_row(m) for m in value]
+            obj = dict(fields=names, rows=rows)
+            if wrap:
+                obj['result_count'] = len(rows)
+                obj.update(self.collection_info)
+            return obj
+        serialize = self.get_member_serializer(fields)
+        obj = [serialize(m) for m in value]
         if wrap:
             obj = self.wrap_json_obj(obj)
         return obj
 
     def wrap_json_obj(self, obj):
-        return dict(
+        wrapped = dict(
             results=obj,
             result_count=len(obj),
         )
+        wrapped.update(self.collection_info)
+        return wrapped
+
+    @reify
+    def read_state(self):
+        """The :class:`ReadState` of the most recent read.
+
+        Each read replaces it with a new one, so nothing carries over from
+        one read to the next.
+
+        """
+        return ReadState()
+
+    @property
+    def collection_info(self):
+        """Extra info about the collection to include when wrapping.
+
+        This is the ``info`` of the :attr:`read_state`, which is populated
+        by :meth:`get_collection` (e.g., with ``next_cursor`` when keyset
+        pagination is used).
+
+        """
+        return self.read_state.info
+
+    @property
+    def embedded(self):
+        """The relationships embedded by the most recent read."""
+        return self.read_state.embedded
 
     def member_to_dict(self, member, fields=None):
+        return self.get_member_serializer(fields)(member)
+
+    def get_member_serializer(self, fields=None):
+        """Get a function that converts a member to a dict.
+
+        The function will include the specified ``fields`` or
+        :attr:`default_fields`, plus the relationships that were embedded
+        by the last call to :meth:`get_collection` or :meth:`get_member`.
+        Override this to customize how members are converted.
+
+        """
         if fields is None:
             fields = self.default_fields
-        return dict((name, getattr(member, name)) for name in fields)
+        return get_member_serializer(self.entity, fields, self.embedded)
+
+    def get_row_serializer(self, fields=None):
+        """Get the field names and a function that converts a member to a
+        list of values in the same order (used for columnar output).
+
+        This uses :meth:`get_member_serializer`, so customizations made
+        there apply to rows too.
+
+        """
+        serializer = self.get_member_serializer(fields)
+        to_row = getattr(serializer, 'to_row', None)
+        if to_row is not None:
+            return list(serializer.fields), to_row
+        if fields is None:
+            fields = self.default_fields
+        names = sorted(fields) if isinstance(fields, set) else list(fields)
+        names.extend(n for n in self.embedded if n not in names)
+
+        def to_row(member):
+            data = serializer(member)
+            return [data.get(name) for name in names]
+
+        return names, to_row
+
+    @reify
+    def field_plan(self):
+        return get_field_plan(self.entity)
 
     @reify
     def default_fields(self):
-        fields = []
-        class_attrs = dir(self.entity)
-        for name in class_attrs:
-            if name.startswith('_'):
-                continue
-            attr = getattr(self.entity, name)
-            if isinstance(attr, property):
-                fields.append(name)
-            else:
-                try:
-                    clause_el = attr.__clause_element__()
-                except AttributeError:
-                    pass
-                else:
-                    if issubclass(clause_el.__class__, Column):
-                        fields.append(name)
-        fields = set(fields)
-        return fields
+        return set(self.field_plan.names)
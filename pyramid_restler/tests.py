@@ -1,31 +1,92 @@
+import datetime
+import decimal
+import gc
 import json
-from unittest import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, skipIf
+import weakref
+import zlib
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from pyramid.config import Configurator
-from pyramid.events import NewRequest
-from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid.exceptions import (
+    ConfigurationConflictError,
+    ConfigurationError,
+)
+from pyramid.httpexceptions import (
+    HTTPBadRequest, HTTPConflict, HTTPNotAcceptable, HTTPNotFound,
+    HTTPPreconditionFailed)
+from pyramid.interfaces import IRoutesMapper
+from pyramid.registry import Registry
 from pyramid.response import Response
 from pyramid.testing import DummyRequest
 
-from webob.request import MIMEAccept
+from webob.request import MIMEAccept, Request
 
 try:
     import sqlalchemy
 except ImportError:  # pragma: no cover
     pass
 else:
+    from sqlalchemy import event, text
+    from sqlalchemy.ext import baked
     from sqlalchemy.engine import create_engine
     from sqlalchemy.ext.declarative import declarative_base
-    from sqlalchemy.orm import Session
-    from sqlalchemy.schema import Column
-    from sqlalchemy.types import Integer, String
+    from sqlalchemy.orm import (
+        Session, relationship, scoped_session, sessionmaker)
+    from sqlalchemy.schema import Column, ForeignKey
+    from sqlalchemy.types import DateTime, Integer, Numeric, String
 
 from zope.interface import implementer
 
-from pyramid_restler.interfaces import IContext
-from pyramid_restler.model import SQLAlchemyORMContext
+from pyramid_restler.cache import (
+    DBMCacheBackend, MemoryCacheBackend, ResponseCache)
+from pyramid_restler.compression import compress_iter, negotiate_encoding
+from pyramid_restler.exceptions import (
+    IntegrityConflict, InvalidQuery, VersionConflict)
+from pyramid_restler.interfaces import (
+    IContext, IJSONBackend, IResponseCache)
+from pyramid_restler.jsonlib import (
+    StdlibJSONBackend, get_json_backend, json_backends)
+from pyramid_restler.model import (
+    DefaultJSONEncoder, SQLAlchemyORMContext, clear_field_plans,
+    get_field_plan, get_member_serializer)
+from pyramid_restler.tweens import (
+    deferred_commit_tween_factory, deferred_commits_key)
+from pyramid_restler.util import ClosingIterator, LRUCache, TTLCache
 from pyramid_restler.view import RESTfulView
 
+try:
+    import aiosqlite
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from pyramid_restler.aio import (
+        AsyncRESTfulView, AsyncSQLAlchemyORMContext, EventLoopThread,
+        blocking_view)
+except (ImportError, SyntaxError):  # Python 2 or SQLAlchemy < 1.4
+    AsyncSQLAlchemyORMContext = None
+
 
 class Test_SQLAlchemyORMContext(TestCase):
 
@@ -60,11 +121,178 @@ class Test_SQLAlchemyORMContext(TestCase):
         collection = self.context.get_collection()
         self.assertEqual(3, len(collection))
 
+    def test_json_default_is_cached(self):
+        self.assertTrue(self.context.json_default is self.context.json_default)
+
+    def test_default_fields(self):
+        self.assertEqual(self.context.default_fields, set(['id', 'value']))
+
+    def test_field_plan_is_cached_per_entity(self):
+        entity = self.context.entity
+        plan = get_field_plan(entity)
+        self.assertTrue(self.context.field_plan is plan)
+        self.assertEqual(plan.names, ('id', 'value'))
+        self.assertEqual(sorted(plan.columns), ['id', 'value'])
+        clear_field_plans()
+        self.assertFalse(get_field_plan(entity) is plan)
+
+    def test_caches_do_not_keep_entities_alive(self):
+        def make_entities():
+            Base = declarative_base()
+            class Parent(Base):
+                __tablename__ = 'parent'
+                id = Column(Integer, primary_key=True)
+                children = relationship('Child')
+            class Child(Base):
+                __tablename__ = 'child'
+                id = Column(Integer, primary_key=True)
+                parent_id = Column(Integer, ForeignKey('parent.id'))
+            get_field_plan(Child)
+            get_member_serializer(Parent, ['id'], ['children'])
+            return weakref.ref(Parent), weakref.ref(Child)
+        refs = make_entities()
+        gc.collect()
+        self.assertEqual([r() for r in refs], [None, None])
+
     def test_get_collection_with_kwargs(self):
         collection = self.context.get_collection(filters={'value': 'three'})
         self.assertEqual(1, len(collection))
         self.assertEqual(collection[0].value, 'three')
 
+    def test_get_collection_with_column_fields(self):
+        collection = self.context.get_collection(
+            filters={'value': 'two'}, fields=['value'])
+        self.assertEqual(len(collection), 1)
+        self.assertFalse(isinstance(collection[0], self.context.entity))
+        self.assertEqual(collection[0].value, 'two')
+        content = json.loads(self.context.to_json(collection, ['value']))
+        self.assertEqual(content['results'], [{'value': 'two'}])
+
+    def test_get_collection_with_non_column_fields(self):
+        entity = self.context.entity
+        entity.upper_value = property(lambda self: self.value.upper())
+        try:
+            collection = self.context.get_collection(
+                fields=['id', 'upper_value'], order_by=['id'])
+            self.assertTrue(isinstance(collection[0], entity))
+            obj = self.context.get_json_obj(
+                collection, ['id', 'upper_value'], False)
+            self.assertEqual(obj[0], {'id': 1, 'upper_value': 'ONE'})
+        finally:
+            del entity.upper_value
+            clear_field_plans()
+
+    def test_get_collection_with_cursor(self):
+        page = self.context.get_collection(cursor='', limit=2)
+        self.assertEqual([m.id for m in page], [1, 2])
+        next_cursor = self.context.collection_info['next_cursor']
+        self.assertTrue(next_cursor)
+        page = self.context.get_collection(cursor=next_cursor, limit=2)
+        self.assertEqual([m.id for m in page], [3])
+        self.assertEqual(self.context.collection_info['next_cursor'], None)
+        # Nothing carries over to the next read
+        self.context.get_collection(limit=2)
+        self.assertEqual(self.context.collection_info, {})
+        self.assertFalse(self.context.read_state.paged)
+
+    def test_get_collection_with_invalid_cursor(self):
+        self.assertRaises(
+            InvalidQuery, self.context.get_collection, cursor='!!!', limit=2)
+        self.assertRaises(
+            InvalidQuery, self.context.get_collection, cursor='',
+            order_by=['value'])
+
+    def test_get_collection_view_with_cursor(self):
+        def get_page(cursor, stream='false'):
+            kwargs = json.dumps({'cursor': cursor, 'limit': 2})
+            request = DummyRequest(
+                path='/thing.json',
+                params={
+                    '$$': kwargs, '$fields': '["value"]', '$stream': stream})
+            request.matchdict = {'renderer': 'json'}
+            response = RESTfulView(self.context, request).get_collection()
+            return json.loads(b''.join(response.app_iter).decode('utf-8'))
+        content = get_page('')
+        self.assertEqual(
+            content['results'], [{'value': 'one'}, {'value': 'two'}])
+        content = get_page(content['next_cursor'], stream='true')
+        self.assertEqual(content['results'], [{'value': 'three'}])
+        self.assertEqual(content['next_cursor'], None)
+
+    def test_get_collection_view_with_invalid_cursor(self):
+        request = DummyRequest(
+            path='/thing.json', params={'$$': '{"cursor": "x", "limit": 2}'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(self.context, request)
+        self.assertRaises(HTTPBadRequest, view.get_collection)
+
+    def test_get_collection_view_only_converts_invalid_queries(self):
+        def get_collection(**kwargs):
+            raise ValueError('Not a client error')
+        self.context.get_collection = get_collection
+        request = DummyRequest(path='/thing.json', params={'$stream': 'false'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(self.context, request)
+        self.assertRaises(ValueError, view.get_collection)
+        request = DummyRequest(path='/thing.json', params={'$$': '{'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(self.context, request)
+        self.assertRaises(HTTPBadRequest, view.get_collection)
+
+    def test_get_collection_with_exact_count(self):
+        collection = self.context.get_collection(limit=1, count='exact')
+        self.assertEqual(len(collection), 1)
+        self.assertEqual(self.context.collection_info['total_count'], 3)
+        self.context.get_collection(
+            filters={'value': 'two'}, limit=1, count='exact')
+        self.assertEqual(self.context.collection_info['total_count'], 1)
+        # Exact counts are cached until the context writes to the entity
+        self.context.session.add(self.context.entity(id=4, value='four'))
+        self.context.session.commit()
+        self.context.get_collection(limit=1, count='exact')
+        self.assertEqual(self.context.collection_info['total_count'], 3)
+        self.context.create_member({'value': 'five'})
+        self.context.get_collection(limit=1, count='exact')
+        self.assertEqual(self.context.collection_info['total_count'], 5)
+        self.context.delete_member(1)
+        self.context.get_collection(limit=1, count='exact')
+        self.assertEqual(self.context.collection_info['total_count'], 4)
+
+    def test_get_collection_view_with_count_after_write(self):
+        # The response cache is invalidated by the write, so the next
+        # response is rendered again and must not reuse the cached count.
+        registry = Registry()
+        registry.registerUtility(
+            ResponseCache(MemoryCacheBackend()), IResponseCache)
+        def get():
+            request = DummyRequest(
+                path='/thing.json', params={'$count': 'exact'})
+            request.matchdict = {'renderer': 'json'}
+            request.registry = registry
+            response = RESTfulView(self.context, request).get_collection()
+            return json.loads(response.body)['total_count']
+        self.assertEqual(get(), 3)
+        request = DummyRequest(path='/thing/1', method='DELETE')
+        request.matchdict = {'id': '1'}
+        request.registry = registry
+        RESTfulView(self.context, request).delete_member()
+        self.assertEqual(get(), 2)
+
+    def test_get_collection_with_estimated_count(self):
+        # Falls back to an exact count on databases other than PostgreSQL
+        self.context.get_collection(limit=1, count='estimated')
+        self.assertEqual(self.context.collection_info['total_count'], 3)
+
+    def test_get_collection_view_with_count(self):
+        request = DummyRequest(
+            path='/thing.json',
+            params={'$$': '{"limit": 2}', '$count': 'exact'})
+        request.matchdict = {'renderer': 'json'}
+        response = RESTfulView(self.context, request).get_collection()
+        content = json.loads(response.body)
+        self.assertEqual(content['result_count'], 2)
+        self.assertEqual(content['total_count'], 3)
+
     def test_get_member(self):
         member = self.context.get_member(1)
         self.assertEqual(member.id, 1)
@@ -96,10 +324,367 @@ class Test_SQLAlchemyORMContext(TestCase):
         member = self.context.get_member(1)
         self.assert_(member is None)
 
+    def test_patch_member(self):
+        context = self.context
+        commits = []
+        def after_commit(session):
+            commits.append(session)
+        event.listen(context.session, 'after_commit', after_commit)
+        member = context.patch_member(1, {'value': 'one'})
+        self.assertEqual(member.id, 1)
+        self.assertEqual(context.changed_fields, ())
+        self.assertEqual(len(commits), 0)
+        member = context.patch_member(1, {'id': 1, 'value': 'ONE'})
+        self.assertEqual(context.changed_fields, ('value',))
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(context.get_member(1).value, 'ONE')
+        self.assertEqual(context.patch_member(42, {'value': 'x'}), None)
+        self.assertRaises(ValueError, context.patch_member, 1, {'nope': 'x'})
+        self.assertRaises(
+            ValueError, context.patch_member, 1, {'value': 'x'}, version='1')
+
+    def _make_versioned_context(self, version_id_col=False):
+        Base = declarative_base()
+        class Versioned(Base):
+            __tablename__ = 'versioned'
+            id = Column(Integer, primary_key=True)
+            value = Column(String)
+            version = Column(Integer, nullable=False)
+            if version_id_col:
+                __mapper_args__ = {'version_id_col': version}
+        Base.metadata.create_all(bind=self.context.session.get_bind())
+        self.context.session.add(Versioned(id=1, value='one', version=1))
+        self.context.session.commit()
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = Versioned
+            version_field = 'version'
+        return ContextFactory(self.context.request)
+
+    def test_patch_member_with_version(self):
+        context = self._make_versioned_context()
+        version = context.get_validators(context.get_member(1))[0]
+        self.assertRaises(
+            VersionConflict, context.patch_member, 1, {'value': 'ONE'},
+            version='two')
+        self.assertEqual(context.get_member(1).value, 'one')
+        context.patch_member(1, {'value': 'ONE'}, version=version)
+        member = context.get_member(1)
+        self.assertEqual((member.value, member.version), ('ONE', 2))
+        self.assertRaises(
+            VersionConflict, context.patch_member, 1, {'value': 'x'},
+            version=version)
+        context.patch_member(1, {'value': 'ONE'})
+        self.assertEqual(member.version, 2)
+        context.version_field = 'value'
+        self.assertRaises(ValueError, context.patch_member, 1, {'value': 'x'})
+
+    def test_patch_member_with_version_id_col(self):
+        context = self._make_versioned_context(version_id_col=True)
+        context.patch_member(1, {'value': 'ONE'})
+        self.assertEqual(context.get_member(1).version, 2)
+
+    def test_all_updates_bump_version(self):
+        for version_id_col in (False, True):
+            context = self._make_versioned_context(version_id_col)
+            def get_version():
+                context.session.expire_all()
+                return context.get_member(1).version
+            context.update_member(1, {'value': 'ONE'})
+            self.assertEqual(get_version(), 2)
+            context.direct_writes = True
+            context.update_member(1, {'value': 'One'})
+            self.assertEqual(get_version(), 3)
+            context.update_members([1], {'value': 'one'})
+            self.assertEqual(get_version(), 4)
+            self.context.session.execute(text('DROP TABLE versioned'))
+            self.context.session.commit()
+
+    def test_patch_view(self):
+        context = self._make_versioned_context()
+        def get():
+            request = DummyRequest(path='/thing/1.json')
+            request.matchdict = {'id': 1, 'renderer': 'json'}
+            return RESTfulView(context, request).get_member()
+        def patch(id, data, headers=None):
+            request = DummyRequest(
+                method='PATCH', path='/thing/{0}'.format(id),
+                body=json.dumps(data), content_type='application/json',
+                headers=headers)
+            request.matchdict = {'id': id}
+            return RESTfulView(context, request).patch_member()
+        if_match = {'If-Match': '"{0}"'.format(get().etag)}
+        response = patch(1, {'value': 'ONE'}, if_match)
+        self.assertEqual(response.status_int, 204)
+        self.assertRaises(
+            HTTPPreconditionFailed, patch, 1, {'value': 'x'}, if_match)
+        self.assertRaises(HTTPNotFound, patch, 42, {'value': 'x'})
+        self.assertRaises(
+            HTTPPreconditionFailed, patch, 42, {'value': 'x'}, if_match)
+        self.assertRaises(
+            HTTPPreconditionFailed, patch, 42, {'value': 'x'},
+            {'If-Match': '*'})
+        self.assertRaises(HTTPBadRequest, patch, 1, {'nope': 'x'})
+        response = patch(1, {'value': 'ONE'}, {'If-Match': '*'})
+        self.assertEqual(response.status_int, 204)
+        if_match = {'If-Match': '"{0}"'.format(get().etag)}
+        response = patch(1, {'value': 'x'}, if_match)
+        self.assertEqual(response.status_int, 204)
+
+    def test_commit_strategies(self):
+        context = self.context
+        commits = []
+        def after_commit(session):
+            commits.append(session)
+        event.listen(context.session, 'after_commit', after_commit)
+        context.commit_strategy = 'flush'
+        member = context.create_member({'value': 'four'})
+        self.assertEqual(member.id, 4)
+        self.assertEqual(len(commits), 0)
+        context.session.rollback()
+        context.commit_strategy = 'deferred'
+        self.assertRaises(
+            RuntimeError, context.create_member, {'value': 'four'})
+        context.session.rollback()
+        invalidated = []
+        def handler(request):
+            context.create_member({'value': 'four'})
+            context.update_member(1, {'value': 'ONE'})
+            context.delete_members([2])
+            context.after_commit(lambda: invalidated.append(True))
+            self.assertEqual(len(commits), 0)
+            self.assertEqual(invalidated, [])
+            return Response()
+        tween = deferred_commit_tween_factory(handler, None)
+        tween(context.request)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(invalidated, [True])
+        def handler(request):
+            context.update_member(1, {'value': 'x'})
+            context.after_commit(lambda: invalidated.append(True))
+            return Response(status=500)
+        tween = deferred_commit_tween_factory(handler, None)
+        tween(context.request)
+        def handler(request):
+            context.update_member(1, {'value': 'x'})
+            raise KeyError('x')
+        tween = deferred_commit_tween_factory(handler, None)
+        self.assertRaises(KeyError, tween, context.request)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(invalidated, [True])
+        context.session.commit()
+        self.assertEqual(invalidated, [True])
+        commits[:] = []
+        self.assertEqual(context.get_member(1).value, 'ONE')
+        self.assertEqual(len(context.get_collection()), 3)
+        class FailingSession(object):
+            def commit(self):
+                raise ValueError('Commit failed')
+            def rollback(self):
+                pass
+        def handler(request):
+            request.environ[deferred_commits_key].append(FailingSession())
+            context.update_member(1, {'value': 'x'})
+            return Response()
+        tween = deferred_commit_tween_factory(handler, None)
+        self.assertRaises(ValueError, tween, context.request)
+        self.assertEqual(len(commits), 0)
+        self.assertEqual(context.get_member(1).value, 'ONE')
+        context.commit_strategy = 'nope'
+        self.assertRaises(
+            ValueError, context.create_member, {'value': 'five'})
+
+    def test_after_commit_with_scoped_session(self):
+        engine = self.context.session.get_bind()
+        scope = ['a']
+        db_session = scoped_session(
+            sessionmaker(bind=engine), scopefunc=lambda: scope[0])
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = self.context.entity
+            commit_strategy = 'flush'
+        request = DummyRequest()
+        request.db_session = db_session
+        context = ContextFactory(request)
+        called = []
+        context.update_member(1, {'value': 'ONE'})
+        context.after_commit(lambda: called.append('a'))
+        # Other sessions from the same factory don't affect the callback
+        scope[0] = 'b'
+        db_session.commit()
+        db_session.rollback()
+        self.assertEqual(called, [])
+        scope[0] = 'a'
+        db_session.commit()
+        self.assertEqual(called, ['a'])
+        db_session.commit()
+        self.assertEqual(called, ['a'])
+        context.update_member(1, {'value': 'x'})
+        context.after_commit(lambda: called.append('rolled back'))
+        db_session.rollback()
+        db_session.commit()
+        self.assertEqual(called, ['a'])
+        db_session.remove()
+        scope[0] = 'b'
+        db_session.remove()
+
+    def test_sessionmaker(self):
+        engine = self.context.session.get_bind()
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = self.context.entity
+            sessionmaker = sessionmaker(bind=engine)
+        request = DummyRequest()
+        context = ContextFactory(request)
+        self.assertEqual(len(context.get_collection()), 3)
+        other_context = ContextFactory(request)
+        self.assertTrue(other_context.session is context.session)
+        self.assertEqual(len(request.finished_callbacks), 1)
+        request.finished_callbacks.popleft()(request)
+        self.assertFalse(ContextFactory(request).session is context.session)
+
+    def test_sessionmaker_with_stream(self):
+        engine = self.context.session.get_bind()
+        closed = []
+        class RecordingSession(Session):
+            def close(self):
+                closed.append(self)
+                super(RecordingSession, self).close()
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = self.context.entity
+            sessionmaker = sessionmaker(bind=engine, class_=RecordingSession)
+            stream_batch_size = 1
+        request = DummyRequest()
+        context = ContextFactory(request)
+        app_iter = context.to_ndjson_iter(
+            context.get_collection_query(), ['id'])
+        # The stream owns the session, so finishing the request doesn't
+        # close it.
+        request.finished_callbacks.popleft()(request)
+        self.assertEqual(closed, [])
+        self.assertEqual(b''.join(app_iter).count(b'\n'), 3)
+        app_iter.close()
+        self.assertEqual(closed, [context.session])
+
+    def test_direct_writes(self):
+        self.context.direct_writes = True
+        self.assertEqual(self.context.update_member(1, {'value': 'ONE'}), 1)
+        self.assertEqual(self.context.update_member(42, {'value': 'x'}), None)
+        self.assertEqual(self.context.get_member(1).value, 'ONE')
+        self.assertRaises(
+            ValueError, self.context.update_member, 1, {'nope': 'x'})
+        self.assertEqual(self.context.delete_member(2), 2)
+        self.assertEqual(self.context.delete_member(2), None)
+        self.assertEqual(self.context.get_member(2), None)
+
+    def test_update_view_with_direct_writes(self):
+        self.context.direct_writes = True
+        parsed = []
+        class View(RESTfulView):
+            def _get_data(self):
+                parsed.append(True)
+                return super(View, self)._get_data()
+        request = DummyRequest(
+            method='PUT', path='/thing/42', body='{"value": "x"}',
+            content_type='application/json')
+        request.matchdict = {'id': 42}
+        response = View(self.context, request).update_member()
+        self.assertEqual(response.status_int, 201)
+        self.assertEqual(len(parsed), 1)
+        request = DummyRequest(
+            method='PUT', path='/thing/1', body='{"nope": "x"}',
+            content_type='application/json')
+        request.matchdict = {'id': 1}
+        self.assertRaises(
+            HTTPBadRequest, View(self.context, request).update_member)
+
+    def test_create_members(self):
+        results = self.context.create_members([
+            {'value': 'four'},
+            {'nope': 'x'},
+            'five',
+            {'id': 10, 'value': 'ten'},
+        ])
+        self.assertEqual(results[0], {'id': 4})
+        self.assertTrue('error' in results[1])
+        self.assertTrue('error' in results[2])
+        self.assertEqual(results[3], {'id': 10})
+        self.assertEqual(self.context.get_member(4).value, 'four')
+        self.assertEqual(len(self.context.get_collection()), 5)
+
+    def test_create_members_with_ids_uses_executemany(self):
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            if statement.startswith('INSERT'):
+                statements.append(executemany)
+        engine = self.context.session.get_bind()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            results = self.context.create_members([
+                {'id': 10, 'value': 'ten'},
+                {'id': 11, 'value': 'eleven'},
+                {'id': 12, 'value': 'twelve'},
+            ])
+        finally:
+            event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(results, [{'id': 10}, {'id': 11}, {'id': 12}])
+        self.assertEqual(statements, [True])
+
+    def test_create_members_with_conflict(self):
+        self.assertRaises(
+            IntegrityConflict, self.context.create_members,
+            [{'id': 10, 'value': 'ten'}, {'id': 1, 'value': 'one'}])
+        self.assertEqual(self.context.get_member(10), None)
+        self.assertEqual(len(self.context.get_collection()), 3)
+
+    def test_update_members(self):
+        count = self.context.update_members([1, 2, 42], {'value': 'x'})
+        self.assertEqual(count, 2)
+        self.assertEqual(self.context.get_member(1).value, 'x')
+        self.assertEqual(self.context.get_member(3).value, 'three')
+        self.assertRaises(
+            ValueError, self.context.update_members, [1], {'nope': 'x'})
+        self.assertRaises(ValueError, self.context.update_members, [1], {})
+
+    def test_delete_members(self):
+        count = self.context.delete_members([1, 3, 42])
+        self.assertEqual(count, 2)
+        self.assertEqual(len(self.context.get_collection()), 1)
+        self.assertEqual(self.context.delete_members([]), 0)
+
+    def test_batch_views(self):
+        def request(method, data):
+            request = DummyRequest(
+                method=method, path='/thing/batch', body=json.dumps(data),
+                content_type='application/json')
+            return RESTfulView(self.context, request)
+        response = request('POST', [{'value': 'four'}]).create_members()
+        self.assertEqual(
+            json.loads(response.body),
+            {'results': [{'id': 4}], 'result_count': 1})
+        view = request('PATCH', {'ids': [1, 4], 'data': {'value': 'x'}})
+        response = view.update_members()
+        self.assertEqual(json.loads(response.body), {'result_count': 2})
+        view = request('PATCH', {'ids': [1], 'data': {'nope': 'x'}})
+        self.assertRaises(HTTPBadRequest, view.update_members)
+        view = request('PATCH', {'ids': [1], 'data': {}})
+        self.assertRaises(HTTPBadRequest, view.update_members)
+        view = request('POST', [{'id': 1, 'value': 'one'}])
+        self.assertRaises(HTTPConflict, view.create_members)
+        response = request('DELETE', {'ids': [1, 2]}).delete_members()
+        self.assertEqual(json.loads(response.body), {'result_count': 2})
+        view = request('DELETE', [1, 2])
+        self.assertRaises(HTTPBadRequest, view.delete_members)
+        view = request('DELETE', {'ids': 'abc'})
+        self.assertRaises(HTTPBadRequest, view.delete_members)
+        view = request('PATCH', {'ids': 'abc', 'data': {'value': 'x'}})
+        self.assertRaises(HTTPBadRequest, view.update_members)
+        view = request('PATCH', {'ids': [3], 'data': ['value', 'x']})
+        self.assertRaises(HTTPBadRequest, view.update_members)
+
     def test_collection_to_json(self):
         collection = self.context.get_collection()
         json_collection = self.context.to_json(collection)
-        self.assertTrue(isinstance(json_collection, basestring))
+        self.assertTrue(isinstance(json_collection, bytes))
         should_equal = [
             {'id': 1, 'value': 'one'},
             {'id': 2, 'value': 'two'},
@@ -110,16 +695,610 @@ class Test_SQLAlchemyORMContext(TestCase):
     def test_member_to_json(self):
         member = self.context.get_member(1)
         json_member = self.context.to_json(member)
-        self.assertTrue(isinstance(json_member, basestring))
+        self.assertTrue(isinstance(json_member, bytes))
         should_equal = [{'id': 1, 'value': 'one'}]
         self.assertEqual(json.loads(json_member)['results'], should_equal)
 
+    def test_collection_to_json_iter(self):
+        self.context.stream_batch_size = 2
+        query = self.context.get_collection_query()
+        chunks = list(self.context.to_json_iter(query))
+        self.assertEqual(len(chunks), 2)
+        content = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertEqual(content['result_count'], 3)
+        expected = json.loads(self.context.to_json(query))['results']
+        self.assertEqual(content['results'], expected)
+
+    def test_unwrapped_collection_to_json_iter(self):
+        query = self.context.get_collection_query(filters={'value': 'two'})
+        chunks = self.context.to_json_iter(query, fields=['id'], wrap=False)
+        content = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertEqual(content, [{'id': 2}])
+
+    @skipIf(ThreadPoolExecutor is None, 'concurrent.futures not available')
+    def test_collection_to_json_offloaded(self):
+        collection = self.context.get_collection(order_by=['id'])
+        expected = json.loads(self.context.to_json(collection).decode('utf-8'))
+        self.context.encode_threshold = 2
+        self.context.encode_chunk_size = 2
+        with ThreadPoolExecutor(2) as executor:
+            self.context.encode_executor = executor
+            content = self.context.to_json(collection)
+            unwrapped = self.context.to_json(collection, ['id'], wrap=False)
+            empty = self.context.to_json_offloaded([])
+        self.assertEqual(json.loads(content.decode('utf-8')), expected)
+        self.assertEqual(
+            json.loads(unwrapped.decode('utf-8')),
+            [{'id': 1}, {'id': 2}, {'id': 3}])
+        self.assertEqual(
+            json.loads(empty.decode('utf-8')),
+            {'results': [], 'result_count': 0})
+
+    def test_collection_to_columnar_json(self):
+        collection = self.context.get_collection(order_by=['id'])
+        expected = {
+            'fields': ['id', 'value'],
+            'rows': [[1, 'one'], [2, 'two'], [3, 'three']],
+        }
+        content = self.context.to_json(collection, wrap=False, columnar=True)
+        self.assertEqual(json.loads(content.decode('utf-8')), expected)
+        chunks = self.context.to_json_iter(
+            self.context.get_collection_query(order_by=['id']),
+            columnar=True)
+        content = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertEqual(content, dict(expected, result_count=3))
+
+    def test_get_collection_view_with_columnar_format(self):
+        for params, matchdict in (
+                ({'$format': 'columnar'}, {}),
+                ({}, {'renderer': '.cjson'})):
+            params['$fields'] = '["value"]'
+            request = DummyRequest(path='/thing', params=params)
+            request.matchdict = matchdict
+            response = RESTfulView(self.context, request).get_collection()
+            content = json.loads(response.body.decode('utf-8'))
+            self.assertEqual(content['fields'], ['value'])
+            self.assertEqual(content['result_count'], 3)
+
+    @skipIf(msgpack is None, 'msgpack not installed')
+    def test_get_collection_view_with_msgpack(self):
+        request = DummyRequest(path='/thing')
+        request.accept = MIMEAccept('application/msgpack')
+        request.matchdict = {}
+        response = RESTfulView(self.context, request).get_collection()
+        self.assertEqual(response.content_type, 'application/msgpack')
+        content = msgpack.unpackb(response.body, raw=False)
+        expected = json.loads(self.context.to_json(
+            self.context.get_collection()).decode('utf-8'))
+        self.assertEqual(content, expected)
+
+    @skipIf(pyarrow is None, 'pyarrow not installed')
+    def test_get_collection_view_with_arrow(self):
+        request = DummyRequest(path='/thing.arrow', params={'$$': json.dumps(
+            {'cursor': '', 'limit': 2})})
+        request.matchdict = {'renderer': '.arrow'}
+        self.context.arrow_batch_size = 1
+        response = RESTfulView(self.context, request).get_collection()
+        reader = pyarrow.ipc.open_stream(response.body)
+        batches = list(reader)
+        self.assertEqual(len(batches), 2)
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEqual(table.column_names, ['id', 'value'])
+        self.assertEqual(
+            [f.type for f in table.schema],
+            [pyarrow.int64(), pyarrow.string()])
+        self.assertEqual(table.column('id').to_pylist(), [1, 2])
+        info = json.loads(table.schema.metadata[b'collection_info'])
+        self.assertTrue(info['next_cursor'])
+
+    def test_unavailable_renderers_should_raise_400(self):
+        class Context(self.context.__class__):
+            to_msgpack = None
+            to_arrow = None
+        context = Context(self.context.request)
+        for renderer in ('msgpack', 'arrow'):
+            request = DummyRequest(path='/thing.' + renderer)
+            request.matchdict = {'renderer': '.' + renderer}
+            view = RESTfulView(context, request)
+            self.assertRaises(HTTPBadRequest, view.get_collection)
+
+    def test_get_collection_view_with_export_renderers(self):
+        def get(renderer):
+            request = DummyRequest(path='/thing.' + renderer)
+            request.matchdict = {'renderer': '.' + renderer}
+            view = RESTfulView(self.context, request)
+            self.assertTrue(view.stream)
+            return view.get_collection()
+        response = get('csv')
+        self.assertEqual(response.content_type, 'text/csv')
+        content = b''.join(response.app_iter).decode('utf-8')
+        self.assertEqual(
+            content.splitlines(), ['id,value', '1,one', '2,two', '3,three'])
+        response = get('ndjson')
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        lines = b''.join(response.app_iter).decode('utf-8').splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            json.loads(self.context.to_json(
+                self.context.get_collection()).decode('utf-8'))['results'])
+
+    @skipIf(tracemalloc is None, 'tracemalloc not available')
+    def test_export_is_memory_bounded(self):
+        # Materializing 20,000 rows would take several MB; streaming them
+        # should only hold one batch at a time. See benchmarks/export.py
+        # for a larger export.
+        n = 20000
+        session = self.context.session
+        session.execute(
+            text(
+                'WITH RECURSIVE c(x) AS ('
+                'SELECT 4 UNION ALL SELECT x + 1 FROM c WHERE x < :n) '
+                'INSERT INTO entity (id, value) '
+                'SELECT x, \'row\' || x FROM c'),
+            {'n': n})
+        session.commit()
+        self.context.stream_batch_size = 100
+        query = self.context.get_collection_query(fields=['id', 'value'])
+        count = size = 0
+        tracemalloc.start()
+        try:
+            for chunk in self.context.to_csv_iter(query, ['id', 'value']):
+                count += chunk.count(b'\n')
+                size = max(size, len(chunk))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, n + 1)
+        self.assertTrue(size < 64 * 1024)
+        self.assertTrue(peak < 2 * 1024 * 1024, peak)
+
+    def test_streamed_get_collection(self):
+        request = DummyRequest(path='/thing.json', params={'$stream': 'true'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(self.context, request)
+        self.assertTrue(view.stream)
+        response = view.get_collection()
+        content = json.loads(b''.join(response.app_iter).decode('utf-8'))
+        self.assertEqual(content['result_count'], 3)
+        self.assertEqual(len(content['results']), 3)
+
+    def test_member_serializer_converts_by_column_type(self):
+        Base = declarative_base()
+        class Typed(Base):
+            __tablename__ = 'typed'
+            id = Column(Integer, primary_key=True)
+            amount = Column(Numeric(10, 2))
+            created = Column(DateTime)
+            @property
+            def label(self):
+                return 'typed {0}'.format(self.id)
+        member = Typed(
+            id=1, amount=decimal.Decimal('1.50'),
+            created=datetime.datetime(2011, 11, 30, 12, 30))
+        fields = ['amount', 'created', 'id', 'label']
+        serializer = get_member_serializer(Typed, fields)
+        self.assertTrue(get_member_serializer(Typed, fields) is serializer)
+        self.assertEqual(serializer(member), {
+            'id': 1,
+            'amount': '1.50',
+            'created': '2011-11-30 12:30:00',
+            'label': 'typed 1',
+        })
+        legacy = dict((name, getattr(member, name)) for name in fields)
+        self.assertEqual(
+            json.loads(json.dumps(serializer(member))),
+            json.loads(json.dumps(legacy, cls=DefaultJSONEncoder)))
+        self.assertEqual(serializer(Typed(id=2))['amount'], None)
+
+    def test_get_collection_view_with_fields(self):
+        request = DummyRequest(
+            path='/thing.json', params={'$fields': '["id"]'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(self.context, request)
+        response = view.get_collection()
+        results = json.loads(response.body)['results']
+        self.assertEqual(sorted(r['id'] for r in results), [1, 2, 3])
+        self.assertTrue(all(list(r.keys()) == ['id'] for r in results))
+
+    def test_conditional_get_with_version_field(self):
+        self.context.version_field = 'value'
+        def get(headers=None):
+            request = DummyRequest(path='/thing/1.json', headers=headers)
+            request.matchdict = {'id': 1, 'renderer': 'json'}
+            return RESTfulView(self.context, request).get_member()
+        response = get()
+        self.assertEqual(response.status_int, 200)
+        etag = response.etag
+        self.assertTrue(etag)
+        def to_json(*args, **kwargs):
+            raise AssertionError('Body should not be serialized')
+        self.context.to_json = to_json
+        response = get({'If-None-Match': '"{0}"'.format(etag)})
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.etag, etag)
+        self.context.update_member(1, {'value': 'ONE'})
+        del self.context.to_json
+        response = get({'If-None-Match': '"{0}"'.format(etag)})
+        self.assertEqual(response.status_int, 200)
+        self.assertNotEqual(response.etag, etag)
+
+    def test_conditional_get_with_last_modified_field(self):
+        Base = declarative_base()
+        class Stamped(Base):
+            __tablename__ = 'stamped'
+            id = Column(Integer, primary_key=True)
+            updated = Column(DateTime)
+        Base.metadata.create_all(bind=self.context.session.get_bind())
+        self.context.session.add_all([
+            Stamped(id=1, updated=datetime.datetime(2011, 7, 6, 12, 0, 0)),
+            Stamped(id=2, updated=datetime.datetime(2011, 7, 22, 12, 0, 0)),
+        ])
+        self.context.session.commit()
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = Stamped
+            last_modified_field = 'updated'
+        context = ContextFactory(self.context.request)
+        def get(headers=None):
+            request = DummyRequest(
+                path='/stamped/2.json', params={'$fields': '["id"]'},
+                headers=headers)
+            request.matchdict = {'id': 2, 'renderer': 'json'}
+            return RESTfulView(context, request).get_member()
+        response = get()
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(
+            response.headers['Last-Modified'], 'Fri, 22 Jul 2011 12:00:00 GMT')
+        response = get({'If-Modified-Since': 'Fri, 22 Jul 2011 12:00:00 GMT'})
+        self.assertEqual(response.status_int, 304)
+        response = get({'If-Modified-Since': 'Thu, 21 Jul 2011 12:00:00 GMT'})
+        self.assertEqual(response.status_int, 200)
+        # Removing a member doesn't change a collection's most recent
+        # modification time, so collections are versioned by membership.
+        def get_collection(headers=None):
+            request = DummyRequest(
+                path='/stamped.json', params={'$fields': '["id"]'},
+                headers=headers)
+            request.matchdict = {'renderer': 'json'}
+            return RESTfulView(context, request).get_collection()
+        response = get_collection()
+        self.assertEqual(response.status_int, 200)
+        self.assertFalse('Last-Modified' in response.headers)
+        etag = response.etag
+        response = get_collection({'If-None-Match': '"{0}"'.format(etag)})
+        self.assertEqual(response.status_int, 304)
+        context.delete_member(1)
+        response = get_collection({'If-None-Match': '"{0}"'.format(etag)})
+        self.assertEqual(response.status_int, 200)
+        self.assertNotEqual(response.etag, etag)
+
+    def test_get_collection_with_baked_queries(self):
+        self.context.bake_queries = True
+        bakery = baked.bakery(size=8)
+        built = []
+        def counting_bakery(initial_fn, *args):
+            def build(session):
+                built.append(args)
+                return initial_fn(session)
+            return bakery(build, *args)
+        self.context.bakery = counting_bakery
+        self.context.query_shapes = LRUCache(maxsize=8)
+        collection = self.context.get_collection(
+            filters={'value': 'two'}, fields=['id'], limit=2)
+        self.assertEqual([m.id for m in collection], [2])
+        collection = self.context.get_collection(
+            filters={'value': 'three'}, fields=['id'], limit=1)
+        self.assertEqual([m.id for m in collection], [3])
+        collection = self.context.get_collection(
+            order_by=['value'], offset=1, limit=1)
+        self.assertEqual([m.value for m in collection], ['three'])
+        self.assertEqual(len(built), 2)
+        stats = self.context.query_shapes.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.context.entity.value_filter = classmethod(
+            lambda cls, v: cls.value == v)
+        try:
+            collection = self.context.get_collection(filters={'value': 'one'})
+        finally:
+            del self.context.entity.value_filter
+        self.assertEqual([m.id for m in collection], [1])
+        self.assertEqual(len(built), 2)
+        # Instance-level global filters aren't part of the shape
+        entity = self.context.entity
+        self.context.filters = [entity.id > 1]
+        collection = self.context.get_collection(
+            filters={'value': 'two'}, fields=['id'], limit=2)
+        self.assertEqual([m.id for m in collection], [2])
+        collection = self.context.get_collection(
+            filters={'value': 'one'}, fields=['id'], limit=2)
+        self.assertEqual(collection, [])
+        self.assertEqual(len(built), 2)
+        self.assertEqual(len(self.context.query_shapes), 2)
+
+    def test_get_collection_with_embed(self):
+        Base = declarative_base()
+        class Author(Base):
+            __tablename__ = 'author'
+            id = Column(Integer, primary_key=True)
+            name = Column(String)
+            books = relationship('Book', back_populates='author')
+        class Book(Base):
+            __tablename__ = 'book'
+            id = Column(Integer, primary_key=True)
+            author_id = Column(Integer, ForeignKey('author.id'))
+            author = relationship(Author, back_populates='books')
+            @property
+            def author_name(self):
+                return self.author.name
+        Base.metadata.create_all(bind=self.context.session.get_bind())
+        author = Author(id=1, name='Ann')
+        self.context.session.add_all([
+            author, Book(id=1, author=author), Book(id=2, author=author)])
+        self.context.session.commit()
+        class ContextFactory(SQLAlchemyORMContext):
+            entity = Author
+            embeddable = {'books': 'selectin'}
+            version_field = 'id'
+        context = ContextFactory(self.context.request)
+        self.assertEqual(
+            sorted(get_field_plan(Author).relationships), ['books'])
+        self.assertRaises(ValueError, context.get_collection, embed=['nope'])
+        self.context.session.expunge_all()
+        collection = context.get_collection(fields=['name'], embed=['books'])
+        self.assertTrue('books' in collection[0].__dict__)
+        obj = context.get_json_obj(collection, ['name'], False)
+        # Only the columns of embedded members are included
+        self.assertEqual(obj, [{'name': 'Ann', 'books': [
+            {'id': 1, 'author_id': 1}, {'id': 2, 'author_id': 1}]}])
+        # Changes to embedded members change the version
+        version = context.get_validators(collection)[0]
+        collection = context.get_collection(fields=['name'], embed=['books'])
+        self.assertEqual(context.get_validators(collection)[0], version)
+        collection[0].books[1].author_id = None
+        self.context.session.flush()
+        self.context.session.expunge_all()
+        collection = context.get_collection(fields=['name'], embed=['books'])
+        self.assertNotEqual(context.get_validators(collection)[0], version)
+        # Collections loaded eagerly with joins can still be streamed
+        for strategy in ('joined', 'subquery'):
+            context.embeddable = {'books': strategy}
+            query = context.get_collection_query(embed=['books'])
+            rows = b''.join(
+                context.to_ndjson_iter(query, ['id'])).splitlines()
+            self.assertEqual(
+                [len(json.loads(row)['books']) for row in rows], [1])
+        # Embedded members are JSON encoded in CSV cells, but not their names
+        context.embeddable = {'books': 'selectin'}
+        query = context.get_collection_query(embed=['books'])
+        rows = b''.join(context.to_csv_iter(query, ['id'])).splitlines()
+        self.assertEqual(rows[0], b'id,books')
+        self.assertTrue(rows[1].startswith(b'1,"[{'))
+        request = DummyRequest(
+            path='/author/1.json', params={'$embed': '["author"]'})
+        request.matchdict = {'id': 1, 'renderer': 'json'}
+        view = RESTfulView(context, request)
+        self.assertRaises(HTTPBadRequest, view.get_member)
+
     def test_get_member_id_as_string(self):
         member = self.context.get_member(1)
         id = self.context.get_member_id_as_string(member)
         self.assertEqual(id, '1')
 
 
+@skipIf(AsyncSQLAlchemyORMContext is None, 'asyncio support not available')
+class Test_AsyncSQLAlchemyORMContext(TestCase):
+
+    def setUp(self):
+        Base = declarative_base()
+        class Entity(Base):
+            __tablename__ = 'entity'
+            id = Column(Integer, primary_key=True)
+            value = Column(String)
+        class ContextFactory(AsyncSQLAlchemyORMContext):
+            entity = Entity
+        self.loop_thread = EventLoopThread()
+        self.engine = create_async_engine('sqlite+aiosqlite://')
+        self.session = AsyncSession(bind=self.engine)
+        self.loop_thread.run(self.session.run_sync(
+            lambda session: Base.metadata.create_all(session.connection())))
+        self.context_factory = ContextFactory
+        self.view_class = blocking_view(AsyncRESTfulView, self.loop_thread)
+
+    def tearDown(self):
+        self.loop_thread.run(self.session.close())
+        self.loop_thread.run(self.engine.dispose())
+        self.loop_thread.stop()
+
+    def _view(self, path, matchdict=None, **kwargs):
+        request = DummyRequest(path=path, **kwargs)
+        request.db_session = self.session
+        request.matchdict = matchdict or {'renderer': 'json'}
+        return self.view_class(self.context_factory(request), request)
+
+    def test_blocking_work_runs_off_the_loop(self):
+        threads = []
+        class View(AsyncRESTfulView):
+            def render_to_response(self, value, fields=None):
+                threads.append(threading.current_thread())
+                return super(View, self).render_to_response(value, fields)
+        loop_thread = self.loop_thread
+        loop_thread.start()
+        request = DummyRequest(path='/thing.json')
+        request.db_session = self.session
+        request.matchdict = {'renderer': 'json'}
+        view_class = blocking_view(View, loop_thread)
+        context = self.context_factory(request)
+        view_class(context, request).get_collection()
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertEqual(context.__dict__.get('get_collection'), None)
+        view = View(context, request)
+        loop_thread.run(view.get_collection())
+        self.assertEqual(len(threads), 2)
+        self.assertFalse(threads[1] is threading.current_thread())
+        self.assertNotEqual(threads[1].name, 'pyramid_restler.aio')
+
+    def test_request_data_is_handled_off_the_loop(self):
+        threads = {}
+        def record(name):
+            def method(self, *args):
+                threads[name] = threading.current_thread()
+                return getattr(AsyncRESTfulView, name)(self, *args)
+            return method
+        names = ('get_collection_kwargs', '_get_data', '_batch_response')
+        View = type('View', (AsyncRESTfulView,), dict(
+            (name, record(name)) for name in names))
+        view_class = blocking_view(View, self.loop_thread)
+        def view(path, **kwargs):
+            request = DummyRequest(path=path, **kwargs)
+            request.db_session = self.session
+            request.matchdict = {'renderer': 'json'}
+            return view_class(self.context_factory(request), request)
+        view(
+            '/thing', body='{"value": "one"}',
+            content_type='application/json').create_member()
+        view('/thing.json').get_collection()
+        view(
+            '/thing/batch', body='{"ids": [1]}',
+            content_type='application/json').delete_members()
+        self.assertEqual(sorted(threads), sorted(names))
+        for thread in threads.values():
+            self.assertTrue(thread is threading.current_thread())
+
+    def test_unsupported_options(self):
+        class Deferred(self.context_factory):
+            commit_strategy = 'deferred'
+        class WithSessionmaker(self.context_factory):
+            sessionmaker = sessionmaker()
+        for factory in (Deferred, WithSessionmaker):
+            self.assertRaises(ValueError, factory, DummyRequest())
+
+    def test_views(self):
+        view = self._view(
+            '/thing', body='{"value": "one"}', content_type='application/json')
+        response = view.create_member()
+        self.assertEqual(response.status_int, 201)
+        self.assertEqual(response.location, '/thing/1')
+        response = self._view('/thing.json').get_collection()
+        content = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(content['results'], [{'id': 1, 'value': 'one'}])
+        view = self._view(
+            '/thing/1', {'id': 1}, body='{"value": "uno"}',
+            content_type='application/json')
+        self.assertEqual(view.update_member().status_int, 204)
+        view = self._view('/thing/1.json', {'id': 1, 'renderer': 'json'})
+        content = json.loads(view.get_member().body.decode('utf-8'))
+        self.assertEqual(content['results'], [{'id': 1, 'value': 'uno'}])
+        view = self._view('/thing/1', {'id': 1})
+        self.assertEqual(view.delete_member().status_int, 204)
+        self.assertRaises(HTTPNotFound, view.delete_member)
+
+
+class Test_LRUCache(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(
+            cache.stats(), dict(hits=1, misses=1, size=2, maxsize=2))
+
+
+class Test_TTLCache(TestCase):
+
+    def test_items_expire(self):
+        cache = TTLCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+        cache = TTLCache(ttl=30)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+
+
+class Test_ResponseCache(TestCase):
+
+    def _check_cache(self, cache):
+        response = Response(body=b'{}', content_type='application/json')
+        cache.set('ns', 'collection', response)
+        cache.set('ns', 'member1', response, member_id='1')
+        cache.set('ns', 'member2', response, member_id='2')
+        cached = cache.get('ns', 'collection')
+        self.assertEqual(cached.body, b'{}')
+        self.assertEqual(cached.content_type, 'application/json')
+        cache.invalidate('ns', member_id='1')
+        self.assertEqual(cache.get('ns', 'collection'), None)
+        self.assertEqual(cache.get('ns', 'member1', member_id='1'), None)
+        self.assertNotEqual(cache.get('ns', 'member2', member_id='2'), None)
+        cache.invalidate('ns', all_members=True)
+        self.assertEqual(cache.get('ns', 'member2', member_id='2'), None)
+
+    def test_memory_backend(self):
+        self._check_cache(ResponseCache(MemoryCacheBackend()))
+
+    def test_dbm_backend(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            backend = DBMCacheBackend(os.path.join(temp_dir, 'cache'))
+            self._check_cache(ResponseCache(backend))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_ttl(self):
+        cache = ResponseCache(MemoryCacheBackend(), ttl=-1)
+        cache.set('ns', 'collection', Response(body=b'{}'))
+        self.assertEqual(cache.get('ns', 'collection'), None)
+
+
+class Test_JSONBackends(TestCase):
+
+    def test_backends(self):
+        obj = {'a': [1, 2.5, 'three', None, True]}
+        default = DefaultJSONEncoder().default
+        for name in json_backends:
+            try:
+                backend = get_json_backend(name)
+            except ImportError:
+                continue
+            data = backend.dumps(obj)
+            self.assertTrue(isinstance(data, bytes))
+            self.assertEqual(backend.loads(data), obj)
+            self.assertEqual(backend.loads(data.decode('utf-8')), obj)
+            data = backend.dumps([decimal.Decimal('1.5')], default)
+            self.assertTrue(json.loads(data.decode('utf-8'))[0] in ('1.5', 1.5))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, get_json_backend, 'nope')
+
+    def test_default_backend(self):
+        self.assertTrue(isinstance(get_json_backend(), StdlibJSONBackend))
+        config = Configurator()
+        config.include('pyramid_restler')
+        config.commit()
+        backend = config.registry.queryUtility(IJSONBackend)
+        self.assertTrue(isinstance(backend, StdlibJSONBackend))
+
+    def test_backend_from_settings(self):
+        config = Configurator(settings={'restler.json_backend': 'json'})
+        config.include('pyramid_restler')
+        config.commit()
+        backend = config.registry.queryUtility(IJSONBackend)
+        self.assertTrue(isinstance(backend, StdlibJSONBackend))
+
+    def test_set_restful_json_backend(self):
+        backend = StdlibJSONBackend()
+        config = Configurator(settings={'restler.json_backend': 'nope'})
+        self.assertRaises(ValueError, config.include, 'pyramid_restler')
+        config = Configurator()
+        config.include('pyramid_restler')
+        config.set_restful_json_backend(backend)
+        config.commit()
+        self.assertTrue(config.registry.queryUtility(IJSONBackend) is backend)
+
+
 class Test_RESTfulView(TestCase):
 
     def test_get_collection(self):
@@ -212,6 +1391,101 @@ class Test_RESTfulView(TestCase):
         view = RESTfulView(_dummy_context_factory(), request)
         self.assertRaises(HTTPNotFound, view.get_member)
 
+    def test_conditional_get_with_body_hash(self):
+        def get(headers=None):
+            request = DummyRequest(path='/thing/1.json', headers=headers)
+            request.matchdict = {'id': 1, 'renderer': 'json'}
+            return RESTfulView(_dummy_context_factory(), request).get_member()
+        response = get()
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue(response.etag)
+        response = get({'If-None-Match': '"{0}"'.format(response.etag)})
+        self.assertEqual(response.status_int, 304)
+        response = get({'If-None-Match': '"something-else"'})
+        self.assertEqual(response.status_int, 200)
+
+    def test_cached_responses(self):
+        registry = Registry()
+        registry.registerUtility(
+            ResponseCache(MemoryCacheBackend()), IResponseCache)
+        context = _dummy_context_factory()
+        def get_collection():
+            request = DummyRequest(path='/thing.json', params={
+                '$$': '{"filters": {"id": 1}}'})
+            request.matchdict = {'renderer': 'json'}
+            request.registry = registry
+            response = RESTfulView(context, request).get_collection()
+            return json.loads(response.body)['results']
+        self.assertEqual(get_collection(), [{'id': 1, 'val': 'one'}])
+        context._collection[0]['val'] = 'changed elsewhere'
+        self.assertEqual(get_collection(), [{'id': 1, 'val': 'one'}])
+        request = DummyRequest(
+            method='PUT', path='/thing/1', post={'val': 'ONE'},
+            content_type='application/x-www-form-urlencoded')
+        request.matchdict = {'id': 1}
+        request.registry = registry
+        RESTfulView(context, request).update_member()
+        self.assertEqual(get_collection(), [{'id': 1, 'val': 'ONE'}])
+        # Responses with embedded members aren't cached, since writes to
+        # the related entities wouldn't invalidate them.
+        context.embedded = ('parent',)
+        RESTfulView(context, request).update_member()
+        self.assertEqual(get_collection(), [{'id': 1, 'val': 'ONE'}])
+        context._collection[0]['val'] = 'embedded'
+        self.assertEqual(get_collection(), [{'id': 1, 'val': 'embedded'}])
+
+    def test_compressed_responses(self):
+        registry = Registry()
+        registry.registerUtility(
+            ResponseCache(MemoryCacheBackend()), IResponseCache)
+        class View(RESTfulView):
+            compress_min_size = 10
+        context = _dummy_context_factory()
+        def get(accept_encoding, params=None, view_class=View):
+            request = DummyRequest(
+                path='/thing.json', params=params,
+                headers={'Accept-Encoding': accept_encoding})
+            request.matchdict = {'renderer': 'json'}
+            request.registry = registry
+            return view_class(context, request).get_collection()
+        response = get('gzip;q=0.5, deflate')
+        self.assertEqual(response.content_encoding, 'deflate')
+        self.assertTrue('Accept-Encoding' in response.vary)
+        content = zlib.decompress(response.body).decode('utf-8')
+        self.assertEqual(json.loads(content), {'results': []})
+        context.get_collection = lambda **kwargs: [context.get_member(1)]
+        cached = get('deflate')
+        self.assertEqual(cached.body, response.body)
+        self.assertEqual(cached.content_encoding, 'deflate')
+        response = get('identity')
+        self.assertEqual(response.content_encoding, None)
+        self.assertNotEqual(response.etag, cached.etag)
+        response = get('gzip', {'$fields': '["id"]'}, RESTfulView)
+        self.assertEqual(response.content_encoding, None)
+        self.assertFalse(response.etag.endswith('-gzip'))
+        self.assertEqual(response.vary, None)
+        identity = get('identity', {'$fields': '["id"]'}, RESTfulView)
+        self.assertEqual(identity.etag, response.etag)
+        # The identity response was cached under the same key.
+        cached = get('gzip', {'$fields': '["id"]'}, RESTfulView)
+        self.assertEqual(cached.etag, response.etag)
+        self.assertEqual(cached.content_encoding, None)
+        closed = []
+        app_iter = compress_iter(
+            ClosingIterator([b'a'], lambda: closed.append(True)), 'gzip')
+        app_iter.close()
+        self.assertEqual(closed, [True])
+        app_iter = compress_iter(iter([b'a' * 1000, b'b' * 1000]), 'gzip')
+        content = zlib.decompress(b''.join(app_iter), 16 + zlib.MAX_WBITS)
+        self.assertEqual(content, b'a' * 1000 + b'b' * 1000)
+
+    def test_negotiate_encoding(self):
+        offers = ['br', 'gzip', 'deflate']
+        self.assertEqual(negotiate_encoding(None, offers), None)
+        self.assertEqual(negotiate_encoding('gzip, deflate', offers), 'gzip')
+        self.assertEqual(negotiate_encoding('*;q=0.1, gzip;q=0', offers), 'br')
+        self.assertEqual(negotiate_encoding('gzip;q=0, other', offers), None)
+
     def test_get_member_specific_fields(self):
         request = DummyRequest(path='/thing/1.json', params={'$fields': '["id"]'})
         request.matchdict = {'id': 1, 'renderer': 'json'}
@@ -251,12 +1525,66 @@ class Test_RESTfulView(TestCase):
         self.assertEqual(member['id'], 1)
 
     def test_xml_renderer(self):
+        # XML isn't implemented, so it's not offered.
         request = DummyRequest(path='/thing/1')
         request.accept = MIMEAccept('application/xml')
         request.matchdict = {'id': 1}
         view = RESTfulView(_dummy_context_factory(), request)
+        self.assertRaises(HTTPNotAcceptable, view.get_member)
+        request = DummyRequest(path='/thing/1.xml')
+        request.matchdict = {'id': 1, 'renderer': 'xml'}
+        view = RESTfulView(_dummy_context_factory(), request)
         self.assertRaises(HTTPBadRequest, view.get_member)
 
+    def test_browser_accept_header_should_get_json(self):
+        request = DummyRequest(path='/thing/1')
+        request.accept = MIMEAccept(
+            'text/html,application/xhtml+xml,application/xml;q=0.9,'
+            '*/*;q=0.8')
+        request.matchdict = {'id': 1}
+        view = RESTfulView(_dummy_context_factory(), request)
+        self.assertEqual(view.determine_renderer(), 'json')
+        response = view.get_member()
+        self.assertEqual(response.content_type, 'application/json')
+
+    def test_unacceptable_renderer_should_raise_406(self):
+        request = DummyRequest(path='/thing/1')
+        request.accept = MIMEAccept('text/html')
+        request.matchdict = {'id': 1}
+        view = RESTfulView(_dummy_context_factory(), request)
+        self.assertRaises(HTTPNotAcceptable, view.get_member)
+
+    def test_negotiated_renderers_are_cached(self):
+        class View(RESTfulView):
+            negotiation_cache = LRUCache(maxsize=8)
+        context = _dummy_context_factory()
+        context.to_ndjson_iter = lambda value, fields=None: iter([])
+        def determine_renderer(accept):
+            request = DummyRequest(path='/thing')
+            request.accept = MIMEAccept(accept)
+            return View(context, request).determine_renderer()
+        # The dummy context can't render MessagePack, so it's not offered.
+        accept = 'application/msgpack, application/json;q=0.5'
+        self.assertEqual(determine_renderer(accept), 'json')
+        accept = 'application/x-ndjson, application/json;q=0.5'
+        self.assertEqual(determine_renderer(accept), 'ndjson')
+        self.assertEqual(determine_renderer(accept), 'ndjson')
+        # JSON wins ties
+        self.assertEqual(determine_renderer('text/csv, */*'), 'json')
+        self.assertEqual(determine_renderer('*/*'), 'json')
+        stats = View.negotiation_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 4))
+        renderers, offers = View.get_renderer_table()
+        self.assertTrue(View.get_renderer_table()[0] is renderers)
+        self.assertFalse('to_response' in renderers)
+        self.assertEqual(offers[0], ('application/json', 'json'))
+
+    def test_unknown_count_should_raise_400(self):
+        request = DummyRequest(path='/thing.json', params={'$count': 'lots'})
+        request.matchdict = {'renderer': 'json'}
+        view = RESTfulView(_dummy_context_factory(), request)
+        self.assertRaises(HTTPBadRequest, view.get_collection)
+
     def test_unknown_renderer_should_raise_400(self):
         request = DummyRequest(path='/thing/1.xyz')
         request.matchdict = {'id': 1, 'renderer': 'xyz'}
@@ -287,79 +1615,318 @@ class Test_add_restful_routes(TestCase):
         config = self._make_config()
         self.assertTrue(hasattr(config, 'add_restful_routes'))
 
+    def test_response_cache_from_settings(self):
+        config = Configurator(settings={'restler.response_cache': 'memory'})
+        config.include('pyramid_restler')
+        config.commit()
+        cache = config.registry.queryUtility(IResponseCache)
+        self.assertTrue(isinstance(cache, ResponseCache))
+        self.assertTrue(isinstance(cache.backend, MemoryCacheBackend))
+
+    def test_set_restful_response_cache(self):
+        config = self._make_config()
+        cache = ResponseCache(MemoryCacheBackend())
+        config.set_restful_response_cache(cache)
+        self.assertTrue(config.registry.queryUtility(IResponseCache) is cache)
+
     def test_add_restful_routes(self):
         config = self._make_config(add_view=self._make_add_view())
         config.add_restful_routes('thing', _dummy_context_factory())
-        self.assertEqual(7, config.add_view.count())
+        self.assertEqual(8, config.add_view.count())
+
+    def test_add_restful_routes_with_batch(self):
+        config = self._make_config(add_view=self._make_add_view())
+        config.add_restful_routes('thing', _dummy_context_factory(), batch=True)
+        self.assertEqual(11, config.add_view.count())
+
+    def test_add_restful_routes_with_single_route(self):
+        config = self._make_config(add_view=self._make_add_view())
+        config.add_restful_routes(
+            'thing', _dummy_context_factory(), batch=True, single_route=True)
+        self.assertEqual(1, config.add_view.count())
+
+
+class Test_single_route(TestCase):
+
+    def _make_app(self, single_route):
+        config = Configurator()
+        config.include('pyramid_restler')
+        context = _dummy_context_factory()
+        config.add_restful_routes(
+            'thing', lambda request: context, view=_RecordingView,
+            batch=True, single_route=single_route)
+        return config.make_wsgi_app()
+
+    def _dispatch(self, app, method, path):
+        status, result = _get_recorded_response(app, path, method=method)
+        if result is None:
+            return status, None
+        result['matchdict'].pop('rest', None)
+        return status, (result['attr'], result['matchdict'])
+
+    def test_one_route_per_entity(self):
+        app = self._make_app(single_route=True)
+        mapper = app.registry.getUtility(IRoutesMapper)
+        self.assertEqual(['thing'], [r.name for r in mapper.get_routes()])
+
+    def test_dispatch(self):
+        app = self._make_app(single_route=True)
+        cases = [
+            ('GET', '/thing', 'get_collection', {}),
+            ('GET', '/thing.json', 'get_collection', {'renderer': 'json'}),
+            ('GET', '/thing/1', 'get_member', {'id': '1'}),
+            ('GET', '/thing/a.b.json', 'get_member',
+             {'id': 'a.b', 'renderer': 'json'}),
+            ('POST', '/thing', 'create_member', {}),
+            ('PUT', '/thing/1.json', 'update_member', {'id': '1.json'}),
+            ('PATCH', '/thing/1', 'patch_member', {'id': '1'}),
+            ('DELETE', '/thing/1', 'delete_member', {'id': '1'}),
+            ('PATCH', '/thing/batch', 'update_members', {}),
+            ('GET', '/thing/batch', 'get_member', {'id': 'batch'}),
+        ]
+        for method, path, attr, matchdict in cases:
+            status, result = self._dispatch(app, method, path)
+            self.assertEqual(result, (attr, matchdict), (method, path))
+
+    def test_same_as_route_per_method(self):
+        apps = [self._make_app(single_route=s) for s in (False, True)]
+        cases = [
+            ('GET', '/thing'), ('GET', '/thing.'), ('GET', '/thing.json'),
+            ('GET', '/things'), ('GET', '/thing/'), ('GET', '/thing/1'),
+            ('GET', '/thing/1.json'), ('GET', '/thing/.json'),
+            ('GET', '/thing/1/x'), ('POST', '/thing'),
+            ('POST', '/thing.json'), ('POST', '/thing/1'),
+            ('PUT', '/thing'), ('PUT', '/thing/1'), ('PATCH', '/thing/1'),
+            ('DELETE', '/thing/1'), ('POST', '/thing/batch'),
+            ('DELETE', '/thing/batch'), ('PUT', '/thing/batch'),
+        ]
+        for method, path in cases:
+            results = [self._dispatch(app, method, path) for app in apps]
+            self.assertEqual(results[0], results[1], (method, path))
+
+
+class Test_add_restful_resources(TestCase):
+
+    def _make_config(self):
+        class Thing(object):
+            def __init__(self, request):
+                pass
+        class OtherThing(Thing):
+            pass
+        config = Configurator()
+        config.include('pyramid_restler')
+        config.add_restful_resources(
+            [('thing', Thing), ('other_thing', OtherThing)], prefix='/api/',
+            view=_RecordingView, batch=True)
+        return config, Thing
+
+    def test_dispatch(self):
+        config, Thing = self._make_config()
+        config.add_restful_resources(
+            {'third_thing': Thing}, prefix='api', view=_RecordingView)
+        app = config.make_wsgi_app()
+        mapper = app.registry.getUtility(IRoutesMapper)
+        self.assertEqual(1, len(mapper.get_routes()))
+        cases = [
+            ('GET', '/api/thing/1', 'get_member', 'Thing'),
+            ('GET', '/api/other-thing.json', 'get_collection', 'OtherThing'),
+            ('PATCH', '/api/other-thing/batch', 'update_members',
+             'OtherThing'),
+            ('DELETE', '/api/third-thing/1', 'delete_member', 'Thing'),
+        ]
+        for method, path, attr, context in cases:
+            status, result = _get_recorded_response(app, path, method=method)
+            self.assertEqual(
+                (result['attr'], result['context']), (attr, context))
+        for path in ('/api/nope', '/api/other_thing', '/thing/1'):
+            status, result = _get_recorded_response(app, path)
+            self.assertEqual(status, 404, path)
+        # third-thing doesn't have batch routes
+        status, result = _get_recorded_response(
+            app, '/api/third-thing/batch', method='PATCH')
+        self.assertEqual(result['attr'], 'patch_member')
+
+    def test_unknown_slugs_fall_through(self):
+        config = Configurator()
+        config.include('pyramid_restler')
+        config.add_restful_resources(
+            [('thing', lambda request: None)], view=_RecordingView)
+        config.add_route('about', '/about')
+        config.add_view(
+            lambda request: Response(json.dumps({'attr': 'about'})),
+            route_name='about')
+        app = config.make_wsgi_app()
+        status, result = _get_recorded_response(app, '/thing/1')
+        self.assertEqual(result['attr'], 'get_member')
+        status, result = _get_recorded_response(app, '/about')
+        self.assertEqual(result['attr'], 'about')
+        status, result = _get_recorded_response(app, '/nope')
+        self.assertEqual(status, 404)
+
+    def test_duplicate_resource(self):
+        config, Thing = self._make_config()
+        config.add_restful_resources(
+            [('thing', Thing)], prefix='api', view=_RecordingView)
+        self.assertRaises(ConfigurationConflictError, config.commit)
+
+    def test_invalid_options(self):
+        config, Thing = self._make_config()
+        add = config.add_restful_resources
+        self.assertRaises(
+            ConfigurationError, add, [('x', Thing)], prefix='api',
+            route_kw={'custom_predicates': ()})
+        self.assertRaises(
+            ConfigurationError, add, [('x', Thing)], prefix='api',
+            view_kw={'http_cache': 60})
+        self.assertRaises(
+            ConfigurationError, add, [('x', Thing)], prefix='other',
+            route_kw={'factory': Thing})
+        # The same options can be passed again
+        add([('x', Thing)], prefix='api', route_kw={}, view_kw={})
+        config.commit()
 
 
 class Test_POST_tunneling(TestCase):
 
-    def _make_app(self):
+    def _make_app(self, tunneling=True, single_route=False):
         config = Configurator()
         config.include('pyramid_restler')
-        config.enable_POST_tunneling()
+        if tunneling:
+            config.enable_POST_tunneling()
+        context = _dummy_context_factory()
+        config.add_restful_routes(
+            'thing', lambda request: context, view=_RecordingView,
+            single_route=single_route)
         return config.make_wsgi_app()
 
+    def _request(self, app, path, **kw):
+        return _get_recorded_response(app, path, method='POST', **kw)
+
     def test_POST_without_tunnel(self):
         app = self._make_app()
-        request = DummyRequest(method='POST')
-        self.assertEqual('POST', request.method)
-        self.assert_('$method' not in request.params)
-        app.registry.notify(NewRequest(request))
-        self.assertEqual('POST', request.method)
-        self.assert_('$method' not in request.params)
-
-    def _assert_before(self, request):
-        self.assertEqual('POST', request.method)
-
-    def _assert_after(self, request, method):
-        self.assertEqual(request.method, method)
-        self.assert_('$method' not in request.GET)
-        self.assert_('$method' not in request.POST)
-        self.assert_('X-HTTP-Method-Override' not in request.headers)
+        status, result = self._request(app, '/thing', POST={'val': 'x'})
+        self.assertEqual(result['attr'], 'create_member')
+        self.assertEqual(result['method'], 'POST')
+        status, result = self._request(app, '/thing/1', POST={'val': 'x'})
+        self.assertEqual(status, 404)
+
+    def _assert_tunneled(self, result, attr, method):
+        self.assertEqual(result['attr'], attr)
+        self.assertEqual(result['method'], method)
+        self.assertTrue('$method' not in result['params'])
+        self.assertEqual(result['override'], None)
 
     def test_PUT_using_GET_param(self):
         app = self._make_app()
-        request = DummyRequest(method='POST')
-        request.GET = {'$method': 'PUT'}
-        request.POST = {'$method': 'DUMMY'}
-        request.headers['X-HTTP-Method-Override'] = 'DUMMY'
-        self._assert_before(request)
-        app.registry.notify(NewRequest(request))
-        self._assert_after(request, 'PUT')
+        status, result = self._request(
+            app, '/thing/1?$method=PUT', POST={'$method': 'DUMMY'},
+            headers={'X-HTTP-Method-Override': 'DUMMY'})
+        self._assert_tunneled(result, 'update_member', 'PUT')
 
     def test_PUT_using_POST_param(self):
         app = self._make_app()
-        request = DummyRequest(method='POST')
-        request.POST = {'$method': 'PUT'}
-        request.headers['X-HTTP-Method-Override'] = 'DUMMY'
-        self._assert_before(request)
-        app.registry.notify(NewRequest(request))
-        self._assert_after(request, 'PUT')
+        status, result = self._request(
+            app, '/thing/1', POST={'$method': 'PUT', 'val': 'x'})
+        self._assert_tunneled(result, 'update_member', 'PUT')
+        self.assertEqual(result['params'], {'val': 'x'})
+        # The body can still be read after the form is parsed.
+        self.assertTrue('val=x' in result['body'])
 
     def test_PUT_using_header(self):
         app = self._make_app()
-        request = DummyRequest(method='POST')
-        request.headers['X-HTTP-Method-Override'] = 'PUT'
-        self._assert_before(request)
-        app.registry.notify(NewRequest(request))
-        self._assert_after(request, 'PUT')
+        status, result = self._request(
+            app, '/thing/1', body=b'{"val": "x"}',
+            content_type='application/json',
+            headers={'X-HTTP-Method-Override': 'PUT'})
+        self._assert_tunneled(result, 'update_member', 'PUT')
+        self.assertEqual(result['body'], '{"val": "x"}')
 
     def test_DELETE_using_POST_param(self):
         app = self._make_app()
-        request = DummyRequest(method='POST')
-        request.POST = {'$method': 'DELETE'}
-        request.headers['X-HTTP-Method-Override'] = 'DUMMY'
-        self._assert_before(request)
-        app.registry.notify(NewRequest(request))
-        self._assert_after(request, 'DELETE')
+        status, result = self._request(
+            app, '/thing/1', POST={'$method': 'DELETE'})
+        self._assert_tunneled(result, 'delete_member', 'DELETE')
+
+    def test_POST_param_is_ignored_for_non_form_body(self):
+        app = self._make_app()
+        status, result = self._request(
+            app, '/thing/1', body=b'{"$method": "PUT"}',
+            content_type='application/json')
+        self.assertEqual(status, 404)
+
+    def test_tunneling_not_enabled(self):
+        app = self._make_app(tunneling=False)
+        status, result = self._request(app, '/thing/1?$method=PUT')
+        self.assertEqual(status, 404)
 
     def test_unknown_method_using_param(self):
         app = self._make_app()
-        request = DummyRequest(params={'$method': 'PANTS'}, method='POST')
-        self._assert_before(request)
-        self.assertRaises(HTTPBadRequest, app.registry.notify, NewRequest(request))
+        status, result = self._request(app, '/thing/1?$method=PANTS')
+        self.assertEqual(status, 400)
+
+    def test_PUT_using_header_with_single_route(self):
+        app = self._make_app(single_route=True)
+        status, result = self._request(
+            app, '/thing/1', headers={'X-HTTP-Method-Override': 'PUT'})
+        self._assert_tunneled(result, 'update_member', 'PUT')
+        status, result = self._request(app, '/thing/1?$method=PANTS')
+        self.assertEqual(status, 400)
+
+    def test_predicate_does_not_modify_request(self):
+        app = self._make_app()
+        mapper = app.registry.getUtility(IRoutesMapper)
+        route = mapper.get_route('update_thing')
+        request = Request.blank(
+            '/thing/1?$method=PUT', method='POST',
+            headers={'X-HTTP-Method-Override': 'PUT'})
+        request.registry = app.registry
+        self.assertTrue(all(p({}, request) for p in route.predicates))
+        self.assertEqual(request.method, 'POST')
+        self.assertEqual(request.GET['$method'], 'PUT')
+        self.assertEqual(request.headers['X-HTTP-Method-Override'], 'PUT')
+        request.GET['$method'] = 'PANTS'
+        # Matches so the request is rejected with a 400 (not a 404)
+        self.assertTrue(all(p({}, request) for p in route.predicates))
+
+    def test_predicate_is_not_used_for_GET_routes(self):
+        app = self._make_app()
+        mapper = app.registry.getUtility(IRoutesMapper)
+        for route in mapper.get_routes():
+            predicates = [p.text() for p in route.predicates]
+            tunneled = any(p.startswith('tunneled_method') for p in predicates)
+            self.assertEqual(
+                tunneled,
+                route.name in ('update_thing', 'patch_thing', 'delete_thing'))
+
+
+class _RecordingView(object):
+
+    """Responds with the view attr called and the request it was given."""
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    def __getattr__(self, name):
+        def view():
+            request = self.request
+            body = json.dumps(dict(
+                attr=name, context=self.context.__class__.__name__,
+                method=request.method,
+                matchdict=dict(request.matchdict),
+                params=dict(request.params),
+                override=request.headers.get('X-HTTP-Method-Override'),
+                body=request.body.decode('utf-8')))
+            return Response(
+                body.encode('utf-8'), content_type='application/json')
+        return view
+
+
+def _get_recorded_response(app, path, **kw):
+    response = Request.blank(path, **kw).get_response(app)
+    if response.status_int == 200:
+        return response.status_int, json.loads(response.text)
+    return response.status_int, None
 
 
 def _dummy_context_factory():
@@ -406,6 +1973,9 @@ def _dummy_context_factory():
                 member[name] = data[name]
             return member
 
+        def patch_member(self, id, data, version=None):
+            return self.update_member(id, data)
+
         def delete_member(self, id):
             for i, m in enumerate(self._collection):
                 if m['id'] == id:
@@ -0,0 +1,55 @@
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+#: The WSGI environ key holding the sessions with deferred commits.
+deferred_commits_key = 'pyramid_restler.deferred_commits'
+
+
+def deferred_commit_tween_factory(handler, registry):
+    """Commit the sessions of contexts using the 'deferred' strategy.
+
+    Contexts with a 'deferred' `commit_strategy` add their sessions to
+    ``request.environ[deferred_commits_key]`` instead of committing them.
+    Once the view (and any exception view) has returned, this commits them
+    if the response is successful (i.e., its status is less than 400) or
+    rolls them back if it isn't or if an exception was raised.
+
+    This is added under the exception view tween by `includeme`, so if a
+    commit fails, the remaining sessions are rolled back and the error is
+    rendered by an exception view rather than escaping after a success
+    response has already been created.
+
+    """
+    def deferred_commit_tween(request):
+        sessions = request.environ[deferred_commits_key] = []
+        try:
+            response = handler(request)
+        except Exception:
+            rollback(sessions)
+            raise
+        if response.status_int >= 400:
+            rollback(sessions)
+            return response
+        while sessions:
+            session = sessions.pop(0)
+            try:
+                session.commit()
+            except Exception:
+                session.rollback()
+                rollback(sessions)
+                raise
+        return response
+
+    return deferred_commit_tween
+
+
+def rollback(sessions):
+    while sessions:
+        session = sessions.pop(0)
+        try:
+            session.rollback()
+        except Exception:
+            log.exception('Could not roll back %r', session)
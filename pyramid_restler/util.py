@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+class LRUCache(object):
+    """A bounded, thread safe mapping that evicts least recently used items.
+
+    ``maxsize`` is the maximum number of items that will be kept.
+
+    The numbers of cache hits and misses are counted; see :meth:`stats`.
+
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Get a dict with the cache's hits, misses, size, and maxsize."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._data),
+            maxsize=self.maxsize,
+        )
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ClosingIterator(object):
+    """Iterates over ``iterable`` and calls ``close`` when it's closed.
+
+    WSGI servers call the ``close`` method of a response's ``app_iter``
+    once the body has been sent (or the client has gone away), so this is
+    used to hold resources that a streamed body needs until then.
+    ``iterable`` is closed first, if it has a ``close`` method, and
+    ``close`` is only called once.
+
+    """
+
+    def __init__(self, iterable, close):
+        self.iterable = iterable
+        self._close = close
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        close, self._close = self._close, None
+        if close is None:
+            return
+        try:
+            iterable_close = getattr(self.iterable, 'close', None)
+            if iterable_close is not None:
+                iterable_close()
+        finally:
+            close()
+
+
+class TTLCache(LRUCache):
+    """An :class:`LRUCache` whose items expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=128, ttl=30):
+        super(TTLCache, self).__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        item = super(TTLCache, self).get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < time.time():
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+                self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value):
+        item = (time.time() + self.ttl, value)
+        super(TTLCache, self).set(key, item)
@@ -1,92 +1,710 @@
+import datetime
+from functools import partial
+import hashlib
 import json
 
+from pyramid.compat import string_types
 from pyramid.decorator import reify
-from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid.httpexceptions import (
+    HTTPBadRequest, HTTPConflict, HTTPNotAcceptable, HTTPNotFound,
+    HTTPNotModified, HTTPPreconditionFailed)
 from pyramid.response import Response
 
+from webob.datetime_utils import UTC, parse_date
+from webob.etag import ETagMatcher
+
 from zope.interface import implementer
 
-from pyramid_restler.interfaces import IView
+from pyramid_restler.compression import (
+    compress, compress_iter, compressors, negotiate_encoding)
+from pyramid_restler.exceptions import (
+    IntegrityConflict, InvalidQuery, VersionConflict)
+from pyramid_restler.interfaces import IResponseCache, IView
+from pyramid_restler.jsonlib import get_request_json_backend
+from pyramid_restler.util import LRUCache
 
 @implementer(IView)
 class RESTfulView(object):
 
+    default_stream = False
+
+    hash_etags = True
+
+    format_renderers = {
+        'columnar': 'cjson',
+    }
+
+    renderer_media_types = (
+        ('json', ('application/json',)),
+        ('msgpack', ('application/msgpack', 'application/x-msgpack')),
+        ('arrow', ('application/vnd.apache.arrow.stream',)),
+        ('csv', ('text/csv',)),
+        ('ndjson', ('application/x-ndjson',)),
+    )
+
+    renderer_context_methods = {
+        'msgpack': 'to_msgpack',
+        'arrow': 'to_arrow',
+        'csv': 'to_csv_iter',
+        'ndjson': 'to_ndjson_iter',
+    }
+
+    negotiation_cache = LRUCache(maxsize=256)
+
+    streaming_renderers = ('csv', 'ndjson')
+
+    compress_encodings = ('br', 'gzip', 'deflate')
+
+    compress_min_size = 1024
+
+    compress_level = None
+
+    compressible_types = (
+        'application/json',
+        'application/msgpack',
+        'application/x-ndjson',
+        'text/csv',
+    )
+
     def __init__(self, context, request):
         self.context = context
         self.request = request
 
     def get_collection(self):
+        cached_response = self.get_cached_response()
+        if cached_response is not None:
+            return cached_response
+        try:
+            kwargs = self.get_collection_kwargs()
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        try:
+            if self.stream and hasattr(self.context, 'get_collection_query'):
+                collection = self.context.get_collection_query(**kwargs)
+            else:
+                collection = self.context.get_collection(**kwargs)
+        except InvalidQuery as exc:
+            raise HTTPBadRequest(str(exc))
+        return self.cache_response(self.render_to_response(collection))
+
+    def get_collection_kwargs(self):
+        """Get the keyword args for the context's `get_collection` method.
+
+        These come from the $$ query parameter along with $fields, $count,
+        and $embed. A `ValueError` is raised if any of them is invalid.
+
+        """
         kwargs = self.request.params.get('$$', {})
         if kwargs:
-            kwargs = json.loads(kwargs)
-        collection = self.context.get_collection(**kwargs)
-        return self.render_to_response(collection)
+            kwargs = self.json_backend.loads(kwargs)
+        if self.fields is not None:
+            kwargs.setdefault('fields', self.fields)
+        if self.count != 'none':
+            kwargs.setdefault('count', self.count)
+        if self.embed is not None:
+            kwargs.setdefault('embed', self.embed)
+        return kwargs
 
     def get_member(self):
         id = self.request.matchdict['id']
-        member = self.context.get_member(id)
-        return self.render_to_response(member)
+        cached_response = self.get_cached_response(id)
+        if cached_response is not None:
+            return cached_response
+        try:
+            embed = self.embed
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        try:
+            if embed is None:
+                member = self.context.get_member(id)
+            else:
+                member = self.context.get_member(id, embed=embed)
+        except InvalidQuery as exc:
+            raise HTTPBadRequest(str(exc))
+        return self.cache_response(self.render_to_response(member), id)
 
     def _get_data(self):
         content_type = self.request.content_type
         if content_type == 'application/json':
-            data = json.loads(self.request.body)
+            data = self.json_backend.loads(self.request.body)
         elif content_type == 'application/x-www-form-urlencoded':
             data = dict(self.request.POST)
         return data
 
     def create_member(self):
         member = self.context.create_member(self._get_data())
+        self.invalidate_cached_responses()
         id = self.context.get_member_id_as_string(member)
         headers = {'Location': '/'.join((self.request.path, id))}
         return Response(status=201, headers=headers)
 
     def update_member(self):
         id = self.request.matchdict['id']
-        member = self.context.update_member(id, self._get_data())
+        data = self._get_data()
+        try:
+            member = self.context.update_member(id, data)
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        self.invalidate_cached_responses(id)
         if member is None:
-            member = self.context.create_member(self._get_data())
+            member = self.context.create_member(data)
             headers = {'Location': self.request.path}
             return Response(status=201, headers=headers)
         else:
             return Response(status=204, content_type='')
 
+    def patch_member(self):
+        id = self.request.matchdict['id']
+        data = self._get_data()
+        try:
+            if self.if_match_version is None:
+                member = self.context.patch_member(id, data)
+            else:
+                member = self.context.patch_member(
+                    id, data, version=self.if_match_version)
+        except VersionConflict:
+            raise HTTPPreconditionFailed()
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        if member is None:
+            if 'If-Match' in self.request.headers:
+                raise HTTPPreconditionFailed()
+            raise HTTPNotFound(self.context)
+        if getattr(self.context, 'changed_fields', True):
+            self.invalidate_cached_responses(id)
+        return Response(status=204, content_type='')
+
     def delete_member(self):
         id = self.request.matchdict['id']
         member = self.context.delete_member(id)
         if member is None:
             raise HTTPNotFound(self.context)
+        self.invalidate_cached_responses(id)
         return Response(status=204, content_type='')
 
+    def create_members(self):
+        data = self._get_batch_data()
+        if not isinstance(data, list):
+            raise HTTPBadRequest('Expected a JSON array of members.')
+        try:
+            results = self.context.create_members(data)
+        except IntegrityConflict as exc:
+            raise HTTPConflict(str(exc))
+        self.invalidate_cached_responses()
+        return self._batch_response(
+            dict(results=results, result_count=len(results)))
+
+    def update_members(self):
+        data = self._get_batch_data()
+        if not (isinstance(data, dict) and 'ids' in data and 'data' in data):
+            raise HTTPBadRequest(
+                'Expected a JSON object with "ids" and "data" keys.')
+        ids = self._get_batch_ids(data)
+        changes = self._get_batch_changes(data)
+        try:
+            count = self.context.update_members(ids, changes)
+        except ValueError as exc:
+            raise HTTPBadRequest(str(exc))
+        self.invalidate_all_cached_responses()
+        return self._batch_response(dict(result_count=count))
+
+    def delete_members(self):
+        data = self._get_batch_data()
+        if not (isinstance(data, dict) and 'ids' in data):
+            raise HTTPBadRequest('Expected a JSON object with an "ids" key.')
+        count = self.context.delete_members(self._get_batch_ids(data))
+        self.invalidate_all_cached_responses()
+        return self._batch_response(dict(result_count=count))
+
+    def _get_batch_data(self):
+        if self.request.content_type != 'application/json':
+            raise HTTPBadRequest('Batch requests must contain JSON.')
+        try:
+            return self.json_backend.loads(self.request.body)
+        except ValueError:
+            raise HTTPBadRequest('Could not decode JSON.')
+
+    def _get_batch_ids(self, data):
+        ids = data['ids']
+        if not isinstance(ids, list):
+            raise HTTPBadRequest('"ids" must be a JSON array.')
+        return ids
+
+    def _get_batch_changes(self, data):
+        changes = data['data']
+        if not (isinstance(changes, dict) and
+                all(isinstance(k, string_types) for k in changes)):
+            raise HTTPBadRequest('"data" must be a JSON object.')
+        return changes
+
+    def _batch_response(self, obj):
+        default = getattr(self.context, 'json_default', None)
+        body = self.json_backend.dumps(obj, default)
+        return Response(body=body, content_type='application/json')
+
+    @reify
+    def if_match_version(self):
+        """The member version from the If-Match header, if any.
+
+        For PATCH requests, clients can send back the ETag of any
+        representation of the member (as returned by :meth:`get_validators`)
+        to make the update conditional. The ETag's version part is compared
+        to the member's current version. A missing header or ``*`` means no
+        version is expected.
+
+        """
+        header = self.request.headers.get('If-Match')
+        if not header or header.strip() == '*':
+            return None
+        etags = ETagMatcher.parse(header).etags
+        if len(etags) != 1:
+            raise HTTPBadRequest('If-Match must contain a single version.')
+        return etags[0].split('-', 1)[0]
+
+    @reify
+    def json_backend(self):
+        """The :class:`IJSONBackend` used to decode request data."""
+        return get_request_json_backend(self.request)
+
+    @reify
+    def response_cache(self):
+        """The :class:`IResponseCache` for the app or ``None``."""
+        registry = getattr(self.request, 'registry', None)
+        if registry is None:
+            return None
+        return registry.queryUtility(IResponseCache)
+
+    @reify
+    def cache_namespace(self):
+        """Namespace for cached responses; derived from the entity."""
+        obj = getattr(self.context, 'entity', None) or self.context.__class__
+        return '{0}.{1}'.format(obj.__module__, obj.__name__)
+
+    @reify
+    def cache_key(self):
+        """Identifies the requested representation in the response cache.
+
+        This doesn't include the content coding, since whether a response
+        is compressed is only known once it's rendered; see
+        :meth:`get_cache_key`.
+
+        """
+        request = self.request
+        params = request.params
+        kwargs = params.get('$$')
+        if kwargs:
+            try:
+                kwargs = json.loads(kwargs)
+            except ValueError:
+                pass
+        route = getattr(request, 'matched_route', None)
+        route_name = request.path if route is None else route.name
+        matchdict = sorted((request.matchdict or {}).items())
+        key = [
+            route_name, matchdict, kwargs, params.get('$fields'),
+            params.get('$embed'), self.wrap, self.count,
+            self.determine_renderer(),
+        ]
+        return json.dumps(key, sort_keys=True)
+
+    def get_cache_key(self, content_encoding):
+        """Get the cache key for a response with ``content_encoding``."""
+        if content_encoding is None:
+            return self.cache_key
+        return '{0}-{1}'.format(self.cache_key, content_encoding)
+
+    def get_cached_response(self, member_id=None):
+        cache = self.response_cache
+        if cache is None or self.stream or '$embed' in self.request.params:
+            return None
+        namespace = self.cache_namespace
+        member_id = None if member_id is None else str(member_id)
+        encoding = self.content_encoding
+        response = None
+        if encoding is not None:
+            response = cache.get(
+                namespace, self.get_cache_key(encoding), member_id)
+        if response is None:
+            response = cache.get(namespace, self.cache_key, member_id)
+            if response is None:
+                return None
+            if encoding is not None and self.is_compressible(response):
+                # This was cached for a client that didn't accept the
+                # negotiated coding, so it has to be rendered again.
+                return None
+        if self.is_not_modified(response.etag, response.last_modified):
+            compressible = 'Accept-Encoding' in (response.vary or ())
+            return self.not_modified(
+                response.etag, response.last_modified, compressible)
+        return response
+
+    def cache_response(self, response, member_id=None):
+        """Cache ``response`` if caching is enabled; return ``response``.
+
+        Responses that include embedded members aren't cached, since
+        they're only invalidated by writes to the view's own entity (see
+        :attr:`cache_namespace`), not by writes to the related entities.
+
+        """
+        cache = self.response_cache
+        cacheable = (
+            cache is not None and
+            response.status_int == 200 and
+            not self.stream and
+            self.request.method == 'GET' and
+            '$embed' not in self.request.params and
+            not getattr(self.context, 'embedded', None))
+        if cacheable:
+            cache.set(
+                self.cache_namespace,
+                self.get_cache_key(response.content_encoding), response,
+                None if member_id is None else str(member_id))
+        return response
+
+    def invalidate_all_cached_responses(self):
+        cache = self.response_cache
+        if cache is not None:
+            self.after_commit(partial(
+                cache.invalidate, self.cache_namespace, all_members=True))
+
+    def invalidate_cached_responses(self, member_id=None):
+        cache = self.response_cache
+        if cache is not None:
+            self.after_commit(partial(
+                cache.invalidate, self.cache_namespace,
+                None if member_id is None else str(member_id)))
+
+    def after_commit(self, callback):
+        """Call ``callback`` once the context's writes are committed.
+
+        This defers to the context's `after_commit` method, if it has one,
+        so cached responses aren't invalidated before the new data is
+        visible to other requests. Otherwise, ``callback`` is called right
+        away.
+
+        """
+        after_commit = getattr(self.context, 'after_commit', None)
+        if after_commit is None:
+            callback()
+        else:
+            after_commit(callback)
+
     def render_to_response(self, value, fields=None):
         if value is None:
             raise HTTPNotFound(self.context)
-        renderer = self.determine_renderer()
+        renderer_name = self.determine_renderer()
         try:
-            renderer = getattr(self, 'render_{0}'.format(renderer))
-        except AttributeError:
+            renderer = self.get_renderer_table()[0][renderer_name]
+        except KeyError:
             name = self.__class__.__name__
             raise HTTPBadRequest(
-                '{0} view has no renderer "{1}".'.format(name, renderer))
-        return Response(**renderer(value))
+                '{0} view has no renderer "{1}".'.format(name, renderer_name))
+        renderer = renderer.__get__(self)
+        etag, last_modified = self.get_validators(value, renderer_name)
+        if etag is not None:
+            # The body hasn't been rendered yet, so it isn't known whether
+            # it will be compressed. Since the same version and options
+            # always render the same body, either ETag identifies it.
+            etags = [etag]
+            if self.content_encoding is not None:
+                etags.append('{0}-{1}'.format(etag, self.content_encoding))
+            for candidate in etags:
+                if self.is_not_modified(candidate, last_modified):
+                    return self.not_modified(
+                        candidate, last_modified, candidate != etag)
+        elif self.is_not_modified(None, last_modified):
+            return self.not_modified(None, last_modified)
+        response = Response(**renderer(value))
+        encoding = self.get_response_encoding(response)
+        if etag is None and self.hash_etags and not self.stream:
+            response.md5_etag()
+            etag = response.etag
+            if encoding is not None:
+                # Each content coding is a different representation.
+                response.etag = '{0}-{1}'.format(etag, encoding)
+            if self.is_not_modified(response.etag, None):
+                return self.not_modified(
+                    response.etag, last_modified,
+                    self.is_compressible(response))
+        elif etag is not None:
+            if encoding is not None:
+                etag = '{0}-{1}'.format(etag, encoding)
+            response.etag = etag
+        if last_modified is not None:
+            response.last_modified = last_modified
+        return self.compress_response(response, encoding)
+
+    def is_compressible(self, response):
+        """Check whether ``response`` is compressed for accepting clients.
+
+        Responses are compressible when their content type is one of
+        :attr:`compressible_types` and their body is at least
+        :attr:`compress_min_size` bytes. Streamed bodies are compressed
+        regardless of size.
+
+        """
+        if response.status_int != 200 or response.content_encoding:
+            return False
+        if response.content_type not in self.compressible_types:
+            return False
+        length = response.content_length
+        return length is None or length >= self.compress_min_size
+
+    def get_response_encoding(self, response):
+        """Get the content coding ``response`` will be compressed with.
+
+        This is the negotiated :attr:`content_encoding` if ``response`` is
+        compressible or ``None`` if it will be left as is.
+
+        """
+        if not self.is_compressible(response):
+            return None
+        return self.content_encoding
+
+    def compress_response(self, response, encoding):
+        """Compress ``response`` using ``encoding``.
+
+        ``encoding`` comes from :meth:`get_response_encoding` and is
+        ``None`` if ``response`` shouldn't be compressed. Since compression
+        happens before responses are cached, compressed variants are stored
+        in the response cache too (see :meth:`get_cache_key`).
+
+        """
+        if self.compress_encodings and self.is_compressible(response):
+            response.vary = tuple(response.vary or ()) + ('Accept-Encoding',)
+        if encoding is None:
+            return response
+        level = self.compress_level
+        if response.content_length is None:
+            # The body is streamed, so its size isn't known.
+            response.app_iter = compress_iter(
+                response.app_iter, encoding, level)
+        else:
+            response.body = compress(response.body, encoding, level)
+        response.content_encoding = encoding
+        return response
+
+    @reify
+    def content_encoding(self):
+        """The content coding negotiated from the Accept-Encoding header.
+
+        This is ``None`` if the client doesn't accept any of the available
+        codings. Responses that aren't compressible are left uncompressed
+        either way (see :meth:`get_response_encoding`).
+
+        """
+        offers = [e for e in self.compress_encodings if e in compressors]
+        if not offers:
+            return None
+        accept_encoding = self.request.headers.get('Accept-Encoding')
+        return negotiate_encoding(accept_encoding, offers)
+
+    def get_validators(self, value, renderer_name):
+        """Get the ETag and Last-Modified validators for ``value``.
+
+        These come from the context's `get_validators` method, if it has
+        one. Since the ETag must differ for each representation of
+        ``value``, it's the context's version followed by a hash of the
+        renderer and representation options, i.e. ``{version}-{hash}``, so
+        the version can be recovered from an If-Match header. If the
+        response is compressed, `render_to_response` appends the content
+        coding to the ETag. When the context can't provide a version, the
+        ETag will instead be computed by hashing the response body (if
+        :attr:`hash_etags` is set).
+
+        """
+        if not hasattr(self.context, 'get_validators'):
+            return None, None
+        version, last_modified = self.context.get_validators(value)
+        etag = None
+        if version is not None:
+            data = json.dumps([
+                renderer_name, self.fields, self.embed, self.wrap,
+            ], sort_keys=True)
+            etag = '{0}-{1}'.format(
+                version, hashlib.md5(data.encode('utf-8')).hexdigest())
+        if isinstance(last_modified, datetime.datetime):
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=UTC)
+            # HTTP dates have a resolution of one second
+            last_modified = last_modified.replace(microsecond=0)
+        else:
+            last_modified = None
+        return etag, last_modified
+
+    def is_not_modified(self, etag, last_modified):
+        """Check the request's conditional headers against validators."""
+        request = self.request
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        headers = request.headers
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            if etag is None:
+                return False
+            return etag in ETagMatcher.parse(if_none_match, strong=False)
+        if_modified_since = parse_date(headers.get('If-Modified-Since'))
+        if last_modified is not None and if_modified_since is not None:
+            return last_modified <= if_modified_since
+        return False
+
+    def not_modified(self, etag, last_modified, compressible=False):
+        response = HTTPNotModified()
+        if self.compress_encodings and compressible:
+            response.vary = ('Accept-Encoding',)
+        if etag is not None:
+            response.etag = etag
+        if last_modified is not None:
+            response.last_modified = last_modified
+        return response
+
+    @classmethod
+    def get_renderer_table(cls):
+        """Get the renderers available for this view class.
+
+        Returns a `dict` that maps renderer names to `render_{name}`
+        methods and a list of ``(media type, name)`` pairs in order of
+        preference (from :attr:`renderer_media_types`) for content
+        negotiation. The table is built once per class.
+
+        """
+        table = cls.__dict__.get('_renderer_table')
+        if table is None:
+            renderers = {}
+            for attr in dir(cls):
+                if attr.startswith('render_') and attr != 'render_to_response':
+                    renderers[attr[7:]] = getattr(cls, attr)
+            offers = [
+                (media_type, name)
+                for name, media_types in cls.renderer_media_types
+                for media_type in media_types
+                if name in renderers]
+            table = cls._renderer_table = (renderers, offers)
+        return table
 
     def determine_renderer(self):
+        """Determine the name of the renderer to use for the request.
+
+        A {.renderer} suffix takes precedence, then the $format query
+        parameter, and then the Accept header. Negotiated renderers are
+        cached by Accept header in :attr:`negotiation_cache`. If no
+        available renderer is acceptable, a 406 is raised.
+
+        """
         request = self.request
         renderer = (request.matchdict or {}).get('renderer', '').lstrip('.')
         if renderer:
             return renderer
-        if request.accept.best_match(['application/json']):
-            return 'json'
-        elif request.accept.best_match(['application/xml']):
-            return 'xml'
+        format = request.params.get('$format')
+        if format:
+            return self.format_renderers.get(format, format)
+        accept = request.accept
+        key = (self.__class__, self.context.__class__, str(accept))
+        renderer = self.negotiation_cache.get(key)
+        if renderer is None:
+            renderer = self.negotiate_renderer(accept)
+            if renderer is None:
+                raise HTTPNotAcceptable()
+            self.negotiation_cache.set(key, renderer)
+        return renderer
+
+    def negotiate_renderer(self, accept):
+        """Choose the renderer whose media type ``accept`` prefers.
+
+        Only renderers that can produce output for the context are offered:
+        those listed in :attr:`renderer_context_methods` are skipped when
+        the context doesn't have the corresponding method (or it's
+        ``None``, e.g. because an optional package isn't installed). When
+        quality values tie (e.g., when offers only match */*), the first
+        offer in :attr:`renderer_media_types` (JSON) wins. Returns ``None``
+        if no offer is acceptable.
+
+        """
+        offers = self.get_renderer_table()[1]
+        context = self.context
+        methods = self.renderer_context_methods
+        offers = [
+            (media_type, name) for (media_type, name) in offers
+            if name not in methods or
+            getattr(context, methods[name], None) is not None]
+        if not offers:
+            return None
+        if not accept:
+            return offers[0][1]
+        best = None
+        best_quality = 0
+        for media_type, name in offers:
+            quality = accept.quality(media_type)
+            if quality and quality > best_quality:
+                best, best_quality = name, quality
+        return best
 
     def render_json(self, value):
+        return self._render_json(value)
+
+    def render_cjson(self, value):
+        """Render columnar JSON (see the context's `to_json` method)."""
+        return self._render_json(value, columnar=True)
+
+    def _render_json(self, value, columnar=False):
+        # Contexts that don't support columnar output can still render JSON.
+        kwargs = {'columnar': True} if columnar else {}
+        if self.stream and hasattr(self.context, 'to_json_iter'):
+            return dict(
+                app_iter=self.context.to_json_iter(
+                    value, self.fields, self.wrap, **kwargs),
+                content_type='application/json',
+            )
+        body = self.context.to_json(value, self.fields, self.wrap, **kwargs)
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
         response_data = dict(
-            body=self.context.to_json(value, self.fields, self.wrap),
+            body=body,
             content_type='application/json',
         )
         return response_data
 
+    def render_msgpack(self, value):
+        """Render MessagePack (requires msgpack).
+
+        The structure is the same as for JSON, including columnar output
+        when $format=columnar is also passed.
+
+        """
+        to_msgpack = getattr(self.context, 'to_msgpack', None)
+        if to_msgpack is None:
+            raise HTTPBadRequest('MessagePack renderer not available.')
+        columnar = self.request.params.get('$format') == 'columnar'
+        body = to_msgpack(value, self.fields, self.wrap, columnar=columnar)
+        return dict(body=body, content_type='application/msgpack')
+
+    def render_arrow(self, value):
+        """Render an Apache Arrow IPC stream (requires pyarrow)."""
+        to_arrow = getattr(self.context, 'to_arrow', None)
+        if to_arrow is None:
+            raise HTTPBadRequest('Arrow renderer not available.')
+        body = to_arrow(value, self.fields, self.wrap)
+        return dict(
+            body=body, content_type='application/vnd.apache.arrow.stream')
+
+    def render_csv(self, value):
+        """Render CSV; the body is always streamed."""
+        to_csv_iter = getattr(self.context, 'to_csv_iter', None)
+        if to_csv_iter is None:
+            raise HTTPBadRequest('CSV renderer not available.')
+        return dict(
+            app_iter=to_csv_iter(value, self.fields),
+            content_type='text/csv', charset='utf-8')
+
+    def render_ndjson(self, value):
+        """Render newline delimited JSON; the body is always streamed."""
+        to_ndjson_iter = getattr(self.context, 'to_ndjson_iter', None)
+        if to_ndjson_iter is None:
+            raise HTTPBadRequest('NDJSON renderer not available.')
+        return dict(
+            app_iter=to_ndjson_iter(value, self.fields),
+            content_type='application/x-ndjson')
+
     def render_xml(self, value):
         raise HTTPBadRequest('XML renderer not implemented.')
 
@@ -94,10 +712,62 @@ class RESTfulView(object):
     def fields(self):
         fields = self.request.params.get('$fields', None)
         if fields is not None:
-            fields = json.loads(fields)
+            fields = self.json_backend.loads(fields)
         return fields
 
+    @reify
+    def embed(self):
+        """Relationships to embed in each member as nested objects.
+
+        This is specified via the $embed query parameter as a JSON list of
+        relationship names. The context decides which relationships can be
+        embedded.
+
+        """
+        embed = self.request.params.get('$embed', None)
+        if embed is not None:
+            embed = self.json_backend.loads(embed)
+            if not isinstance(embed, list):
+                raise ValueError('$embed must be a list of names')
+        return embed
+
     @reify
     def wrap(self):
         wrap = self.request.params.get('$wrap', 'true').strip().lower()
         return wrap in ('1', 'true')
+
+    @reify
+    def count(self):
+        """How to count the total number of members in a collection.
+
+        This is specified via the $count query parameter; it can be
+        'none' (the default), 'exact', or 'estimated'.
+
+        """
+        count = self.request.params.get('$count', 'none').strip().lower()
+        if count not in ('none', 'exact', 'estimated'):
+            raise HTTPBadRequest('Unknown $count: {0}.'.format(count))
+        return count
+
+    @reify
+    def stream(self):
+        """Whether the response body should be streamed.
+
+        This can be set per request via the $stream query parameter. When
+        $stream isn't present, :attr:`default_stream` is used; set that
+        in a subclass to stream by default for the routes using it.
+
+        Streaming only happens when the context supports it (i.e., when it
+        has `get_collection_query` and `to_json_iter` methods).
+
+        Responses rendered by :attr:`streaming_renderers` (CSV and NDJSON
+        by default) are streamed unless $stream is explicitly disabled,
+        since they're typically used to export entire collections.
+
+        """
+        stream = self.request.params.get('$stream', None)
+        if stream is None:
+            if self.determine_renderer() in self.streaming_renderers:
+                return True
+            return self.default_stream
+        return stream.strip().lower() in ('1', 'true')
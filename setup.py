@@ -13,14 +13,15 @@ setup(
     keywords='Web REST Pylons Pyramid',
     url='https://github.com/wylee/pyramid_restler',
     install_requires=(
-        'pyramid>=1.3',
+        'pyramid>=1.4',
     ),
     extras_require=dict(
         dev=(
+            'aiosqlite>=0.17; python_version >= "3.7"',
             'coverage>=4.1',
             'repoze.sphinx.autointerface>=0.8',
             'Sphinx>=1.4.1',
-            'SQLAlchemy>=1.0.13',
+            'SQLAlchemy>=1.3',
             'psycopg2>=2.6.1',
             'waitress>=0.9.0',
         ),
@@ -32,7 +33,6 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
     ),